@@ -1,5 +1,9 @@
 from .constants import *
 from .llm_models import *
+from .metrics import *
+from .scheduler import *
+from .state import *
+from .storage import *
 from .telegram_bot import *
 from .telegram_bot.bot_core import *
 from .utils import *
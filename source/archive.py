@@ -0,0 +1,140 @@
+"""Export the chat archive or replay archived traffic against fake backends.
+
+    python source/archive.py export --from 20240101 --to 20240131 -o chats.jsonl
+    python source/archive.py export --chat 42 --role user --format parquet -o 42.parquet
+    python source/archive.py replay --day 20240115 --speed 10
+
+Objects and records are streamed one at a time, so memory use does not grow
+with the size of the archive.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+
+def _day(text: str):
+    return datetime.strptime(text, "%Y%m%d").date()
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["export", "replay"])
+    parser.add_argument(
+        "--source",
+        choices=["s3", "fs"],
+        default=os.environ.get("ARCHIVE_BACKEND", "s3"),
+        help="where the archive is, ARCHIVE_BACKEND by default",
+    )
+    parser.add_argument(
+        "--dir",
+        default=os.environ.get("ARCHIVE_DIR", "archive"),
+        help="archive directory of the fs source",
+    )
+    parser.add_argument(
+        "--bot",
+        default=os.environ.get("BOT_NAME"),
+        help="BOT_NAME the archive was written by",
+    )
+    parser.add_argument("--from", dest="start", type=_day, help="first day, YYYYMMDD")
+    parser.add_argument("--to", dest="end", type=_day, help="last day, YYYYMMDD")
+    parser.add_argument("--day", type=_day, help="same as --from DAY --to DAY")
+    parser.add_argument(
+        "--chat", type=int, action="append", help="chat id, can be repeated"
+    )
+    parser.add_argument("--type", action="append", choices=["text", "image"])
+    parser.add_argument(
+        "--role", action="append", choices=["system", "user", "assistant"]
+    )
+    parser.add_argument(
+        "--format", choices=["jsonl", "csv", "parquet"], default="jsonl"
+    )
+    parser.add_argument("-o", "--output", help="export file")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0.0,
+        help="replay this many times faster than recorded, 0 sends at once",
+    )
+    parser.add_argument(
+        "--max-pending", type=int, default=1000, help="replayed turns in flight"
+    )
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(args)
+    if args.day:
+        args.start = args.end = args.day
+    if args.command == "export" and not args.output:
+        parser.error("export needs --output")
+    if not args.bot:
+        parser.error("set --bot or BOT_NAME")
+    return args
+
+
+def read_records(args):
+    """Filtered archive records, one at a time."""
+    from storage import create_backend
+    from storage.archive_reader import RecordFilter, iter_objects, iter_records
+
+    backend = create_backend(args.source, args.dir)
+    if backend is None:
+        raise SystemExit(f"archive source {args.source} is not available")
+    # keys only give the day a part was written, check every record too
+    start = end = None
+    if args.start:
+        start = datetime.combine(args.start, datetime.min.time())
+    if args.end:
+        end = datetime.combine(args.end + timedelta(days=1), datetime.min.time())
+    keep = RecordFilter(
+        chat_ids=set(args.chat) if args.chat else None,
+        types=set(args.type) if args.type else None,
+        roles=set(args.role) if args.role else None,
+        start=start,
+        end=end,
+    )
+    keys = iter_objects(backend, f"{args.bot}/", args.start, args.end)
+    return filter(keep, iter_records(backend, keys))
+
+
+def export(args):
+    from storage.archive_export import WRITERS, export_records
+
+    with WRITERS[args.format](args.output) as writer:
+        count = export_records(read_records(args), writer)
+    print(f"exported {count} records to {args.output}")
+
+
+def replay(args):
+    from benchmark import BotBenchmark, FakeOpenAIConfig, archived_turns
+
+    # per turn logging would dominate the measurements
+    logging.disable(logging.WARNING)
+    # points the bot at the fakes, before the bot modules are imported
+    bench = BotBenchmark(
+        FakeOpenAIConfig(latency=args.latency, image_latency=args.image_latency),
+        telegram_latency=args.telegram_latency,
+    )
+    turns = archived_turns(read_records(args))
+    report = asyncio.run(
+        bench.replay("replay", turns, args.speed, max_pending=args.max_pending)
+    )
+    if args.json:
+        print(json.dumps(report.as_dict()))
+    else:
+        print(report.format())
+
+
+def main(args=None):
+    args = parse_args(args)
+    if args.command == "export":
+        export(args)
+    else:
+        replay(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Offline benchmarks of the bot against fake Telegram, OpenAI and S3 backends.
+
+    python source/bench.py chat --chats 1000 --turns 3
+    python source/bench.py images --chats 200 --error-rate 0.05
+    python source/bench.py history
+    python source/bench.py archive --messages 100000
+    python source/bench.py startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+
+from benchmark import (
+    BotBenchmark,
+    FakeOpenAIConfig,
+    archive_benchmark,
+    chat_turn,
+    configure_environment,
+    history_benchmark,
+    image_turn,
+    startup_benchmark,
+)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "scenario",
+        choices=["chat", "images", "history", "archive", "startup"],
+        help="what to run",
+    )
+    parser.add_argument("--chats", type=int, default=1000, help="concurrent chats")
+    parser.add_argument("--turns", type=int, default=3, help="turns per chat")
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="seconds to the first token"
+    )
+    parser.add_argument(
+        "--token-delay", type=float, default=0.01, help="seconds between tokens"
+    )
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument(
+        "--image-latency", type=float, default=1.0, help="seconds per image call"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of OpenAI calls given a 429",
+    )
+    parser.add_argument(
+        "--telegram-latency", type=float, default=0.05, help="seconds per Bot API call"
+    )
+    parser.add_argument("--no-stream", action="store_true", help="disable streaming")
+    parser.add_argument(
+        "--no-rate-limits",
+        action="store_true",
+        help="turn off the scheduler's RPM and TPM limits",
+    )
+    parser.add_argument(
+        "--no-tracemalloc",
+        action="store_true",
+        help="skip memory tracing, which slows the run down",
+    )
+    parser.add_argument("--messages", type=int, default=100000, help="archive size")
+    parser.add_argument("--inserts", type=int, default=10000, help="history turns")
+    parser.add_argument("--content-chars", type=int, default=400)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to time")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    # per turn logging would dominate the measurements
+    logging.disable(logging.WARNING)
+
+    if args.scenario in ("history", "archive", "startup"):
+        configure_environment("http://127.0.0.1:9/v1", tempfile.mkdtemp())
+        if args.scenario == "history":
+            report = history_benchmark(args.inserts, args.content_chars)
+        elif args.scenario == "archive":
+            report = archive_benchmark(args.messages, args.chats)
+        else:
+            report = startup_benchmark(args.runs)
+    else:
+        config = FakeOpenAIConfig(
+            latency=args.latency,
+            token_delay=args.token_delay,
+            reply_tokens=args.reply_tokens,
+            image_latency=args.image_latency,
+            error_rate=args.error_rate,
+        )
+        bench = BotBenchmark(
+            config,
+            telegram_latency=args.telegram_latency,
+            stream=not args.no_stream,
+            trace_memory=not args.no_tracemalloc,
+            rate_limits=not args.no_rate_limits,
+        )
+        make_update = chat_turn if args.scenario == "chat" else image_turn
+        report = asyncio.run(
+            bench.run(args.scenario, args.chats, args.turns, make_update)
+        )
+
+    if args.json:
+        print(json.dumps(report.as_dict()))
+    else:
+        print(report.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from .fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from .fake_telegram import FakeTelegramRequest
+from .runner import BenchmarkReport, BotBenchmark, configure_environment
+from .scenarios import (
+    archive_benchmark,
+    archived_turns,
+    chat_turn,
+    history_benchmark,
+    image_turn,
+    startup_benchmark,
+)
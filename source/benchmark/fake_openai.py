@@ -0,0 +1,222 @@
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+from io import BytesIO
+from typing import Dict
+
+import tornado.web
+from PIL import Image
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+EMBEDDING_DIM = 64
+
+_WORDS = (
+    "the quick brown fox jumps over the lazy dog while a curious cat watches "
+    "from the garden wall and the sun slowly sets behind the distant hills"
+).split()
+
+
+def sample_png(side: int = 64) -> bytes:
+    """A small PNG, used as generated, edited and downloaded image."""
+    out = BytesIO()
+    Image.new("RGB", (side, side), (90, 140, 200)).save(out, format="PNG")
+    return out.getvalue()
+
+
+class FakeOpenAIConfig:
+    """Behaviour of the fake API.
+
+    ``latency`` is the delay before the first byte of a completion and
+    ``token_delay`` the delay between streamed pieces. ``error_rate`` is the
+    share of requests answered with a 429 carrying ``retry_after``.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        token_delay: float = 0.01,
+        reply_tokens: int = 60,
+        image_latency: float = 1.0,
+        error_rate: float = 0.0,
+        retry_after: float = 0.1,
+    ) -> None:
+        self.latency = latency
+        self.token_delay = token_delay
+        self.reply_tokens = reply_tokens
+        self.image_latency = image_latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+
+
+class _Handler(tornado.web.RequestHandler):
+    def initialize(self, server: "FakeOpenAIServer"):
+        self.server = server
+        self.config = server.config
+
+    def check_xsrf_cookie(self):
+        pass
+
+    def _throttled(self) -> bool:
+        self.server.count(self.request.path)
+        if random.random() >= self.config.error_rate:
+            return False
+        self.server.count("429")
+        self.set_status(429)
+        self.set_header("retry-after", str(self.config.retry_after))
+        self.write({"error": {"message": "Rate limit reached", "type": "requests"}})
+        return True
+
+
+class _ChatHandler(_Handler):
+    async def post(self):
+        if self._throttled():
+            return
+        body = json.loads(self.request.body)
+        model = body.get("model", "gpt-4.1")
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body["messages"])
+        prompt_tokens //= 4
+        words = [random.choice(_WORDS) for _ in range(self.config.reply_tokens)]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+        }
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": model}
+        await asyncio.sleep(self.config.latency)
+
+        if not body.get("stream"):
+            self.write(
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": " ".join(words),
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+            return
+
+        self.set_header("Content-Type", "text/event-stream")
+        chunk = {**base, "object": "chat.completion.chunk"}
+        for i, word in enumerate(words):
+            delta = {
+                "index": 0,
+                "delta": {"content": word + " "},
+                "finish_reason": None,
+            }
+            self.write(f"data: {json.dumps({**chunk, 'choices': [delta]})}\n\n")
+            await self.flush()
+            if i < len(words) - 1:
+                await asyncio.sleep(self.config.token_delay)
+        done = {"index": 0, "delta": {}, "finish_reason": "stop"}
+        self.write(f"data: {json.dumps({**chunk, 'choices': [done]})}\n\n")
+        self.write(f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n")
+        self.write("data: [DONE]\n\n")
+
+
+class _ImageHandler(_Handler):
+    async def post(self):
+        if self._throttled():
+            return
+        await asyncio.sleep(self.config.image_latency)
+        self.write(
+            {
+                "created": int(time.time()),
+                "data": [{"b64_json": self.server.image_b64}],
+            }
+        )
+
+
+class _EmbeddingHandler(_Handler):
+    async def post(self):
+        if self._throttled():
+            return
+        body = json.loads(self.request.body)
+        texts = body["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        await asyncio.sleep(self.config.latency / 4)
+        data = []
+        for i, text in enumerate(texts):
+            # the same text always gets the same vector
+            rng = random.Random(text)
+            vector = [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIM)]
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = sum(len(text) for text in texts) // 4
+        self.write(
+            {
+                "object": "list",
+                "data": data,
+                "model": body.get("model", "text-embedding-3-small"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }
+        )
+
+
+class FakeOpenAIServer:
+    """OpenAI compatible HTTP API on localhost, running in its own thread.
+
+    Serves chat completions (plain and streamed), embeddings, image
+    generations and edits. Point the client at it with
+    ``OPENAI_BASE_URL=server.base_url``.
+    """
+
+    def __init__(self, config: FakeOpenAIConfig = None) -> None:
+        self.config = config or FakeOpenAIConfig()
+        self.image_b64 = base64.b64encode(sample_png()).decode("ascii")
+        self.requests: Dict[str, int] = {}
+        self.base_url = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._stop = None
+
+    def count(self, name: str):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def start(self) -> "FakeOpenAIServer":
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self._serve(ready),), daemon=True
+        )
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._thread.join()
+
+    async def _serve(self, ready: threading.Event):
+        args = dict(server=self)
+        app = tornado.web.Application(
+            [
+                (r"/v1/chat/completions", _ChatHandler, args),
+                (r"/v1/embeddings", _EmbeddingHandler, args),
+                (r"/v1/images/generations", _ImageHandler, args),
+                (r"/v1/images/edits", _ImageHandler, args),
+            ],
+            log_function=lambda handler: None,
+        )
+        sockets = bind_sockets(0, "127.0.0.1")
+        server = HTTPServer(app)
+        server.add_sockets(sockets)
+        self.base_url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/v1"
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        ready.set()
+        await self._stop.wait()
+        server.stop()
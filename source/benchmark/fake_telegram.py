@@ -0,0 +1,83 @@
+import asyncio
+import itertools
+import json
+import time
+from typing import Dict, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+from .fake_openai import sample_png
+
+BOT_USER = {
+    "id": 1000,
+    "is_bot": True,
+    "first_name": "BenchBot",
+    "username": "bench_bot",
+}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls in process, after ``latency`` seconds.
+
+    Sent and edited messages are counted per method and dropped. File
+    downloads return a small PNG.
+    """
+
+    def __init__(self, latency: float = 0.05) -> None:
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+        self._photo = sample_png()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        await asyncio.sleep(self.latency)
+        if "/file/bot" in url:
+            self._count("download")
+            return 200, self._photo
+
+        endpoint = url.rsplit("/", 1)[-1]
+        self._count(endpoint)
+        params = request_data.parameters if request_data else {}
+        result = self._result(endpoint, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _result(self, endpoint: str, params: dict):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getFile":
+            file_id = params.get("file_id", "photo")
+            return {
+                "file_id": file_id,
+                "file_unique_id": f"u-{file_id}",
+                "file_size": len(self._photo),
+                "file_path": f"photos/{file_id}.png",
+            }
+        if endpoint.startswith(("send", "edit")):
+            message = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            return message
+        return True
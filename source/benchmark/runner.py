@@ -0,0 +1,233 @@
+import asyncio
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, List
+
+from .fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from .fake_telegram import FakeTelegramRequest
+
+BENCH_TOKEN = "123456:bench"
+
+
+def configure_environment(
+    openai_url: str, workdir: str, stream: bool = True, rate_limits: bool = True
+):
+    """Point the bot at the fakes. Must run before the bot modules are imported,
+    they read their settings at import time.
+
+    Without ``rate_limits`` the scheduler's RPM and TPM buckets are off, which
+    measures the bot itself rather than the configured OpenAI quota.
+    """
+    if not rate_limits:
+        for lane in ("CHAT", "VISION", "IMAGES", "EMBEDDINGS", "TELEGRAM"):
+            os.environ[f"SCHEDULER_{lane}_RPM"] = "0"
+            os.environ[f"SCHEDULER_{lane}_TPM"] = "0"
+    os.environ.update(
+        {
+            "TELEGRAM_TOKEN": BENCH_TOKEN,
+            "OPENAI_TOKEN": "bench",
+            "OPENAI_BASE_URL": openai_url,
+            "BOT_NAME": "bench",
+            "ARCHIVE_BACKEND": "fs",
+            "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+            "BLOB_BACKEND": "fs",
+            "BLOB_DIR": os.path.join(workdir, "blobs"),
+            "STATE_BACKEND": "memory",
+            "JOB_STORE_PATH": os.path.join(workdir, "jobs.db"),
+            "METRICS_PORT": "0",
+            "STREAM_REPLIES": "1" if stream else "0",
+            # every sent update is timed to its own reply
+            "COALESCE_WINDOW": "0",
+        }
+    )
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest rank percentile of ``values``."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class BenchmarkReport:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.seconds = 0.0
+        self.peak_memory = 0
+        self.extra: Dict[str, object] = {}
+
+    def as_dict(self) -> dict:
+        count = len(self.latencies)
+        return {
+            "scenario": self.name,
+            "turns": count,
+            "seconds": round(self.seconds, 3),
+            "throughput": round(count / self.seconds, 2) if self.seconds else 0.0,
+            "p50_ms": round(1000 * percentile(self.latencies, 50), 1),
+            "p95_ms": round(1000 * percentile(self.latencies, 95), 1),
+            "p99_ms": round(1000 * percentile(self.latencies, 99), 1),
+            "errors": self.errors,
+            "peak_memory_mb": round(self.peak_memory / 2**20, 1),
+            # ru_maxrss is in kilobytes on Linux
+            "max_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+            **self.extra,
+        }
+
+    def format(self) -> str:
+        return "\n".join(f"{k:>16}: {v}" for k, v in self.as_dict().items())
+
+
+class BotBenchmark:
+    """Drive the real ``BotCore`` application with synthetic updates.
+
+    OpenAI is replaced by ``FakeOpenAIServer`` on localhost, Telegram by
+    ``FakeTelegramRequest`` and S3 by the filesystem backend in a temporary
+    directory. Each chat sends its turns one after the other, waiting for
+    the previous reply, while all chats run at once. Latency is measured
+    from putting an update on the application's queue until its handlers
+    are done.
+    """
+
+    def __init__(
+        self,
+        openai_config: FakeOpenAIConfig = None,
+        telegram_latency: float = 0.05,
+        stream: bool = True,
+        trace_memory: bool = True,
+        rate_limits: bool = True,
+    ) -> None:
+        self.openai = FakeOpenAIServer(openai_config).start()
+        self.telegram = FakeTelegramRequest(telegram_latency)
+        self.workdir = tempfile.mkdtemp(prefix="dalibot-bench-")
+        self.trace_memory = trace_memory
+        configure_environment(self.openai.base_url, self.workdir, stream, rate_limits)
+
+    async def run(
+        self,
+        name: str,
+        chats: int,
+        turns: int,
+        make_update: Callable,
+    ) -> BenchmarkReport:
+        """``make_update(bot, chat_id, turn)`` builds the update of one turn."""
+        report = BenchmarkReport(name)
+        async with self._bot(report) as (bot, send):
+
+            async def chat_session(chat_id: int):
+                for turn in range(turns):
+                    await send(make_update(bot, chat_id, turn))
+
+            await asyncio.gather(*(chat_session(1 + i) for i in range(chats)))
+        return report
+
+    async def replay(
+        self,
+        name: str,
+        turns: Iterable[tuple],
+        speed: float = 0.0,
+        max_pending: int = 1000,
+    ) -> BenchmarkReport:
+        """Send ``(seconds, make_update)`` turns in order, ``make_update(bot)``
+        building the update.
+
+        With ``speed`` above 0 the gaps between the turns' ``seconds`` are kept,
+        divided by ``speed``, otherwise turns are sent as fast as possible. At
+        most ``max_pending`` turns are in flight, so memory stays flat however
+        long the replay is.
+        """
+        report = BenchmarkReport(name)
+        async with self._bot(report) as (bot, send):
+            slots = asyncio.Semaphore(max_pending)
+            tasks = set()
+            loop = asyncio.get_running_loop()
+            first = None
+            started = loop.time()
+
+            async def send_one(update):
+                try:
+                    await send(update)
+                finally:
+                    slots.release()
+
+            for seconds, make_update in turns:
+                if speed > 0:
+                    if first is None:
+                        first = seconds
+                    delay = started + (seconds - first) / speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await slots.acquire()
+                task = loop.create_task(send_one(make_update(bot)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        return report
+
+    @asynccontextmanager
+    async def _bot(self, report: BenchmarkReport):
+        """Run the bot and yield ``send(update)``, which waits for the update's
+        handlers and records its latency."""
+        from telegram import Update
+        from telegram.ext import TypeHandler
+        from telegram_bot import BotCore
+
+        if self.trace_memory:
+            tracemalloc.start()
+
+        core = BotCore(token=BENCH_TOKEN, request=self.telegram)
+        core.attach_handlers()
+        application = core.application
+        pending: Dict[int, asyncio.Future] = {}
+
+        async def turn_done(update: Update, context):
+            future = pending.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+        async def count_error(update, context):
+            error = type(context.error).__name__
+            report.errors[error] = report.errors.get(error, 0) + 1
+
+        # group 1 runs after the bot's handlers, also when they raise
+        application.add_handler(TypeHandler(Update, turn_done), group=1)
+        application.add_error_handler(count_error)
+
+        async def send(update: Update):
+            loop = asyncio.get_running_loop()
+            future = pending[update.update_id] = loop.create_future()
+            start = time.perf_counter()
+            await application.update_queue.put(update)
+            await future
+            report.latencies.append(time.perf_counter() - start)
+
+        async with application:
+            await application.start()
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            yield application.bot, send
+            report.seconds = time.perf_counter() - start
+            if self.trace_memory:
+                report.peak_memory = tracemalloc.get_traced_memory()[1]
+            await application.stop()
+            flush_start = time.perf_counter()
+            await core.on_stop(application)
+
+        await core.on_shutdown(application)
+        report.extra["shutdown_ms"] = round(1000 * (time.perf_counter() - flush_start))
+        report.extra["openai_requests"] = dict(self.openai.requests)
+        report.extra["telegram_calls"] = dict(self.telegram.calls)
+        if self.trace_memory:
+            tracemalloc.stop()
+        self.openai.stop()
@@ -0,0 +1,172 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from functools import partial
+from typing import Iterable, Iterator
+
+from telegram import Bot, Update
+
+from .runner import BenchmarkReport, percentile
+from .updates import photo_update, text_update
+
+CHAT_TEXTS = [
+    "hello there, how was your day?",
+    "what's a good name for a goldfish",
+    "tell me a fun fact about the moon",
+    "thanks, that helps a lot",
+]
+# Mixes a new image, an edit, a question about a photo and plain chat
+IMAGE_TURNS = [
+    ("text", "draw a red fox sleeping in the snow"),
+    ("photo", "make it look like a watercolor painting"),
+    ("photo", "what is in this picture?"),
+    ("text", "nice, thank you"),
+]
+
+
+def chat_turn(bot: Bot, chat_id: int, turn: int) -> Update:
+    return text_update(bot, chat_id, CHAT_TEXTS[(chat_id + turn) % len(CHAT_TEXTS)])
+
+
+def image_turn(bot: Bot, chat_id: int, turn: int) -> Update:
+    kind, text = IMAGE_TURNS[(chat_id + turn) % len(IMAGE_TURNS)]
+    if kind == "photo":
+        return photo_update(bot, chat_id, text)
+    return text_update(bot, chat_id, text)
+
+
+def archived_turns(records: Iterable[dict]) -> Iterator[tuple]:
+    """``(seconds, make_update)`` of every user message in archive records, for
+    ``BotBenchmark.replay``. Photos are replaced by the fake API's sample."""
+    from storage.archive_reader import record_time
+
+    for record in records:
+        if record.get("role") != "user":
+            continue
+        when = record_time(record)
+        chat_id = record.get("chat_id") or 1
+        text = record.get("content") or ""
+        if record.get("type") == "image":
+            make_update = partial(photo_update, chat_id=chat_id, caption=text or None)
+        elif text:
+            make_update = partial(text_update, chat_id=chat_id, text=text)
+        else:
+            continue
+        yield (when.timestamp() if when else 0.0), make_update
+
+
+def history_benchmark(
+    inserts: int = 10000, content_chars: int = 400
+) -> BenchmarkReport:
+    """Time ``ChatHistory.insert`` plus ``truncate_messages`` per turn."""
+    from chat import ChatMessage
+    from constants import Role
+    from llm_models import ChatHistory
+
+    report = BenchmarkReport("history")
+    tracemalloc.start()
+    history = ChatHistory(1)
+    content = ("lorem ipsum " * (content_chars // 12 + 1))[:content_chars]
+    start = time.perf_counter()
+    for i in range(inserts):
+        turn_start = time.perf_counter()
+        history.insert(ChatMessage(role=Role.USER, username="bench", content=content))
+        history.truncate_messages(max_tokens=4096)
+        report.latencies.append(time.perf_counter() - turn_start)
+    report.seconds = time.perf_counter() - start
+    report.peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    report.extra["content_chars"] = content_chars
+    report.extra["kept_messages"] = len(history.short_msgs)
+    return report
+
+
+def archive_benchmark(messages: int = 100000, chats: int = 1000) -> BenchmarkReport:
+    """Throughput of ``ChatArchiver`` writing gzipped parts to the filesystem."""
+    from chat import ChatMessage
+    from constants import Role
+    from storage import ChatArchiver
+
+    report = BenchmarkReport("archive")
+    tracemalloc.start()
+    archiver = ChatArchiver()
+    start = time.perf_counter()
+    for i in range(messages):
+        submit_start = time.perf_counter()
+        msg = ChatMessage(role=Role.USER, username="bench", content=f"message {i}")
+        archiver.submit(i % chats, [msg])
+        report.latencies.append(time.perf_counter() - submit_start)
+    submitted = time.perf_counter() - start
+    archiver.close()
+    report.seconds = time.perf_counter() - start
+    report.peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    report.extra["submit_p99_us"] = round(1e6 * percentile(report.latencies, 99), 1)
+    report.extra["submit_seconds"] = round(submitted, 3)
+    report.extra["written"] = archiver.written
+    report.extra["dropped"] = archiver.dropped
+    return report
+
+
+_STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import telegram_bot
+imported = time.perf_counter()
+core = telegram_bot.BotCore()
+core.attach_handlers()
+built = time.perf_counter()
+print(json.dumps({"import": imported - start, "build": built - imported}))
+"""
+
+
+def _import_profile(stderr: str) -> dict:
+    """Self time per top level package from ``python -X importtime`` output."""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        try:
+            self_us = int(parts[0])
+        except ValueError:
+            # the header line
+            continue
+        package = parts[2].strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return totals
+
+
+def startup_benchmark(runs: int = 5, top: int = 10) -> BenchmarkReport:
+    """Cold import of the bot and building ``BotCore``, each run in a new
+    interpreter with ``-X importtime``. Reports the slowest packages to import."""
+    report = BenchmarkReport("startup")
+    source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    imports, builds = [], []
+    profile = {}
+    start = time.perf_counter()
+    for _ in range(runs):
+        run_start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _STARTUP_SCRIPT],
+            cwd=source_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        report.latencies.append(time.perf_counter() - run_start)
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        imports.append(timings["import"])
+        builds.append(timings["build"])
+        profile = _import_profile(result.stderr)
+    report.seconds = time.perf_counter() - start
+    report.extra["import_p50_ms"] = round(1000 * percentile(imports, 50), 1)
+    report.extra["build_p50_ms"] = round(1000 * percentile(builds, 50), 1)
+    slowest = sorted(profile.items(), key=lambda item: item[1], reverse=True)
+    report.extra["import_ms"] = {
+        package: round(us / 1000, 1) for package, us in slowest[:top]
+    }
+    return report
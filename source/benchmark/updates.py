@@ -0,0 +1,48 @@
+import itertools
+import time
+
+from telegram import Bot, Update
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _message(chat_id: int) -> dict:
+    user = {
+        "id": chat_id,
+        "is_bot": False,
+        "first_name": "User",
+        "last_name": str(chat_id),
+    }
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {**user, "type": "private"},
+        "from": user,
+    }
+
+
+def text_update(bot: Bot, chat_id: int, text: str) -> Update:
+    message = _message(chat_id)
+    message["text"] = text
+    return Update.de_json({"update_id": next(_update_ids), "message": message}, bot)
+
+
+def photo_update(
+    bot: Bot, chat_id: int, caption: str = None, media_group_id: str = None
+) -> Update:
+    message = _message(chat_id)
+    file_id = f"photo-{message['message_id']}"
+    message["photo"] = [
+        {
+            "file_id": file_id,
+            "file_unique_id": f"u-{file_id}",
+            "width": 64,
+            "height": 64,
+        }
+    ]
+    if caption:
+        message["caption"] = caption
+    if media_group_id:
+        message["media_group_id"] = media_group_id
+    return Update.de_json({"update_id": next(_update_ids), "message": message}, bot)
@@ -1,6 +1,20 @@
-from constants import Role
+import json
+import time
 from datetime import datetime
-from constants import ChatType
+
+from constants import ChatType, Role
+
+_ROLES = {role.value: role for role in Role}
+_TYPES = {chat_type.value: chat_type for chat_type in ChatType}
+
+
+def _parse_timestamp(value) -> int:
+    """Epoch seconds, also from the ``%Y%m%d_%H%M%S`` strings of older records."""
+    if value is None:
+        return int(time.time())
+    if isinstance(value, str) and not value.isdigit():
+        return int(datetime.strptime(value, "%Y%m%d_%H%M%S").timestamp())
+    return int(value)
 
 
 class ChatMessage:
@@ -9,23 +23,48 @@ class ChatMessage:
         role
         username
         content
-        timestamp
+        timestamp: epoch seconds
         type
         image_url
-        image_b64
+        image_ref
+
+    Slotted, with ``role`` and ``type`` kept as the shared enum members, so a
+    stored message costs little more than its strings.
     """
 
-    def __init__(self, **kwargs):
-        self.role: Role = kwargs.get("role", None)
-        self.username = kwargs.get("username", "")
-        self.content = kwargs.get("content", "")
-        self.timestamp = kwargs.get(
-            "timestamp", datetime.now().strftime("%Y%m%d_%H%M%S")
-        )
-        self.type = kwargs.get("type", ChatType.TEXT).value
-        self.image_url = kwargs.get("image_url", "")
-        self.image_b64 = kwargs.get("image_b64", "")
-        self.tokens = kwargs.get("tokens", 0)
+    __slots__ = (
+        "role",
+        "username",
+        "content",
+        "timestamp",
+        "type",
+        "image_url",
+        "image_ref",
+        "tokens",
+        "_openai",
+    )
+
+    def __init__(
+        self,
+        role: Role = None,
+        username: str = "",
+        content: str = "",
+        timestamp: int = None,
+        type: ChatType = ChatType.TEXT,
+        image_url: str = "",
+        image_ref: str = "",
+        tokens: int = 0,
+    ):
+        self.role = role
+        self.username = username
+        self.content = content
+        self.timestamp = int(time.time()) if timestamp is None else timestamp
+        self.type = type
+        self.image_url = image_url
+        # reference into storage.BlobStore, never the image bytes
+        self.image_ref = image_ref
+        self.tokens = tokens
+        self._openai = None
 
     def jsonify_full(self):
         return {
@@ -33,15 +72,65 @@ class ChatMessage:
             "username": self.username,
             "content": self.content,
             "timestamp": self.timestamp,
-            "type": self.type,
+            "type": self.type.value,
             "image_url": self.image_url,
-            "image_b64": self.image_b64,
+            "image_ref": self.image_ref,
             "tokens": self.tokens,
         }
 
+    @classmethod
+    def from_json(cls, data: dict) -> "ChatMessage":
+        """Inverse of ``jsonify_full``"""
+        return cls(
+            role=_ROLES[data["role"]],
+            username=data.get("username", ""),
+            content=data.get("content", ""),
+            timestamp=_parse_timestamp(data.get("timestamp")),
+            type=_TYPES[data.get("type", ChatType.TEXT.value)],
+            image_url=data.get("image_url", ""),
+            image_ref=data.get("image_ref", ""),
+            tokens=data.get("tokens", 0),
+        )
+
+    def encode(self) -> str:
+        """One compact JSON line with short keys, empty fields left out."""
+        record = {"r": self.role.value, "t": self.timestamp}
+        if self.username:
+            record["u"] = self.username
+        if self.content:
+            record["c"] = self.content
+        if self.type is not ChatType.TEXT:
+            record["y"] = self.type.value
+        if self.image_url:
+            record["i"] = self.image_url
+        if self.image_ref:
+            record["b"] = self.image_ref
+        if self.tokens:
+            record["k"] = self.tokens
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def decode(cls, line) -> "ChatMessage":
+        """Inverse of ``encode``, also reads ``jsonify_full`` records."""
+        data = json.loads(line)
+        if "role" in data:
+            return cls.from_json(data)
+        return cls(
+            role=_ROLES[data["r"]],
+            username=data.get("u", ""),
+            content=data.get("c", ""),
+            timestamp=data["t"],
+            type=_TYPES[data.get("y", ChatType.TEXT.value)],
+            image_url=data.get("i", ""),
+            image_ref=data.get("b", ""),
+            tokens=data.get("k", 0),
+        )
+
     def jsonify_openai(self):
-        """Return the json needed by openai"""
-        return {
-            "role": self.role.value,
-            "content": self.content,
-        }
+        """Return the json needed by openai, built once per message"""
+        if self._openai is None:
+            self._openai = {
+                "role": self.role.value,
+                "content": self.content,
+            }
+        return self._openai
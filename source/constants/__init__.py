@@ -1,2 +1,2 @@
-from .constant import Role, ChatType
+from .constant import ChatType, Intent, Role
 from .system_prompts import *
@@ -10,3 +10,9 @@ class Role(Enum):
 class ChatType(Enum):
     TEXT = "text"
     IMAGE = "image"
+
+
+class Intent(Enum):
+    TEXT = "@noimage"
+    IMAGE = "@image"
+    EDIT = "@edit"
@@ -13,3 +13,10 @@ IMAGE_PROMPT = f"""Use your best judgement to analyze this user prompt,
     If user wants to edit an image, you return '@edit [your_detailed_image_prompt]`.
     If the user wants text response, just return '@noimage'.
 """
+
+SUMMARY_PROMPT = """You maintain the memory of a chat between a user and an assistant.
+    Merge the summary so far with the new messages into one updated summary.
+    Keep facts about the user, their preferences, decisions, open questions and
+    anything the assistant promised. Drop small talk. Answer with the summary only,
+    in at most a few short paragraphs, in the language of the conversation.
+"""
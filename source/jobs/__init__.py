@@ -0,0 +1,2 @@
+from .queue import JobQueue, JobQueueFullError
+from .store import EDIT, IMAGE, Job, JobStore
@@ -0,0 +1,185 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import ERRORS
+from utils import Singleton, logger
+
+from .store import Job, JobStore
+
+# Image jobs run at the same time
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+# SQLite file keeping unfinished jobs across restarts
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", "jobs.db")
+# Jobs waiting for a worker before new ones are refused
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", "200"))
+# Unfinished jobs one chat may have
+JOB_MAX_PER_CHAT = int(os.environ.get("JOB_MAX_PER_CHAT", "3"))
+# Seconds close() waits for queued and running jobs before cancelling them
+JOB_DRAIN_TIMEOUT = 30
+
+
+class JobQueueFullError(Exception):
+    """Raised instead of queueing when there are too many unfinished jobs."""
+
+    def __init__(self, scope: str) -> None:
+        super().__init__(f"Too many image jobs queued for {scope}")
+        self.scope = scope
+
+
+class JobQueue(metaclass=Singleton):
+    """Runs slow image jobs on a bounded pool of workers.
+
+    Handlers ``submit`` a job and return at once; ``JOB_WORKERS`` tasks run
+    the jobs through the runner given to ``bind``, which delivers the result
+    itself. Jobs are kept in a ``JobStore`` until they are done, and
+    ``resume`` queues the ones a previous process left behind, so a job can
+    run twice after a crash but is never lost.
+    """
+
+    def __init__(
+        self,
+        store: JobStore = None,
+        workers: int = JOB_WORKERS,
+        max_queued: int = JOB_QUEUE_LIMIT,
+        max_per_chat: int = JOB_MAX_PER_CHAT,
+    ) -> None:
+        self.store = store or JobStore(JOB_STORE_PATH)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_chat = max_per_chat
+        self._runner: Optional[Callable[[Job], Awaitable[None]]] = None
+        self._on_failure: Optional[Callable[[Job, Exception], Awaitable[None]]] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # unfinished jobs by id, and the task of those a worker is running
+        self._jobs: Dict[str, Job] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        # set once close() stops the workers, failures from then on are kept
+        self._stopping = False
+        self.done = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._jobs) - len(self._running)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def bind(
+        self,
+        runner: Callable[[Job], Awaitable[None]],
+        on_failure: Callable[[Job, Exception], Awaitable[None]] = None,
+    ):
+        """Set what runs a job, e.g. a function bound to the Telegram bot, and
+        what tells the user when it failed."""
+        self._runner = runner
+        self._on_failure = on_failure
+
+    async def submit(self, job: Job):
+        if self.queued >= self.max_queued:
+            raise JobQueueFullError("the bot")
+        if len(self.jobs_of(job.chat_id)) >= self.max_per_chat:
+            raise JobQueueFullError(f"chat {job.chat_id}")
+        await self.store.add(job)
+        self._enqueue(job)
+
+    async def resume(self, shard: Tuple[int, int] = None):
+        """Queue the jobs left in the store by an earlier process."""
+        jobs = await self.store.pending(shard)
+        jobs = [job for job in jobs if job.id not in self._jobs]
+        for job in jobs:
+            self._enqueue(job)
+        if jobs:
+            logger.info(f"resumed {len(jobs)} image jobs")
+
+    def jobs_of(self, chat_id: int) -> List[Job]:
+        return [job for job in self._jobs.values() if job.chat_id == chat_id]
+
+    async def cancel(self, chat_id: int) -> List[Job]:
+        """Cancel the unfinished jobs of a chat and return them."""
+        jobs = self.jobs_of(chat_id)
+        for job in jobs:
+            self._jobs.pop(job.id, None)
+            task = self._running.get(job.id)
+            if task is not None:
+                task.cancel()
+            await self.store.delete(job.id)
+        self.cancelled += len(jobs)
+        return jobs
+
+    async def close(self, timeout: float = JOB_DRAIN_TIMEOUT):
+        """Give running and queued jobs ``timeout`` seconds, then stop. Jobs
+        that did not finish stay in the store for the next ``resume``, so this
+        has to run while the clients the runner uses are still open."""
+        if self._queue is not None and self._jobs:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stopping with {len(self._jobs)} image jobs left")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._jobs.clear()
+        self._stopping = False
+        await asyncio.to_thread(self.store.close)
+
+    def _enqueue(self, job: Job):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [
+                asyncio.create_task(self._work(), name=f"image-job-{i}")
+                for i in range(self.workers)
+            ]
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job)
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                # cancelled while it was waiting
+                if job.id in self._jobs:
+                    await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        task = asyncio.create_task(self._runner(job))
+        self._running[job.id] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if job.id in self._jobs:
+                # the worker itself is stopping, the job stays stored
+                raise
+            return
+        except Exception as e:
+            if self._stopping:
+                # likely failed because the process is stopping, run it again
+                logger.warning(f"Image job {job.id} stopped with the process: {e}")
+                return
+            self.failed += 1
+            ERRORS.inc(error=type(e).__name__)
+            logger.error(f"Image job {job.id} of chat {job.chat_id} failed: {e}")
+            await self._report(job, e)
+        else:
+            self.done += 1
+        finally:
+            self._running.pop(job.id, None)
+        self._jobs.pop(job.id, None)
+        await self.store.delete(job.id)
+
+    async def _report(self, job: Job, error: Exception):
+        if self._on_failure is None:
+            return
+        try:
+            await self._on_failure(job, error)
+        except Exception as e:
+            logger.error(f"Cannot report the failure of image job {job.id}: {e}")
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Tuple
+
+# Kinds of jobs
+IMAGE = "image"
+EDIT = "edit"
+
+
+class Job:
+    """One image generation or edit waiting for, or in, a worker.
+
+    Edits keep the Telegram ``file_ids`` of their photos rather than the
+    bytes, so a job read back after a restart downloads them again.
+    """
+
+    __slots__ = (
+        "id",
+        "chat_id",
+        "kind",
+        "prompt",
+        "model",
+        "content",
+        "file_ids",
+        "placeholder_id",
+        "created",
+    )
+
+    def __init__(
+        self,
+        chat_id: int,
+        kind: str,
+        prompt: str,
+        model: str,
+        content: str = "",
+        file_ids: List[str] = None,
+        placeholder_id: int = None,
+        id: str = None,
+        created: float = None,
+    ) -> None:
+        self.id = id or uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.kind = kind
+        self.prompt = prompt
+        self.model = model
+        # text the result is stored under in the chat history
+        self.content = content
+        self.file_ids = file_ids or []
+        # "working on it" message replaced by the result
+        self.placeholder_id = placeholder_id
+        self.created = created or time.time()
+
+    def to_json(self) -> str:
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+    @classmethod
+    def from_json(cls, data: str) -> "Job":
+        return cls(**json.loads(data))
+
+
+class JobStore:
+    """Unfinished jobs in a SQLite file, so they survive a restart.
+
+    A job is written when it is queued and deleted once it finished, failed
+    or was cancelled. The file is opened on first use and queries run in a
+    worker thread.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs "
+                "(id TEXT PRIMARY KEY, chat_id INTEGER, data TEXT, created REAL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                with self._connect():
+                    return fn(*args)
+
+        return asyncio.to_thread(locked)
+
+    async def add(self, job: Job):
+        def add():
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                (job.id, job.chat_id, job.to_json(), job.created),
+            )
+
+        await self._run(add)
+
+    async def delete(self, job_id: str):
+        def delete():
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+        await self._run(delete)
+
+    async def pending(self, shard: Tuple[int, int] = None) -> List[Job]:
+        """Stored jobs, oldest first. ``shard`` is ``(index, count)`` and keeps
+        the jobs of the chats that worker ``index`` of ``count`` owns."""
+
+        def pending():
+            rows = self._db.execute(
+                "SELECT chat_id, data FROM jobs ORDER BY created"
+            ).fetchall()
+            if shard is not None:
+                index, count = shard
+                rows = [row for row in rows if row[0] % count == index]
+            return [Job.from_json(data) for _, data in rows]
+
+        return await self._run(pending)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,3 +1,9 @@
+from .conversation_store import ConversationStore
 from .embedding import ChatHistory
+from .intent_router import IntentDecision, IntentRouter
+from .long_term_memory import LongTermMemory
 from .model import Model
+from .model_registry import ModelSpec
 from .openai_chat_interface import OpenAIChatInterface
+from .response_cache import ResponseCache
+from .summarizer import ConversationSummarizer
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from chat import ChatMessage
+from state import StateBackend, get_state_backend
+from utils import Singleton, logger
+
+from .embedding import SHORT_MSG_LIMIT, ChatHistory
+from .summarizer import ConversationSummarizer
+
+# Number of chats kept in memory before the least recently used one is dropped
+CONVERSATION_MAX_CHATS = int(os.environ.get("CONVERSATION_MAX_CHATS", "5000"))
+# Seconds a chat may stay idle before its history is dropped, 0 disables it
+CONVERSATION_IDLE_TTL = int(os.environ.get("CONVERSATION_IDLE_TTL", "86400"))
+# Approximate memory ceiling for all histories together
+CONVERSATION_MAX_BYTES = int(
+    os.environ.get("CONVERSATION_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+
+class ConversationStore(metaclass=Singleton):
+    """Chat histories keyed by Telegram chat id.
+
+    Histories are evicted in least recently used order once the store holds
+    more than ``max_chats`` chats or ``max_bytes`` of messages, and dropped
+    after ``idle_ttl`` seconds without a turn. Every chat has its own lock so
+    turns inside one chat run in order while different chats run in parallel.
+
+    With a shared state backend every turn is written through to it, and a
+    chat is reloaded when another process has changed it since, so workers
+    and restarts see the same conversation.
+
+    After every turn the chat is handed to ``ConversationSummarizer``, which
+    may fold its oldest messages into a summary in the background.
+    """
+
+    def __init__(
+        self,
+        max_chats: int = CONVERSATION_MAX_CHATS,
+        idle_ttl: int = CONVERSATION_IDLE_TTL,
+        max_bytes: int = CONVERSATION_MAX_BYTES,
+        backend: StateBackend = None,
+    ) -> None:
+        self.backend = backend or get_state_backend()
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._histories: "OrderedDict[int, ChatHistory]" = OrderedDict()
+        self._last_used: Dict[int, float] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # turns holding or waiting for a chat lock, see _hold
+        self._lock_users: Dict[int, int] = {}
+        self._total_bytes = 0
+        self.summarizer = ConversationSummarizer()
+
+    def __len__(self) -> int:
+        return len(self._histories)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._histories
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, chat_id: int) -> ChatHistory:
+        """Return the history of a chat, creating it on first use."""
+        history = self._histories.get(chat_id)
+        if history is None:
+            history = ChatHistory(chat_id)
+            self._histories[chat_id] = history
+        else:
+            self._histories.move_to_end(chat_id)
+        self._last_used[chat_id] = time.monotonic()
+        return history
+
+    def lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def _hold(self, chat_id: int):
+        """Hold the chat lock, counted from before it is awaited, so ``_drop``
+        never replaces a lock somebody is still waiting for."""
+        self._lock_users[chat_id] = self._lock_users.get(chat_id, 0) + 1
+        try:
+            async with self.lock(chat_id):
+                yield
+        finally:
+            users = self._lock_users.pop(chat_id) - 1
+            if users:
+                self._lock_users[chat_id] = users
+
+    @asynccontextmanager
+    async def session(self, chat_id: int):
+        """Hold the chat lock for one turn and yield its history."""
+        async with self._hold(chat_id):
+            history = self.get(chat_id)
+            size_before = history.size_bytes
+            try:
+                if self.backend.shared:
+                    await self._sync(history)
+                yield history
+            finally:
+                if self._histories.get(chat_id) is history:
+                    self._total_bytes += history.size_bytes - size_before
+                if self.backend.shared:
+                    await self._save(history)
+        self.summarizer.schedule(self, history)
+        self.evict()
+
+    async def apply_summary(
+        self, history: ChatHistory, summary: ChatMessage, messages: list
+    ) -> bool:
+        """Fold ``messages`` of a chat into ``summary`` between two turns.
+
+        Returns False when the chat was reset or evicted meanwhile.
+        """
+        async with self._hold(history.chat_id):
+            if self._histories.get(history.chat_id) is not history:
+                return False
+            size_before = history.size_bytes
+            history.apply_summary(summary, messages)
+            self._total_bytes += history.size_bytes - size_before
+            if self.backend.shared:
+                key = _messages_key(history.chat_id)
+                await self.backend.set(_summary_key(history.chat_id), summary.encode())
+                await self.backend.ltrim(key, len(history.short_msgs))
+                version = await self.backend.incr(_version_key(history.chat_id))
+                history.version = str(version)
+        return True
+
+    async def reset(self, chat_id: int):
+        """Forget a chat, after the turn running for it has finished and saved."""
+        async with self._hold(chat_id):
+            history = self._histories.pop(chat_id, None)
+            self._last_used.pop(chat_id, None)
+            if history is not None:
+                self._total_bytes -= history.size_bytes
+                history.reset()
+            if self.backend.shared:
+                await self.backend.delete(
+                    _messages_key(chat_id), _summary_key(chat_id)
+                )
+                await self.backend.incr(_version_key(chat_id))
+
+    async def _sync(self, history: ChatHistory):
+        """Reload the history if the backend holds a newer version."""
+        version = await self.backend.get(_version_key(history.chat_id))
+        if version == history.version:
+            return
+        records = await self.backend.lrange(_messages_key(history.chat_id))
+        summary = await self.backend.get(_summary_key(history.chat_id))
+        history.load([ChatMessage.decode(r) for r in records])
+        if summary is not None:
+            history.summary = ChatMessage.decode(summary)
+        history.version = version
+
+    async def _save(self, history: ChatHistory):
+        if not history.unsaved:
+            return
+        records = [m.encode() for m in history.unsaved]
+        history.unsaved.clear()
+        key = _messages_key(history.chat_id)
+        await self.backend.rpush(key, records)
+        await self.backend.ltrim(key, min(len(history.short_msgs), SHORT_MSG_LIMIT))
+        version = await self.backend.incr(_version_key(history.chat_id))
+        history.version = str(version)
+
+    def evict(self):
+        """Drop idle chats, then least recently used ones until under the limits."""
+        if self.idle_ttl > 0:
+            deadline = time.monotonic() - self.idle_ttl
+            for chat_id in list(self._histories):
+                if self._last_used[chat_id] > deadline:
+                    # the dict is ordered by last use, the rest is newer
+                    break
+                self._drop(chat_id)
+
+        for chat_id in list(self._histories):
+            if (
+                len(self._histories) <= self.max_chats
+                and self._total_bytes <= self.max_bytes
+            ):
+                break
+            self._drop(chat_id)
+
+    def _drop(self, chat_id: int):
+        if self._lock_users.get(chat_id):
+            # a turn is running or waiting for this chat, keep it
+            return
+        self._locks.pop(chat_id, None)
+        self._last_used.pop(chat_id, None)
+        history = self._histories.pop(chat_id)
+        self._total_bytes -= history.size_bytes
+        logger.info(f"evicted chat history: {chat_id}")
+
+
+def _messages_key(chat_id: int) -> str:
+    return f"history:{chat_id}:messages"
+
+
+def _summary_key(chat_id: int) -> str:
+    return f"history:{chat_id}:summary"
+
+
+def _version_key(chat_id: int) -> str:
+    return f"history:{chat_id}:version"
@@ -1,109 +1,142 @@
-import json
-import os
-from datetime import datetime
-from typing import List
+from collections import deque
+from typing import Deque, List, Optional
 
-import boto3
-import tiktoken
 from chat import ChatMessage
 from constants import Role, system_prompts
-from utils import Singleton, logger
 
 from .model import Model
+from .summarizer import SUMMARY_ENABLED, SUMMARY_MAX_OVERFLOW
+from .tokenizer import count_message_tokens
 
 SHORT_MSG_LIMIT = 30
 
-BOT_NAME = os.environ.get("BOT_NAME")
-BUCKET = "bot-chat-dali"
+# Rough per message overhead on top of its text payloads
+MSG_OVERHEAD_BYTES = 160
 
+_system_msg = None
 
-class ChatHistory(metaclass=Singleton):
-    _instance = None
 
-    @classmethod
-    def getInstance(cls):
-        if cls._instance is None:
-            cls._instance = cls()
-        return cls._instance
+def _shared_system_msg() -> ChatMessage:
+    """The system prompt, one instance shared by every chat."""
+    global _system_msg
+    if _system_msg is None:
+        _system_msg = ChatMessage(
+            role=Role.SYSTEM,
+            username="System",
+            content=system_prompts.DEFAULT_PROMPT,
+        )
+        _system_msg.tokens = count_message_tokens(_system_msg.content)
+    return _system_msg
+
+
+def _message_size(message: ChatMessage) -> int:
+    return MSG_OVERHEAD_BYTES + len(message.content) + len(message.image_url)
+
+
+class ChatHistory:
+    """Short term history of a single chat, see ``ConversationStore``.
 
-    def __init__(self) -> None:
-        self.short_msgs = []
-        self.short_counter = 0
+    Every message's token count is computed once on insert and a running
+    total is kept, so fitting the history into the prompt budget only pops
+    the oldest messages instead of re-counting the whole history.
+    """
+
+    def __init__(self, chat_id: int = None) -> None:
+        self.chat_id = chat_id
+        self.system_msg = _shared_system_msg()
+        self.short_msgs: Deque[ChatMessage] = deque()
+        self.total_tokens = 0
+        self.size_bytes = 0
+        # running summary of older turns, see ``ConversationSummarizer``
+        self.summary: Optional[ChatMessage] = None
+        # messages that left the window and are not in the summary yet
+        self.overflow: List[ChatMessage] = []
+        self.overflow_tokens = 0
+        # state backend version this history was loaded from or saved as
+        self.version = None
+        self.unsaved: List[ChatMessage] = []
 
     def insert(self, new_message: ChatMessage):
+        if not new_message.tokens:
+            new_message.tokens = count_message_tokens(new_message.content)
         self.short_msgs.append(new_message)
-        self.short_counter += 1
-        if self.short_counter >= SHORT_MSG_LIMIT:
-            self.truncate_messages()
-
-    def push_msgs_to_s3(self, msgs: List[ChatMessage]):
-        if (
-            os.getenv("AWS_ACCESS_KEY_ID") is None
-            or os.getenv("AWS_SECRET_ACCESS_KEY") is None
-        ):
-            logger.error("AWS credentials not found. Skipping storage..")
-            return
-
-        s3: boto3.client = boto3.client(
-            "s3",
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        )
-        timestamp = datetime.now().strftime("%Y%m%d")
-
-        # List objects within the bucket
-        filename = f"{BOT_NAME}/{BOT_NAME}_chat_{timestamp}.json"
-        new_msgs_json = json.dumps([m.jsonify_full() for m in msgs], indent=4)
-        try:
-            # Try to download the existing file from S3
-            response = s3.get_object(Bucket=BUCKET, Key=filename)
-            existing_data = response["Body"].read().decode("utf-8")
-            combined_data = json.loads(existing_data)
-            combined_data.extend(json.loads(new_msgs_json))  # Append new data
-            final_data = json.dumps(combined_data, indent=4)
-        except s3.exceptions.NoSuchKey:
-            # If the file does not exist, use new data as the final data
-            final_data = new_msgs_json
-        s3.put_object(Bucket=BUCKET, Key=filename, Body=final_data)
-
-        # TODO: Add logic to ingest the JSON file into Elasticsearch
-
-    def truncate_messages(self, max_tokens: int = 5120) -> List[dict]:
-        """Truncate messages if exceed the limit.
-        However, this should not truncate system prompt.
+        self.unsaved.append(new_message)
+        self.total_tokens += new_message.tokens
+        self.size_bytes += _message_size(new_message)
+        while len(self.short_msgs) > SHORT_MSG_LIMIT:
+            self._pop_oldest()
+
+    def truncate_messages(self, max_tokens: int = None) -> List[dict]:
+        """Drop the oldest messages until the prompt fits in ``max_tokens``.
+        The system prompt and the latest message are always kept.
         """
-        # total_tokens = 0
-        total_messages = 0
-        truncated_messages = []
-
-        # load encoding for model
-        # encoding = tiktoken.get_encoding("cl100k_base")
-
-        # avoid modify system prompt
-        message: ChatMessage
-        for message in reversed(self.short_msgs):
-            if message.role != Role.SYSTEM:
-                # total_tokens += len(
-                #     encoding.encode(json.dumps(message.jsonify_openai()))
-                # )
-                total_messages += 1
-                if total_messages < SHORT_MSG_LIMIT:  # total_tokens <= max_tokens
-                    truncated_messages.insert(0, message)
-                else:
-                    break
-        truncated_messages.insert(
-            0,
-            ChatMessage(
-                role=Role.SYSTEM,
-                username="System",
-                content=system_prompts.DEFAULT_PROMPT,
-            ),
-        )
-
-        self.short_msgs: List[ChatMessage] = truncated_messages
-        self.short_counter = len(self.short_msgs)
-        return [m.jsonify_openai() for m in self.short_msgs]
+        if max_tokens is None:
+            max_tokens = Model().get_prompt_token_budget()
+
+        budget = max_tokens - self.system_msg.tokens
+        if self.summary is not None:
+            budget -= self.summary.tokens
+        while self.total_tokens > budget and len(self.short_msgs) > 1:
+            self._pop_oldest()
+
+        messages = [self.system_msg.jsonify_openai()]
+        if self.summary is not None:
+            messages.append(self.summary.jsonify_openai())
+        messages.extend(m.jsonify_openai() for m in self.short_msgs)
+        return messages
+
+    def _pop_oldest(self) -> ChatMessage:
+        message = self.short_msgs.popleft()
+        self.total_tokens -= message.tokens
+        if SUMMARY_ENABLED and message.content:
+            # kept until the summarizer has folded it into the summary
+            self.overflow.append(message)
+            self.overflow_tokens += message.tokens
+            if len(self.overflow) > SUMMARY_MAX_OVERFLOW:
+                self._forget(self.overflow.pop(0))
+        else:
+            self.size_bytes -= _message_size(message)
+        return message
+
+    def _forget(self, message: ChatMessage):
+        self.overflow_tokens -= message.tokens
+        self.size_bytes -= _message_size(message)
+
+    def apply_summary(self, summary: ChatMessage, messages: List[ChatMessage]):
+        """Replace ``messages``, the oldest of the chat, by ``summary``.
+
+        Messages added or dropped since the summary was started are left
+        alone, the newest message is always kept.
+        """
+        summarized = {id(m) for m in messages}
+        kept = []
+        for message in self.overflow:
+            if id(message) in summarized:
+                self._forget(message)
+            else:
+                kept.append(message)
+        self.overflow = kept
+        while len(self.short_msgs) > 1 and id(self.short_msgs[0]) in summarized:
+            message = self.short_msgs.popleft()
+            self.total_tokens -= message.tokens
+            self.size_bytes -= _message_size(message)
+        if self.summary is not None:
+            self.size_bytes -= _message_size(self.summary)
+        self.size_bytes += _message_size(summary)
+        self.summary = summary
+
+    def load(self, messages: List[ChatMessage]):
+        """Replace the history with messages read back from the state backend."""
+        self.reset()
+        for message in messages:
+            self.insert(message)
+        self.unsaved.clear()
 
     def reset(self):
-        self.short_msgs = []
-        self.short_counter = 0
+        self.short_msgs.clear()
+        self.unsaved.clear()
+        self.overflow.clear()
+        self.overflow_tokens = 0
+        self.summary = None
+        self.total_tokens = 0
+        self.size_bytes = 0
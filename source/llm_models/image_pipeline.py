@@ -0,0 +1,95 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional, Tuple, Union
+
+from .model import Model
+from .model_registry import get_spec
+
+# Threads running PIL work, PIL releases the GIL while resizing and encoding
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+# Upload limit of the image edit endpoint
+EDIT_MAX_BYTES = 50 * 1024 * 1024
+
+# Formats the edit endpoint takes as they are
+ACCEPTED_FORMATS = {
+    "PNG": ("image.png", "image/png"),
+    "JPEG": ("image.jpg", "image/jpeg"),
+    "WEBP": ("image.webp", "image/webp"),
+}
+
+ImageBytes = Union[bytes, bytearray, memoryview]
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+
+class BytesSink:
+    """Write target for ``telegram.File.download_to_memory`` that keeps the
+    downloaded ``bytes`` object instead of copying it into a buffer."""
+
+    def __init__(self) -> None:
+        self.data = b""
+
+    def write(self, data: bytes) -> int:
+        self.data = data
+        return len(data)
+
+
+def sniff_format(data: ImageBytes) -> Optional[str]:
+    """Image format from the magic bytes, without decoding anything."""
+    head = bytes(memoryview(data)[:12])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _image_size(data: ImageBytes) -> Tuple[int, int]:
+    # PIL is only imported once the first photo is edited
+    from PIL import Image
+
+    # Image.open only parses the header, the pixels are not decoded
+    with Image.open(BytesIO(data)) as img:
+        return img.size
+
+
+def _transcode(data: ImageBytes, max_side: int) -> Tuple[str, bytes, str]:
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as img:
+        fmt = img.format if img.format in ACCEPTED_FORMATS else "PNG"
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            fmt = "PNG"
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        img.thumbnail((max_side, max_side))
+        out = BytesIO()
+        img.save(out, format=fmt)
+    filename, content_type = ACCEPTED_FORMATS[fmt]
+    return (filename, out.getvalue(), content_type)
+
+
+async def prepare_edit_image(
+    data: ImageBytes, model: str = None
+) -> Tuple[str, bytes, str]:
+    """Return a (filename, bytes, content type) upload for the edit endpoint.
+
+    Images already in an accepted format and within the model's size are
+    passed through untouched. Anything else is downscaled or transcoded in
+    the image worker pool.
+    """
+    max_side = get_spec(model or Model().get_current_image_model()).max_image_side
+    fmt = sniff_format(data)
+    if fmt is not None and len(data) <= EDIT_MAX_BYTES:
+        if max(_image_size(data)) <= max_side:
+            filename, content_type = ACCEPTED_FORMATS[fmt]
+            if not isinstance(data, bytes):
+                data = bytes(data)
+            return (filename, data, content_type)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _transcode, data, max_side)
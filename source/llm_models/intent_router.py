@@ -0,0 +1,287 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from constants import Intent, Role, system_prompts
+from utils import Singleton, logger
+
+from .openai_chat_interface import OpenAIChatInterface
+
+# Cheap model asked before the current chat model, empty to skip it
+INTENT_SMALL_MODEL = os.environ.get("INTENT_SMALL_MODEL", "gpt-4.1-nano")
+INTENT_CACHE_SIZE = int(os.environ.get("INTENT_CACHE_SIZE", "2048"))
+INTENT_CACHE_TTL = int(os.environ.get("INTENT_CACHE_TTL", "3600"))
+# Log the routing stats every this many decisions
+INTENT_STATS_EVERY = 100
+
+# make sure it's sending less than text limit
+CLASSIFIER_INPUT_LIMIT = 2048
+
+_WS = re.compile(r"\s+")
+
+# Nouns that make a text worth a closer look
+_IMAGE_WORDS = re.compile(
+    r"\b(image|picture|pic|photo|drawing|illustration|logo|icon|wallpaper|"
+    r"portrait|painting|sketch|art|avatar|meme)s?\b|画|图|照片",
+    re.IGNORECASE,
+)
+# Verbs that may ask for an image, in any position and a few languages
+_IMAGE_VERBS = re.compile(
+    r"\b(draw|paint|sketch|illustrate|generate|render|visuali[sz]e|"
+    r"dessin|dibuj|zeichne|disegn|desenh|pinta|рису|нарису)\w*|画|生成",
+    re.IGNORECASE,
+)
+# Requests for a new image
+_IMAGE_REQUESTS = [
+    re.compile(r"\b(draw|paint|sketch|illustrate)\b", re.IGNORECASE),
+    re.compile(
+        r"\b(generate|create|make|give me|show me|design|render)\b.{0,60}"
+        r"\b(image|picture|pic|photo|drawing|illustration|logo|icon|wallpaper|"
+        r"portrait|painting)s?\b",
+        re.IGNORECASE,
+    ),
+    re.compile(r"(请|帮我|给我)?(画|生成.{0,8}(图|图片|照片))"),
+]
+# "I paint on weekends" tells about an image, it doesn't ask for one
+_NARRATION = re.compile(
+    r"\b(i|we|he|she|they|my \w+)\s+(\w+\s+)?(draw|paint|sketch|illustrate)",
+    re.IGNORECASE,
+)
+# Verbs that create something, an image when no other noun is named
+_CREATE_VERBS = re.compile(
+    r"\b(create|make|design|imagine|give me|show me)\b", re.IGNORECASE
+)
+# Texts that are clearly chat; anything else could be an image request in a
+# phrasing the rules miss, e.g. "a dog in a space suit"
+_GREETINGS = re.compile(
+    r"^\W*(hi|hello|hey|thanks|thank you|thx|ok|okay|yes|no|bye|good "
+    r"(morning|night|evening))\b.{0,20}$",
+    re.IGNORECASE,
+)
+_CODE = re.compile(
+    r"```|`[^`]+`|^\s*(def|class|import|from|SELECT)\s|[{};]\s*$", re.MULTILINE
+)
+# Words from which a message without image words reads as prose
+LONG_PROSE_WORDS = 40
+# Captions asking to change the attached photo
+_EDIT_REQUESTS = re.compile(
+    r"^\s*(please\s+)?(edit|change|make (it|this|them|me|him|her)|turn (it|this)|"
+    r"add|remove|replace|convert|recolou?r|colou?rize|erase|put|swap)\b"
+    r"|(修改|改成|换成|去掉|加上)",
+    re.IGNORECASE,
+)
+# Captions asking about the attached photo
+_QUESTIONS = re.compile(
+    r"^\s*(what|who|where|when|why|how|which|is|are|does|do|can|could|describe|"
+    r"explain|tell me|identify)\b|[?？]\s*$|(什么|是谁|哪里|吗)",
+    re.IGNORECASE,
+)
+
+
+def clearly_chat(text: str) -> bool:
+    """Whether a text without image words is a question, a greeting, code or
+    long prose, which the rules answer as chat without asking a model."""
+    return bool(
+        _QUESTIONS.search(text)
+        or _GREETINGS.search(text)
+        or _CODE.search(text)
+        or len(text.split()) >= LONG_PROSE_WORDS
+    )
+
+
+def likely_text(text: str) -> bool:
+    """Whether a message the rules could not settle reads like chat, e.g. a
+    question that happens to mention pictures."""
+    return bool(_QUESTIONS.search(text))
+
+
+class IntentDecision:
+    __slots__ = ("intent", "prompt", "stage")
+
+    def __init__(self, intent: Intent, prompt: str = "", stage: str = "") -> None:
+        self.intent = intent
+        self.prompt = prompt
+        self.stage = stage
+
+
+def parse_classifier_output(text: str, output: str, stage: str) -> IntentDecision:
+    """Turn an ``IMAGE_PROMPT`` answer into a decision."""
+    for intent in (Intent.IMAGE, Intent.EDIT):
+        if intent.value in output:
+            prompt = output.split(intent.value, 1)[1].strip() or text
+            return IntentDecision(intent, prompt, stage)
+    return IntentDecision(Intent.TEXT, stage=stage)
+
+
+class IntentStage:
+    name = "stage"
+
+    async def classify(self, text: str, edit: bool) -> Optional[IntentDecision]:
+        """Return a decision, or None when the stage can't tell."""
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+
+class RuleStage(IntentStage):
+    """Keyword and regex rules, settles clear chat and obvious requests.
+
+    Text is only answered as chat when it has no image word or verb at all
+    and is a question, a greeting, code or long prose; everything the rules
+    are unsure about is left to the model stages.
+    """
+
+    name = "rules"
+
+    async def classify(self, text: str, edit: bool) -> Optional[IntentDecision]:
+        if edit:
+            if _EDIT_REQUESTS.search(text):
+                return IntentDecision(Intent.EDIT, text, self.name)
+            if _QUESTIONS.search(text):
+                return IntentDecision(Intent.TEXT, stage=self.name)
+            return None
+
+        if not any(
+            r.search(text) for r in (_IMAGE_WORDS, _IMAGE_VERBS, _CREATE_VERBS)
+        ):
+            if clearly_chat(text):
+                return IntentDecision(Intent.TEXT, stage=self.name)
+            # a description, another language, or too short to tell
+            return None
+        if _QUESTIONS.search(text) or _NARRATION.search(text):
+            # "how do I draw a circle in OpenGL?" is not an image request
+            return None
+        if any(r.search(text) for r in _IMAGE_REQUESTS):
+            return IntentDecision(Intent.IMAGE, text, self.name)
+        return None
+
+
+class ModelStage(IntentStage):
+    """Ask a model with ``IMAGE_PROMPT``, trusting only answers with a tag."""
+
+    def __init__(self, name: str, model: str = None) -> None:
+        self.name = name
+        self.model = model
+
+    async def classify(self, text: str, edit: bool) -> Optional[IntentDecision]:
+        kwargs = {}
+        if self.model:
+            kwargs["model"] = self.model
+        output = await OpenAIChatInterface.chat_text(
+            messages=[
+                {"role": Role.SYSTEM.value, "content": system_prompts.IMAGE_PROMPT},
+                {"role": Role.USER.value, "content": text[:CLASSIFIER_INPUT_LIMIT]},
+            ],
+            temperature=0,
+            **kwargs,
+        )
+        logger.info(f"image prompt ({self.name}): {output}", extra={"stage": "intent"})
+        if "@" not in output:
+            return None
+        return parse_classifier_output(text, output, self.name)
+
+
+class IntentRouter(metaclass=Singleton):
+    """Decide between a text reply, a new image and an image edit.
+
+    Local rules settle most messages without an API call. What they can't
+    settle is looked up in a cache of recent decisions, then sent to the
+    model stages cheapest first; the current chat model only sees what a
+    small model could not settle.
+    """
+
+    def __init__(
+        self, rules: IntentStage = None, model_stages: List[IntentStage] = None
+    ) -> None:
+        self.rules = rules or RuleStage()
+        if model_stages is None:
+            model_stages = []
+            if INTENT_SMALL_MODEL:
+                model_stages.append(ModelStage("small_model", INTENT_SMALL_MODEL))
+            model_stages.append(ModelStage("llm"))
+        self.model_stages = model_stages
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.decisions = 0
+        self.stage_counts: Dict[str, int] = {}
+        self.stage_seconds: Dict[str, float] = {}
+
+    async def route(self, text: str, edit: bool = False) -> IntentDecision:
+        start = time.perf_counter()
+        decision = await self._settle_locally(text, edit)
+        if decision is None:
+            decision = await self._ask_models(text, edit)
+            self._cache_put(self._cache_key(text, edit), decision)
+
+        self._record(decision.stage, time.perf_counter() - start)
+        return decision
+
+    async def settle(self, text: str, edit: bool = False) -> Optional[IntentDecision]:
+        """The decision of the rules or the cache, None when it takes a model
+        and ``route`` has to be awaited."""
+        start = time.perf_counter()
+        decision = await self._settle_locally(text, edit)
+        if decision is not None:
+            self._record(decision.stage, time.perf_counter() - start)
+        return decision
+
+    async def _settle_locally(self, text: str, edit: bool) -> Optional[IntentDecision]:
+        decision = await self.rules.classify(text, edit)
+        if decision is None:
+            decision = self._cache_get(self._cache_key(text, edit))
+        return decision
+
+    async def _ask_models(self, text: str, edit: bool) -> IntentDecision:
+        last = len(self.model_stages) - 1
+        for i, stage in enumerate(self.model_stages):
+            try:
+                decision = await stage.classify(text, edit)
+            except Exception as e:
+                if i == last:
+                    raise
+                logger.error(f"Intent stage {stage.name} failed: {e}")
+                continue
+            if decision is not None:
+                return decision
+        # the last stage answered without a tag, which means a text reply
+        return IntentDecision(Intent.TEXT, stage=self.model_stages[-1].name)
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            stage: {
+                "count": count,
+                "share": count / self.decisions,
+                "avg_ms": 1000 * self.stage_seconds[stage] / count,
+            }
+            for stage, count in self.stage_counts.items()
+        }
+
+    @staticmethod
+    def _cache_key(text: str, edit: bool) -> tuple:
+        return (edit, _WS.sub(" ", text.strip().lower()))
+
+    def _cache_get(self, key: tuple) -> Optional[IntentDecision]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, decision = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return IntentDecision(decision.intent, decision.prompt, "cache")
+
+    def _cache_put(self, key: tuple, decision: IntentDecision):
+        self._cache[key] = (time.monotonic() + INTENT_CACHE_TTL, decision)
+        if len(self._cache) > INTENT_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _record(self, stage: str, seconds: float):
+        self.decisions += 1
+        self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        if self.decisions % INTENT_STATS_EVERY == 0:
+            summary = ", ".join(
+                f"{stage} {s['share']:.0%} ({s['avg_ms']:.0f}ms)"
+                for stage, s in self.stats().items()
+            )
+            logger.info(f"intent routing: {summary}")
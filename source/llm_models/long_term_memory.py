@@ -0,0 +1,379 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+from chat import ChatMessage
+from constants import Role
+from metrics import STAGE_SECONDS
+from utils import Singleton, logger
+
+from .openai_chat_interface import OpenAIChatInterface
+from .summarizer import transcript
+from .tokenizer import count_message_tokens
+
+# Off by default, every remembered turn and recall costs an embedding call
+MEMORY_ENABLED = os.environ.get("MEMORY_ENABLED", "0") == "1"
+MEMORY_EMBEDDING_MODEL = os.environ.get(
+    "MEMORY_EMBEDDING_MODEL", "text-embedding-3-small"
+)
+# numpy (exact brute force) or hnsw (approximate, needs hnswlib)
+MEMORY_INDEX = os.environ.get("MEMORY_INDEX", "numpy")
+MEMORY_TOP_K = int(os.environ.get("MEMORY_TOP_K", "4"))
+# Prompt tokens recalled turns may take out of the model's budget
+MEMORY_TOKEN_BUDGET = int(os.environ.get("MEMORY_TOKEN_BUDGET", "800"))
+# Turns less similar than this to the new message are not recalled
+MEMORY_MIN_SCORE = float(os.environ.get("MEMORY_MIN_SCORE", "0.3"))
+MEMORY_BATCH_SIZE = int(os.environ.get("MEMORY_BATCH_SIZE", "64"))
+MEMORY_FLUSH_INTERVAL = float(os.environ.get("MEMORY_FLUSH_INTERVAL", "2"))
+# Oldest turns of a chat are forgotten beyond this
+MEMORY_MAX_TURNS = int(os.environ.get("MEMORY_MAX_TURNS", "5000"))
+# Chat indexes kept before the least recently used one is dropped
+MEMORY_MAX_CHATS = int(os.environ.get("MEMORY_MAX_CHATS", "1000"))
+# Seconds a chat index may stay unused before it is dropped, 0 disables it
+MEMORY_IDLE_TTL = int(os.environ.get("MEMORY_IDLE_TTL", "86400"))
+# Approximate memory ceiling for all chat indexes together
+MEMORY_MAX_BYTES = int(os.environ.get("MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+# Longest text embedded per turn
+MEMORY_MAX_CHARS = 2000
+
+MEMORY_HEADER = "Earlier parts of this conversation that may be relevant:"
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class MemoryItem:
+    __slots__ = ("text", "timestamp", "tokens")
+
+    def __init__(self, text: str, timestamp: int) -> None:
+        self.text = text
+        self.timestamp = timestamp
+        self.tokens = count_message_tokens(text)
+
+
+class VectorIndex:
+    """Exact cosine search over unit vectors in one growing NumPy matrix."""
+
+    def __init__(self, dim: int, capacity: int = 64) -> None:
+        # numpy is only imported once a chat has something to remember
+        import numpy as np
+
+        self.dim = dim
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.items: List[MemoryItem] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._vectors.nbytes
+
+    def add(self, vectors: "np.ndarray", items: List[MemoryItem]):
+        import numpy as np
+
+        count = len(self.items)
+        needed = count + len(items)
+        if needed > len(self._vectors):
+            size = max(needed, 2 * len(self._vectors))
+            grown = np.empty((size, self.dim), dtype=np.float32)
+            grown[:count] = self._vectors[:count]
+            self._vectors = grown
+        self._vectors[count:needed] = vectors
+        self.items.extend(items)
+
+    def search(self, vector: "np.ndarray", k: int) -> List[tuple]:
+        import numpy as np
+
+        count = len(self.items)
+        if not count:
+            return []
+        scores = self._vectors[:count] @ vector
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.items[i]) for i in top]
+
+    def drop_oldest(self, count: int):
+        remaining = len(self.items) - count
+        self._vectors[:remaining] = self._vectors[count : count + remaining]
+        del self.items[:count]
+
+
+class HnswIndex:
+    """Approximate search with hnswlib, for chats with very long histories.
+
+    Needs the optional ``hnswlib`` package.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024) -> None:
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError(
+                "MEMORY_INDEX=hnsw needs the hnswlib package: pip install hnswlib"
+            ) from e
+        self.dim = dim
+        self._index = hnswlib.Index(space="ip", dim=dim)
+        self._index.init_index(max_elements=capacity, ef_construction=100, M=16)
+        self._index.set_ef(50)
+        self._next_label = 0
+        self._items: Dict[int, MemoryItem] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def size_bytes(self) -> int:
+        # vectors plus roughly the same again for the graph links
+        return 2 * 4 * self.dim * self._index.get_max_elements()
+
+    def add(self, vectors: "np.ndarray", items: List[MemoryItem]):
+        import numpy as np
+
+        needed = self._next_label + len(items)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        labels = np.arange(self._next_label, needed)
+        self._index.add_items(vectors, labels)
+        self._items.update(zip(labels.tolist(), items))
+        self._next_label = needed
+
+    def search(self, vector: "np.ndarray", k: int) -> List[tuple]:
+        k = min(k, len(self._items))
+        if not k:
+            return []
+        labels, distances = self._index.knn_query(vector, k=k)
+        # inner product space reports 1 - dot product
+        return [
+            (1.0 - float(d), self._items[int(label)])
+            for label, d in zip(labels[0], distances[0])
+        ]
+
+    def drop_oldest(self, count: int):
+        for label in list(self._items)[:count]:
+            self._index.mark_deleted(label)
+            del self._items[label]
+
+
+def _unit(vectors) -> "np.ndarray":
+    import numpy as np
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def turn_text(messages: List[ChatMessage]) -> str:
+    """One document per turn, the user message and the answer together."""
+    return transcript(messages)[:MEMORY_MAX_CHARS]
+
+
+class LongTermMemory(metaclass=Singleton):
+    """Per chat semantic memory of past turns.
+
+    ``remember`` only queues a turn. A background task embeds queued turns in
+    batches of up to ``batch_size`` and adds them to the chat's index.
+    ``recall`` embeds the new message and returns the most similar turns that
+    have already left the short term history, as one system message that
+    fits in ``MEMORY_TOKEN_BUDGET``. Chats with nothing indexed yet skip the
+    embedding call entirely.
+
+    Indexes live in the process only and start empty after a restart; with
+    ``WEB_CONCURRENCY`` above 1 each chat stays on one worker so its memory
+    does too. Like ``ConversationStore``, indexes idle for ``idle_ttl``
+    seconds are dropped, then the least recently used ones while there are
+    more than ``max_chats`` or they take more than ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = MEMORY_ENABLED,
+        model: str = MEMORY_EMBEDDING_MODEL,
+        index: str = MEMORY_INDEX,
+        batch_size: int = MEMORY_BATCH_SIZE,
+        flush_interval: float = MEMORY_FLUSH_INTERVAL,
+        max_turns: int = MEMORY_MAX_TURNS,
+        max_chats: int = MEMORY_MAX_CHATS,
+        idle_ttl: int = MEMORY_IDLE_TTL,
+        max_bytes: int = MEMORY_MAX_BYTES,
+    ) -> None:
+        self.enabled = enabled
+        self.model = model
+        self.index_factory = HnswIndex if index == "hnsw" else VectorIndex
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_turns = max_turns
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[int, object]" = OrderedDict()
+        self._last_used: Dict[int, float] = {}
+        self._pending: List[tuple] = []
+        # chats of the batch being embedded, and those of them forget() was
+        # called for meanwhile, whose turns are then not indexed
+        self._embedding: Set[int] = set()
+        self._forgotten: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.embedded = 0
+        self.recalled = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self._indexes.values())
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(index.size_bytes for index in self._indexes.values())
+
+    def remember(self, chat_id: int, messages: List[ChatMessage]):
+        """Queue a finished turn for embedding without blocking the caller."""
+        if not self.enabled:
+            return
+        text = turn_text(messages)
+        if not text:
+            return
+        self._pending.append((chat_id, MemoryItem(text, messages[0].timestamp)))
+        self._ensure_started()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def recall(
+        self, chat_id: int, query: str, before: int = None, max_tokens: int = None
+    ) -> Optional[dict]:
+        """System message with the past turns most relevant to ``query``.
+
+        Only turns older than the ``before`` timestamp are considered, the
+        rest are still in the prompt. Returns None when nothing fits.
+        """
+        index = self._indexes.get(chat_id)
+        if not self.enabled or not index or not query:
+            return None
+        if max_tokens is None:
+            max_tokens = MEMORY_TOKEN_BUDGET
+        self._touch(chat_id)
+
+        try:
+            with STAGE_SECONDS.time(stage="memory"):
+                vector = _unit((await self._embed([query]))[0])
+        except Exception as e:
+            # answer without the memory rather than failing the turn
+            logger.error(f"Memory recall failed: {e}")
+            return None
+        # ask for extra hits, the newest may still be in the prompt
+        hits = index.search(vector, 2 * MEMORY_TOP_K)
+
+        budget = max_tokens - count_message_tokens(MEMORY_HEADER)
+        chosen: List[MemoryItem] = []
+        for score, item in hits:
+            if score < MEMORY_MIN_SCORE or len(chosen) == MEMORY_TOP_K:
+                break
+            if before is not None and item.timestamp >= before:
+                continue
+            if item.tokens <= budget:
+                chosen.append(item)
+                budget -= item.tokens
+        if not chosen:
+            return None
+        self.recalled += len(chosen)
+        # oldest first so the model reads them as a timeline
+        chosen.sort(key=lambda item: item.timestamp)
+        content = "\n\n".join([MEMORY_HEADER] + [item.text for item in chosen])
+        return {"role": Role.SYSTEM.value, "content": content}
+
+    def forget(self, chat_id: int):
+        if chat_id in self._embedding:
+            self._forgotten.add(chat_id)
+        self._indexes.pop(chat_id, None)
+        self._last_used.pop(chat_id, None)
+        self._pending = [entry for entry in self._pending if entry[0] != chat_id]
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: self.batch_size]
+                await self._index_batch(batch)
+
+    async def _index_batch(self, batch: List[tuple]):
+        self._embedding = {chat_id for chat_id, _ in batch}
+        try:
+            with STAGE_SECONDS.time(stage="embedding"):
+                vectors = _unit(await self._embed([item.text for _, item in batch]))
+        except Exception as e:
+            # memory is best effort, the turns are still in the archive
+            self.failed += len(batch)
+            logger.error(f"Embedding {len(batch)} turns failed: {e}")
+            return
+        finally:
+            forgotten, self._forgotten = self._forgotten, set()
+            self._embedding = set()
+
+        by_chat: Dict[int, List[int]] = {}
+        for i, (chat_id, _) in enumerate(batch):
+            by_chat.setdefault(chat_id, []).append(i)
+        for chat_id, rows in by_chat.items():
+            if chat_id in forgotten:
+                # /reset while the batch was embedded
+                continue
+            index = self._indexes.get(chat_id)
+            if index is None:
+                index = self._indexes[chat_id] = self.index_factory(vectors.shape[1])
+            self._touch(chat_id)
+            index.add(vectors[rows], [batch[i][1] for i in rows])
+            if len(index) > self.max_turns:
+                index.drop_oldest(len(index) - self.max_turns)
+        self.embedded += len(batch)
+        self.evict()
+
+    def evict(self):
+        """Drop idle indexes, then least recently used ones until under the
+        limits."""
+        if self.idle_ttl > 0:
+            deadline = time.monotonic() - self.idle_ttl
+            for chat_id in list(self._indexes):
+                if self._last_used[chat_id] > deadline:
+                    # the dict is ordered by last use, the rest is newer
+                    break
+                self._drop(chat_id)
+
+        total_bytes = self.total_bytes
+        for chat_id in list(self._indexes):
+            if len(self._indexes) <= self.max_chats and total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self._drop(chat_id)
+
+    def _touch(self, chat_id: int):
+        self._indexes.move_to_end(chat_id)
+        self._last_used[chat_id] = time.monotonic()
+
+    def _drop(self, chat_id: int) -> int:
+        self._last_used.pop(chat_id, None)
+        index = self._indexes.pop(chat_id)
+        logger.info(f"evicted memory index: {chat_id}")
+        return index.size_bytes
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        return await OpenAIChatInterface.embed(texts=texts, model=self.model)
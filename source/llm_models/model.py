@@ -1,7 +1,48 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from state import get_state_backend
 from utils import Singleton
 
+from .model_registry import CHAT, IMAGE, ModelSpec, get_spec
+
+# Seconds between reloads of a chat's models from a shared state backend
+MODEL_REFRESH_INTERVAL = 5.0
+# Chats whose model choice is kept in memory
+MODEL_CHAT_CACHE = 10000
+# Send short and simple turns to ROUTING_SMALL_MODEL, 0 always uses CHAT_MODEL
+MODEL_ROUTING = os.environ.get("MODEL_ROUTING", "1") == "1"
+ROUTING_SMALL_MODEL = os.environ.get("ROUTING_SMALL_MODEL", "gpt-4.1-mini")
+# Longest text still counted as a short turn
+ROUTING_SHORT_CHARS = int(os.environ.get("ROUTING_SHORT_CHARS", "280"))
+# Prompts above this many tokens go to the large model whatever the text
+ROUTING_SMALL_MAX_PROMPT = int(os.environ.get("ROUTING_SMALL_MAX_PROMPT", "3000"))
+
+# Requests that deserve the large model even when they are short
+_COMPLEX = re.compile(
+    r"```|\b(explain|why|analy[sz]e|compare|prove|derive|calculate|solve|code|"
+    r"debug|refactor|implement|write|translate|summari[sz]e|step by step)\b"
+    r"|解释|为什么|分析|证明|计算|代码|翻译|总结",
+    re.IGNORECASE,
+)
+
+
+def is_simple_turn(text: str) -> bool:
+    return len(text) <= ROUTING_SHORT_CHARS and not _COMPLEX.search(text)
+
 
 class Model(metaclass=Singleton):
+    """Bot wide default models, per chat overrides and automatic routing.
+
+    A chat picks its models with /model, the choice is kept in the state
+    backend. Chats without a chat model override are routed: short, simple
+    text turns go to ``ROUTING_SMALL_MODEL``, long, complex and vision turns
+    to the default ``CHAT_MODEL``.
+    """
+
     # gpt-4o
     CHAT_MODEL = "gpt-4.1"
     IMAGE_MODEL = "gpt-image-1"
@@ -9,6 +50,9 @@ class Model(metaclass=Singleton):
     def __init__(self) -> None:
         self.current_chat_model: str
         self.current_image_model: str
+        # chat id: (loaded at, chat model, image model)
+        self._chats: "OrderedDict[int, Tuple[float, str, str]]" = OrderedDict()
+        self.routes: Dict[str, int] = {}
 
     def get_current_chat_model(self):
         return self.current_chat_model
@@ -16,8 +60,84 @@ class Model(metaclass=Singleton):
     def get_current_image_model(self):
         return self.current_image_model
 
+    def get_prompt_token_budget(self, model_name: str = None) -> int:
+        if model_name is None:
+            model_name = self.current_chat_model
+        return get_spec(model_name).prompt_budget
+
     def set_current_chat_model(self, model_name):
         self.current_chat_model = model_name
 
     def set_current_image_model(self, model_name):
         self.current_image_model = model_name
+
+    def chat_override(self, chat_id: int) -> Optional[str]:
+        """Chat model picked by the chat, None when it is routed automatically."""
+        entry = self._chats.get(chat_id)
+        return entry[1] if entry else None
+
+    def image_model_for(self, chat_id: int) -> str:
+        entry = self._chats.get(chat_id)
+        return (entry and entry[2]) or self.current_image_model
+
+    def route(
+        self, chat_id: int, text: str, prompt_tokens: int = 0, vision: bool = False
+    ) -> ModelSpec:
+        """Chat model for one turn of a chat."""
+        spec = None
+        override = self.chat_override(chat_id)
+        if override:
+            spec = get_spec(override)
+            if vision and not spec.vision:
+                spec = None
+        if spec is None:
+            spec = get_spec(self.current_chat_model)
+            if (
+                MODEL_ROUTING
+                and not override
+                and not vision
+                and prompt_tokens <= ROUTING_SMALL_MAX_PROMPT
+                and is_simple_turn(text)
+            ):
+                spec = get_spec(ROUTING_SMALL_MODEL)
+        self.routes[spec.name] = self.routes.get(spec.name, 0) + 1
+        return spec
+
+    async def set_chat_model(self, chat_id: int, kind: str, model_name: str = None):
+        """Set a chat's chat or image model, None goes back to the default."""
+        backend = get_state_backend()
+        key = f"model:{chat_id}:{kind}"
+        if model_name:
+            await backend.set(key, model_name)
+        else:
+            await backend.delete(key)
+
+        _, chat_model, image_model = self._chats.get(chat_id, (0.0, None, None))
+        if kind == CHAT:
+            chat_model = model_name
+        elif kind == IMAGE:
+            image_model = model_name
+        self._remember(chat_id, chat_model, image_model)
+
+    async def refresh(self, chat_id: int):
+        """Load a chat's models from the state backend, at most every few seconds."""
+        entry = self._chats.get(chat_id)
+        if entry is not None:
+            backend = get_state_backend()
+            fresh = time.monotonic() - entry[0] < MODEL_REFRESH_INTERVAL
+            if fresh or not backend.shared:
+                # a local backend only changes through set_chat_model
+                self._chats.move_to_end(chat_id)
+                return
+        backend = get_state_backend()
+        self._remember(
+            chat_id,
+            await backend.get(f"model:{chat_id}:{CHAT}"),
+            await backend.get(f"model:{chat_id}:{IMAGE}"),
+        )
+
+    def _remember(self, chat_id: int, chat_model: str, image_model: str):
+        self._chats[chat_id] = (time.monotonic(), chat_model, image_model)
+        self._chats.move_to_end(chat_id)
+        if len(self._chats) > MODEL_CHAT_CACHE:
+            self._chats.popitem(last=False)
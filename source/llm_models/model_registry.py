@@ -0,0 +1,160 @@
+from typing import Dict, List, Optional
+
+CHAT = "chat"
+IMAGE = "image"
+EMBEDDING = "embedding"
+
+# Latency classes, fastest first
+FAST = "fast"
+STANDARD = "standard"
+SLOW = "slow"
+
+
+class ModelSpec:
+    """What the bot needs to know about one model.
+
+    Prices are US dollars per million tokens. ``prompt_budget`` stays well
+    below ``context_window`` so long chats don't pay for input tokens that
+    add little.
+    """
+
+    __slots__ = (
+        "name",
+        "kind",
+        "context_window",
+        "prompt_budget",
+        "input_price",
+        "output_price",
+        "latency",
+        "vision",
+        "stream",
+        "edit",
+        "edit_images",
+        "max_image_side",
+        "image_quality",
+        "image_format",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        kind: str = CHAT,
+        context_window: int = 0,
+        prompt_budget: int = 5120,
+        input_price: float = 0.0,
+        output_price: float = 0.0,
+        latency: str = STANDARD,
+        vision: bool = False,
+        stream: bool = True,
+        edit: bool = False,
+        edit_images: int = 1,
+        max_image_side: int = 1024,
+        image_quality: str = None,
+        image_format: str = None,
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.context_window = context_window
+        self.prompt_budget = prompt_budget
+        self.input_price = input_price
+        self.output_price = output_price
+        self.latency = latency
+        self.vision = vision
+        self.stream = stream
+        self.edit = edit
+        # input images one edit request takes
+        self.edit_images = edit_images
+        self.max_image_side = max_image_side
+        # quality and response_format sent with image requests, None leaves
+        # them out for models that don't take them
+        self.image_quality = image_quality
+        self.image_format = image_format
+
+    def cost(self, prompt_tokens: int, completion_tokens: int = 0) -> float:
+        return (
+            prompt_tokens * self.input_price + completion_tokens * self.output_price
+        ) / 1_000_000
+
+
+MODELS: Dict[str, ModelSpec] = {
+    spec.name: spec
+    for spec in [
+        ModelSpec("gpt-4.1", CHAT, 1047576, 8192, 2.0, 8.0, STANDARD, vision=True),
+        ModelSpec("gpt-4.1-mini", CHAT, 1047576, 8192, 0.4, 1.6, FAST, vision=True),
+        ModelSpec("gpt-4.1-nano", CHAT, 1047576, 4096, 0.1, 0.4, FAST, vision=True),
+        ModelSpec("gpt-4o", CHAT, 128000, 8192, 2.5, 10.0, STANDARD, vision=True),
+        ModelSpec("gpt-4o-mini", CHAT, 128000, 8192, 0.15, 0.6, FAST, vision=True),
+        ModelSpec("gpt-4-turbo", CHAT, 128000, 8192, 10.0, 30.0, SLOW, vision=True),
+        ModelSpec("gpt-3.5-turbo", CHAT, 16385, 4096, 0.5, 1.5, FAST),
+        ModelSpec(
+            "gpt-image-1",
+            IMAGE,
+            stream=False,
+            edit=True,
+            edit_images=16,
+            max_image_side=1536,
+            image_quality="high",
+        ),
+        ModelSpec(
+            "dall-e-3",
+            IMAGE,
+            stream=False,
+            image_quality="standard",
+            image_format="b64_json",
+        ),
+        # dall-e-2 only edits square RGBA PNGs through their transparent
+        # parts, which Telegram's JPEG photos never have; edits fall back to
+        # the default image model
+        ModelSpec(
+            "dall-e-2",
+            IMAGE,
+            stream=False,
+            image_quality="standard",
+            image_format="b64_json",
+        ),
+        ModelSpec("text-embedding-3-small", EMBEDDING, 8191, 0, 0.02, stream=False),
+        ModelSpec("text-embedding-3-large", EMBEDDING, 8191, 0, 0.13, stream=False),
+    ]
+}
+
+# Short names accepted by /model
+ALIASES = {
+    "4": "gpt-4-turbo",
+    "gpt-4": "gpt-4-turbo",
+    "4o": "gpt-4o",
+    "3": "gpt-3.5-turbo",
+    "mini": "gpt-4.1-mini",
+    "nano": "gpt-4.1-nano",
+}
+
+
+def get_spec(name: str) -> ModelSpec:
+    """Spec of a model, unknown models get the defaults of a chat model."""
+    spec = MODELS.get(name)
+    if spec is None:
+        spec = ModelSpec(name)
+    return spec
+
+
+def models_of(kind: str) -> List[ModelSpec]:
+    return [spec for spec in MODELS.values() if spec.kind == kind]
+
+
+def resolve(text: str) -> Optional[ModelSpec]:
+    """Find the model a user means by a name, an alias, or a unique start or
+    part of a name."""
+    text = text.strip().lower()
+    if not text:
+        return None
+    if text in ALIASES:
+        return MODELS[ALIASES[text]]
+    selectable = {
+        name: spec for name, spec in MODELS.items() if spec.kind in (CHAT, IMAGE)
+    }
+    if text in selectable:
+        return selectable[text]
+    for match in (str.startswith, str.__contains__):
+        matches = [spec for name, spec in selectable.items() if match(name, text)]
+        if len(matches) == 1:
+            return matches[0]
+    return None
@@ -1,105 +1,260 @@
-import os
+import asyncio
 import base64
-from io import BytesIO
-from PIL import Image
+import os
+import threading
+from typing import List
 
+import httpx
 from constants import Role
-from openai import OpenAI
+from metrics import CHAT_TOKENS, COST, TOKENS
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from scheduler import OutboundScheduler, Priority
 from utils import logger
 
+from .image_pipeline import ImageBytes, prepare_edit_image
 from .model import Model
+from .model_registry import get_spec
+from .response_cache import ResponseCache
+
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "20"))
+# Rough token cost of one image plus the reply when budgeting vision calls
+VISION_IMAGE_TOKENS = 1500
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> AsyncOpenAI:
+    """One pooled HTTP client shared by every handler, so concurrent chats
+    reuse keep-alive connections instead of opening a new one per request.
+    Built on first use rather than at import, see ``BotCore.warm_up``."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AsyncOpenAI(
+                    api_key=os.environ.get("OPENAI_TOKEN"),
+                    # retries go through the scheduler, which knows the rate limits
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                        ),
+                    ),
+                )
+    return _client
+
+
+cache = ResponseCache()
+scheduler = OutboundScheduler()
+
+
+def _estimate_tokens(messages, max_tokens: int) -> int:
+    """Tokens a request counts against the TPM limit, without tokenizing."""
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return prompt_chars // 4 + max_tokens
+
 
-client = OpenAI(api_key=os.environ.get("OPENAI_TOKEN"))
+def _image_options(model: str, **kwargs) -> dict:
+    """The quality and response_format a model takes, given ones first."""
+    spec = get_spec(model)
+    options = {
+        "quality": kwargs.get("quality", spec.image_quality),
+        "response_format": spec.image_format,
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def _log_usage(model: str, usage, chat_id: int = None):
+    cost = get_spec(model).cost(usage.prompt_tokens, usage.completion_tokens)
+    logger.info(
+        f"token used: {usage.total_tokens} ({model}, ${cost:.5f})",
+        extra={"chat_id": chat_id, "stage": "usage", "tokens": usage.total_tokens},
+    )
+    TOKENS.inc(usage.prompt_tokens, model=model, type="prompt")
+    TOKENS.inc(usage.completion_tokens, model=model, type="completion")
+    COST.inc(cost, model=model)
+    if chat_id is not None:
+        CHAT_TOKENS.inc(usage.total_tokens, chat=chat_id)
 
 
 class OpenAIChatInterface:
     @staticmethod
-    def chat_text(*args, **kwargs):
+    async def chat_text(*args, **kwargs):
         model = kwargs.get("model", Model().get_current_chat_model())
         messages = kwargs.get("messages", [])
         temperature = kwargs.get("temperature", 0.8)
         max_tokens = kwargs.get("max_tokens", 3600)
+        priority = kwargs.get("priority", Priority.HIGH)
+        # cache low temperature completions unless told otherwise
+        use_cache = kwargs.get("cache", ResponseCache.cacheable(temperature))
 
-        response = client.chat.completions.create(
+        if use_cache:
+            cache_key = ResponseCache.make_key(
+                "chat", model, messages, temperature, max_tokens=max_tokens
+            )
+            cached = await cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        response = await scheduler.run(
+            "chat",
+            get_client().chat.completions.create,
+            priority=priority,
+            tokens=_estimate_tokens(messages, max_tokens),
             model=model,
             messages=messages,
             temperature=temperature,
             max_tokens=max_tokens,
         )
-        logger.info(f"token used: {response.usage.total_tokens}")
-        return response.choices[0].message.content.strip()
+        _log_usage(model, response.usage, kwargs.get("chat_id"))
+        content = response.choices[0].message.content.strip()
+        if use_cache:
+            await cache.put(cache_key, content)
+        return content
+
+    @staticmethod
+    async def chat_text_stream(*args, **kwargs):
+        """Same as ``chat_text`` but yields the reply in pieces as it arrives."""
+        model = kwargs.get("model", Model().get_current_chat_model())
+        messages = kwargs.get("messages", [])
+        temperature = kwargs.get("temperature", 0.8)
+        max_tokens = kwargs.get("max_tokens", 3600)
+
+        # the chat slot is held until the whole reply was read
+        async with scheduler.hold(
+            "chat",
+            get_client().chat.completions.create,
+            priority=Priority.HIGH,
+            tokens=_estimate_tokens(messages, max_tokens),
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        ) as stream:
+            try:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        _log_usage(model, chunk.usage, kwargs.get("chat_id"))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                # give the connection back to the pool if the caller stops early
+                await stream.close()
 
     @staticmethod
-    def chat_image(*args, **kwargs):
+    async def chat_image(*args, **kwargs) -> bytes:
         model = kwargs.get("model", Model().get_current_image_model())
         prompt = kwargs.get("prompt", "")
         n = kwargs.get("n", 1)
         size = kwargs.get("size", "1024x1024")
-        quality = kwargs.get("quality", "high")
 
-        response = client.images.generate(
+        response = await scheduler.run(
+            "images",
+            get_client().images.generate,
+            priority=Priority.LOW,
             model=model,
             prompt=prompt,
             n=n,
             size=size,
-            quality=quality,
+            **_image_options(model, **kwargs),
         )
-        return response.data[0].b64_json
+        return base64.b64decode(response.data[0].b64_json)
 
     @staticmethod
-    def edit_image(*args, **kwargs):
+    async def edit_image(*args, **kwargs) -> bytes:
         """
         Creates a new image based on the prompt and description of the original image.
+        ``images`` edits several photos in one request, as far as the model
+        takes them.
         """
 
         prompt = kwargs.get("prompt", "")
-        base64_image = kwargs.get("base64_image", "")
-        quality = kwargs.get("quality", "high")
-
-        # Decode the base64 string and load it with PIL
-        image_data = base64.b64decode(base64_image)
-        img = Image.open(BytesIO(image_data))
-
-        # Ensure the image has an alpha channel so the transparent mask aligns
-        if img.mode != "RGBA":
-            img = img.convert("RGBA")
-
-        # Serialize image and mask into in-memory byte buffers
-        image_buffer = BytesIO()
-        img.save(image_buffer, format="PNG")
-        image_buffer.seek(0)
+        image: ImageBytes = kwargs.get("image", b"")
+        images: List[ImageBytes] = kwargs.get("images", [image])
+        model = kwargs.get("model", Model().get_current_image_model())
 
-        # Provide a pseudo-filename so the OpenAI SDK infers content type
-        image_buffer.name = "image.png"
+        images = images[: get_spec(model).edit_images]
+        image_files = await asyncio.gather(
+            *(prepare_edit_image(data, model) for data in images)
+        )
 
         try:
-            response = client.images.edit(
-                model="gpt-image-1",
-                image=image_buffer,
+            response = await scheduler.run(
+                "images",
+                get_client().images.edit,
+                priority=Priority.LOW,
+                model=model,
+                image=image_files[0] if len(image_files) == 1 else list(image_files),
                 prompt=prompt,
                 n=1,
+                # edits keep the model's default quality
+                **_image_options(model, quality=None),
             )
-            return response.data[0].b64_json
+            return base64.b64decode(response.data[0].b64_json)
         except Exception as e:
             logger.error(f"Error editing image: {e}")
             raise e
 
     @staticmethod
-    def chat_vision(*args, **kwargs):
+    async def chat_vision(*args, **kwargs):
         caption = kwargs.get("caption", "")
         image_url = kwargs.get("image_url", "")
+        # several photos, e.g. an album, are sent in one request
+        image_urls = kwargs.get("image_urls", [image_url])
+        # stable id of the photo, e.g. Telegram's file_unique_id, enables caching
+        image_id = kwargs.get("image_id", None)
+        image_ids = kwargs.get("image_ids", None if image_id is None else [image_id])
+        model = kwargs.get("model", Model().get_current_chat_model())
 
-        response = client.chat.completions.create(
-            model=Model().get_current_chat_model(),
-            messages=[
-                {
-                    "role": Role.USER.value,
-                    "content": [
-                        {"type": "text", "text": caption},
-                        {"type": "image_url", "image_url": {"url": image_url}},
-                    ],
-                },
-            ],
+        if image_ids is not None:
+            cache_key = ResponseCache.make_key("vision", model, [caption, *image_ids])
+            cached = await cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        content = [{"type": "text", "text": caption}]
+        content.extend(
+            {"type": "image_url", "image_url": {"url": url}} for url in image_urls
+        )
+        response = await scheduler.run(
+            "vision",
+            get_client().chat.completions.create,
+            tokens=_estimate_tokens([], VISION_IMAGE_TOKENS * len(image_urls)),
+            model=model,
+            messages=[{"role": Role.USER.value, "content": content}],
+        )
+        _log_usage(model, response.usage, kwargs.get("chat_id"))
+        content = response.choices[0].message.content
+        if image_ids is not None:
+            await cache.put(cache_key, content)
+        return content
+
+    @staticmethod
+    async def embed(*args, **kwargs):
+        """Embedding vectors of ``texts``, in order, from one batched request."""
+        texts = kwargs.get("texts", [])
+        model = kwargs.get("model", "text-embedding-3-small")
+
+        response = await scheduler.run(
+            "embeddings",
+            get_client().embeddings.create,
+            priority=Priority.LOW,
+            tokens=_estimate_tokens([{"content": t} for t in texts], 0),
+            model=model,
+            input=texts,
         )
-        logger.info(f"token used: {response.usage.total_tokens}")
-        return response.choices[0].message.content
+        cost = get_spec(model).cost(response.usage.prompt_tokens)
+        TOKENS.inc(response.usage.prompt_tokens, model=model, type="prompt")
+        COST.inc(cost, model=model)
+        return [item.embedding for item in response.data]
+
+    @staticmethod
+    async def close():
+        """Release the pooled HTTP connections."""
+        if _client is not None:
+            await _client.close()
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from utils import Singleton, logger
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "86400"))
+# SQLite file for the on-disk tier, empty keeps the cache in memory only
+RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB", "")
+RESPONSE_CACHE_DISK_ENTRIES = int(
+    os.environ.get("RESPONSE_CACHE_DISK_ENTRIES", "100000")
+)
+# Completions above this temperature are random enough not to be cached
+RESPONSE_CACHE_MAX_TEMPERATURE = float(
+    os.environ.get("RESPONSE_CACHE_MAX_TEMPERATURE", "0.2")
+)
+# Reuse a generated image for a repeated prompt
+RESPONSE_CACHE_IMAGES = os.environ.get("RESPONSE_CACHE_IMAGES", "0") == "1"
+# Prune the disk tier every this many writes
+PRUNE_EVERY = 1000
+
+_WS = re.compile(r"\s+")
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return _WS.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ResponseCache(metaclass=Singleton):
+    """Two tier cache for repeatable OpenAI responses.
+
+    A bounded LRU in memory sits in front of an optional SQLite table, both
+    with a TTL. Keys hash the call kind, model, whitespace normalized
+    messages and sampling parameters, see ``make_key``. Disk reads and
+    writes run in a worker thread.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        ttl: int = RESPONSE_CACHE_TTL,
+        db_path: str = RESPONSE_CACHE_DB,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(kind: str, model: str, messages, temperature=None, **params) -> str:
+        payload = json.dumps(
+            [kind, model, _normalize(messages), temperature, params],
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def cacheable(temperature: float) -> bool:
+        return temperature is not None and temperature <= RESPONSE_CACHE_MAX_TEMPERATURE
+
+    async def get(self, key: str) -> Optional[str]:
+        kind = key.split(":", 1)[0]
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] < now:
+            del self._memory[key]
+            entry = None
+        if entry is None and self._db is not None:
+            row = await asyncio.to_thread(self._read, key)
+            if row is not None and row[0] >= now:
+                entry = row
+                self._remember(key, row[0], row[1])
+        if entry is None:
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+            return None
+        if key in self._memory:
+            self._memory.move_to_end(key)
+        self.hits[kind] = self.hits.get(kind, 0) + 1
+        return entry[1]
+
+    async def put(self, key: str, value: str, ttl: int = None):
+        expires = time.time() + (ttl or self.ttl)
+        self._remember(key, expires, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._write, key, value, expires)
+
+    def _read(self, key: str) -> Optional[tuple]:
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT expires, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _write(self, key: str, value: str, expires: float):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, value, expires),
+            )
+            self._db.commit()
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune()
+
+    def stats(self) -> Dict[str, dict]:
+        kinds = set(self.hits) | set(self.misses)
+        stats = {}
+        for kind in kinds:
+            hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+            stats[kind] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses),
+            }
+        return stats
+
+    def _remember(self, key: str, expires: float, value: str):
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _prune(self):
+        self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM responses WHERE key NOT IN "
+            "(SELECT key FROM responses ORDER BY expires DESC LIMIT ?)",
+            (RESPONSE_CACHE_DISK_ENTRIES,),
+        )
+        self._db.commit()
+        logger.info(f"response cache: {self.stats()}")
@@ -0,0 +1,130 @@
+import asyncio
+import os
+from typing import Dict, List
+
+from chat import ChatMessage
+from constants import ChatType, Role, system_prompts
+from metrics import STAGE_SECONDS
+from scheduler import Priority
+from utils import Singleton, logger
+
+from .openai_chat_interface import OpenAIChatInterface
+from .tokenizer import count_message_tokens
+
+# Fold old turns into a running summary instead of dropping them
+SUMMARY_ENABLED = os.environ.get("SUMMARY_ENABLED", "1") == "1"
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4.1-mini")
+# Summarize once the history and the turns waiting for it pass this many tokens
+SUMMARY_TRIGGER_TOKENS = int(os.environ.get("SUMMARY_TRIGGER_TOKENS", "3000"))
+# Newest messages always kept verbatim
+SUMMARY_KEEP_MESSAGES = int(os.environ.get("SUMMARY_KEEP_MESSAGES", "6"))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", "400"))
+# Messages that left the window kept for the next summary, oldest dropped first
+SUMMARY_MAX_OVERFLOW = 200
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+
+def transcript(messages: List[ChatMessage]) -> str:
+    """Plain text of messages, one ``role: content`` line each."""
+    lines = []
+    for message in messages:
+        if message.type is ChatType.IMAGE and message.role is Role.ASSISTANT:
+            lines.append(f"assistant: [sent an image of: {message.content}]")
+        elif message.content:
+            lines.append(f"{message.role.value}: {message.content}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer(metaclass=Singleton):
+    """Keeps a running summary of the oldest part of every chat.
+
+    After a turn, a chat whose history and overflow (messages that already
+    left the window) pass ``SUMMARY_TRIGGER_TOKENS`` is summarized by a
+    background task, never on the reply path. The overflow and all but the
+    newest ``SUMMARY_KEEP_MESSAGES`` messages are folded, together with the
+    previous summary, into a new one that is sent after the system prompt.
+    At most one summary per chat is in flight.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = SUMMARY_ENABLED,
+        model: str = SUMMARY_MODEL,
+        trigger_tokens: int = SUMMARY_TRIGGER_TOKENS,
+        keep_messages: int = SUMMARY_KEEP_MESSAGES,
+    ) -> None:
+        self.enabled = enabled
+        self.model = model
+        self.trigger_tokens = trigger_tokens
+        self.keep_messages = keep_messages
+        self._running: Dict[int, asyncio.Task] = {}
+        self.summaries = 0
+        self.failed = 0
+
+    def due(self, history) -> bool:
+        if len(history.overflow) >= self.keep_messages:
+            return True
+        tokens = history.total_tokens + history.overflow_tokens
+        return (
+            tokens > self.trigger_tokens
+            and len(history.short_msgs) > self.keep_messages
+        )
+
+    def schedule(self, store, history):
+        """Start summarizing ``history`` in the background if it is due."""
+        chat_id = history.chat_id
+        if not self.enabled or chat_id in self._running or not self.due(history):
+            return
+        task = asyncio.get_running_loop().create_task(self._summarize(store, history))
+        self._running[chat_id] = task
+        task.add_done_callback(lambda _: self._running.pop(chat_id, None))
+
+    async def close(self):
+        for task in list(self._running.values()):
+            task.cancel()
+
+    async def _summarize(self, store, history):
+        keep = len(history.short_msgs) - self.keep_messages
+        segment = list(history.overflow)
+        segment.extend(list(history.short_msgs)[: max(keep, 0)])
+        text = transcript(segment)
+        if not text:
+            return
+        previous = history.summary.content if history.summary else ""
+        previous = previous[len(SUMMARY_HEADER) :].strip()
+
+        try:
+            with STAGE_SECONDS.time(stage="summary"):
+                reply = await OpenAIChatInterface.chat_text(
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": Role.SYSTEM.value,
+                            "content": system_prompts.SUMMARY_PROMPT,
+                        },
+                        {
+                            "role": Role.USER.value,
+                            "content": f"Summary so far:\n{previous or '(none)'}\n\n"
+                            f"New messages:\n{text}",
+                        },
+                    ],
+                    temperature=0.2,
+                    max_tokens=SUMMARY_MAX_TOKENS,
+                    priority=Priority.LOW,
+                    cache=False,
+                )
+        except Exception as e:
+            # the messages stay in the overflow for the next attempt
+            self.failed += 1
+            logger.error(f"Summarizing chat {history.chat_id} failed: {e}")
+            return
+
+        summary = ChatMessage(
+            role=Role.SYSTEM,
+            username="Summary",
+            content=f"{SUMMARY_HEADER}\n{reply}",
+        )
+        summary.tokens = count_message_tokens(summary.content)
+        if await store.apply_summary(history, summary, segment):
+            self.summaries += 1
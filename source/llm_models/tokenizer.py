@@ -0,0 +1,47 @@
+import threading
+
+from utils import logger
+
+# Tokens the chat format adds around every message
+MSG_TOKEN_OVERHEAD = 4
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                _encoding = _load_encoding()
+                _encoding_loaded = True
+    return _encoding
+
+
+def _load_encoding():
+    # tiktoken is imported and its ranks loaded on first use, not at startup
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its ranks on first use, fall back to an
+        # estimate rather than failing the turn when that is not possible
+        logger.error(f"tiktoken unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of a text, approximated by length when tiktoken is missing."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(content: str) -> int:
+    return count_tokens(content) + MSG_TOKEN_OVERHEAD
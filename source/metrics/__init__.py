@@ -0,0 +1,18 @@
+import os
+
+from .instruments import (
+    CHAT_TOKENS,
+    COST,
+    ERRORS,
+    STAGE_SECONDS,
+    STARTUP_SECONDS,
+    TOKENS,
+    TURN_SECONDS,
+    UPDATES,
+)
+from .registry import Counter, Gauge, Histogram, MetricsRegistry
+from .server import mount_metrics, start_metrics_server
+
+# Extra port for /metrics and /ready, e.g. when polling; the webhook port
+# always serves them. 0 turns the extra port off
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
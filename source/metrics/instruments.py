@@ -0,0 +1,46 @@
+import os
+
+from .registry import Counter, Gauge, Histogram
+
+# Chats tracked by the per chat counters before the rest is counted as "other"
+METRICS_MAX_CHATS = int(os.environ.get("METRICS_MAX_CHATS", "1000"))
+
+STAGE_SECONDS = Histogram(
+    "dalibot_stage_seconds",
+    "Seconds spent in one stage of a turn",
+    labels=("stage",),
+)
+TURN_SECONDS = Histogram(
+    "dalibot_turn_seconds",
+    "Seconds from receiving an update to the last reply, per kind of turn",
+    labels=("kind",),
+)
+UPDATES = Counter(
+    "dalibot_updates_total",
+    "Telegram updates received",
+)
+ERRORS = Counter(
+    "dalibot_errors_total",
+    "Errors raised by handlers, by exception type",
+    labels=("error",),
+)
+TOKENS = Counter(
+    "dalibot_tokens_total",
+    "OpenAI tokens used, by model and prompt or completion",
+    labels=("model", "type"),
+)
+CHAT_TOKENS = Counter(
+    "dalibot_chat_tokens_total",
+    "OpenAI tokens used per chat",
+    labels=("chat",),
+    max_series=METRICS_MAX_CHATS,
+)
+COST = Counter(
+    "dalibot_cost_dollars_total",
+    "Estimated OpenAI cost in US dollars, by model",
+    labels=("model",),
+)
+STARTUP_SECONDS = Gauge(
+    "dalibot_startup_seconds",
+    "Seconds from the first import until updates could be served",
+)
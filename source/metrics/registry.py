@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from utils import Singleton
+
+# Label value used once a metric has reached its series limit
+OVERFLOW_LABEL = "other"
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# (labels, value) pairs of one metric
+Samples = List[Tuple[Dict[str, str], float]]
+# name, type, help and samples, as returned by a collector
+Family = Tuple[str, str, str, Samples]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Base of the metric types, one series per combination of label values.
+
+    Updates may come from worker threads, so they take a lock. Once
+    ``max_series`` label combinations exist, new ones are folded into a
+    single series labelled ``other``, which keeps per chat metrics bounded.
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        max_series: int = 0,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.max_series = max_series
+        self._series: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        MetricsRegistry().register(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        if (
+            self.max_series
+            and key not in self._series
+            and len(self._series) >= self.max_series
+        ):
+            key = (OVERFLOW_LABEL,) * len(self.labels)
+        return key
+
+    def _label_dict(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labels, key))
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """(sample name, labels, value) of every series."""
+        with self._lock:
+            series = list(self._series.items())
+        return [(self.name, self._label_dict(k), v) for k, v in series]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        max_series: int = 0,
+    ) -> None:
+        super().__init__(name, help, labels, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # per bucket counts, then sum and count
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the ``with`` block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._series.items()]
+        samples = []
+        for key, values in series:
+            labels = self._label_dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = {**labels, "le": _format_value(bound)}
+                samples.append((f"{self.name}_bucket", bucket_labels, cumulative))
+            samples.append(
+                (f"{self.name}_bucket", {**labels, "le": "+Inf"}, values[-1])
+            )
+            samples.append((f"{self.name}_sum", labels, values[-2]))
+            samples.append((f"{self.name}_count", labels, values[-1]))
+        return samples
+
+
+class MetricsRegistry(metaclass=Singleton):
+    """All metrics of the process, rendered in the Prometheus text format.
+
+    Besides the metrics themselves, collectors registered with
+    ``register_collector`` are called on every scrape and return families of
+    values read from other components, like queue depths and cache hits.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, help: str, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(
+                    f"{sample_name}{_format_labels(labels)} {_format_value(value)}"
+                )
+
+        for metric in list(self._metrics.values()):
+            family(metric.name, metric.kind, metric.help, metric.samples())
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                family(name, kind, help, [(name, l, v) for l, v in samples])
+        return "\n".join(lines) + "\n"
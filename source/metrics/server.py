@@ -0,0 +1,60 @@
+import tornado.web
+from tornado.httpserver import HTTPServer
+from utils import logger, startup
+
+from .registry import MetricsRegistry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(MetricsRegistry().render())
+
+
+class ReadyHandler(tornado.web.RequestHandler):
+    """200 once the bot can serve updates, 503 while it is starting."""
+
+    def get(self):
+        if startup.is_ready():
+            self.write("ready\n")
+        else:
+            self.set_status(503)
+            self.write("starting\n")
+
+
+def _log_request(handler: tornado.web.RequestHandler):
+    # scrapes come every few seconds, only log the failed ones
+    if handler.get_status() >= 400:
+        logger.warning(f"metrics request failed: {handler.get_status()}")
+
+
+ROUTES = [(r"/metrics", MetricsHandler), (r"/ready", ReadyHandler)]
+
+
+def start_metrics_server(port: int, address: str = "0.0.0.0") -> HTTPServer:
+    """Serve ``/metrics`` and ``/ready`` on the running event loop."""
+    app = tornado.web.Application(ROUTES, log_function=_log_request)
+    return app.listen(port, address)
+
+
+def mount_metrics(updater) -> bool:
+    """Serve ``/metrics`` and ``/ready`` on the port of a running webhook.
+
+    PTB 20 has no public way to add routes to the tornado app behind
+    ``Updater.start_webhook``, so this reaches into the updater, as laid out
+    in the pinned python-telegram-bot 20.2. Returns False when another
+    version moved it, then only ``METRICS_PORT`` serves them.
+    """
+    httpd = getattr(updater, "_httpd", None)
+    server = getattr(httpd, "_http_server", None)
+    app = getattr(server, "request_callback", None)
+    if not hasattr(app, "add_handlers"):
+        logger.warning(
+            "Cannot serve metrics on the webhook port with this "
+            "python-telegram-bot version, set METRICS_PORT to serve them"
+        )
+        return False
+    app.add_handlers(r".*", ROUTES)
+    return True
@@ -0,0 +1,2 @@
+from .scheduler import OutboundScheduler, Priority, SchedulerBusyError
+from .token_bucket import TokenBucket
@@ -0,0 +1,300 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Dict, List, Optional
+
+import openai
+from telegram.error import RetryAfter
+from utils import Singleton, logger
+
+from .token_bucket import TokenBucket
+
+SCHEDULER_MAX_RETRIES = int(os.environ.get("SCHEDULER_MAX_RETRIES", "4"))
+SCHEDULER_BACKOFF_BASE = 0.5
+SCHEDULER_BACKOFF_CAP = 20.0
+# Per chat Telegram send rate, Telegram asks for about one message a second
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_CHAT_BUCKETS = 10000
+
+
+class Priority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class SchedulerBusyError(Exception):
+    """Raised instead of queueing when an endpoint's queue is full."""
+
+    def __init__(self, endpoint: str) -> None:
+        super().__init__(f"Too many requests queued for {endpoint}")
+        self.endpoint = endpoint
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, str(default)))
+
+
+# endpoint: (max in flight, max queued, requests per minute, tokens per minute)
+LANE_LIMITS = {
+    "chat": (
+        _env_int("SCHEDULER_CHAT_CONCURRENCY", 64),
+        _env_int("SCHEDULER_CHAT_QUEUE", 256),
+        _env_int("SCHEDULER_CHAT_RPM", 500),
+        _env_int("SCHEDULER_CHAT_TPM", 200000),
+    ),
+    "vision": (
+        _env_int("SCHEDULER_VISION_CONCURRENCY", 16),
+        _env_int("SCHEDULER_VISION_QUEUE", 64),
+        _env_int("SCHEDULER_VISION_RPM", 500),
+        _env_int("SCHEDULER_VISION_TPM", 200000),
+    ),
+    "images": (
+        _env_int("SCHEDULER_IMAGES_CONCURRENCY", 4),
+        _env_int("SCHEDULER_IMAGES_QUEUE", 16),
+        _env_int("SCHEDULER_IMAGES_RPM", 20),
+        0,
+    ),
+    "embeddings": (
+        _env_int("SCHEDULER_EMBEDDINGS_CONCURRENCY", 8),
+        _env_int("SCHEDULER_EMBEDDINGS_QUEUE", 256),
+        _env_int("SCHEDULER_EMBEDDINGS_RPM", 500),
+        _env_int("SCHEDULER_EMBEDDINGS_TPM", 1000000),
+    ),
+    "telegram": (
+        _env_int("SCHEDULER_TELEGRAM_CONCURRENCY", 64),
+        _env_int("SCHEDULER_TELEGRAM_QUEUE", 1024),
+        _env_int("SCHEDULER_TELEGRAM_RPM", 1800),
+        0,
+    ),
+}
+
+
+class Lane:
+    """Concurrency slots, a bounded priority queue and rate limits for one endpoint.
+
+    A call that can't start at once takes a place in the queue, which counts
+    against ``max_queue`` whether it waits for a slot or for the rate limits.
+    The queue is served by priority: its head gets the next free slot once
+    the request and token buckets allow it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int,
+        rpm: int = 0,
+        tpm: int = 0,
+    ) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+        self._requests = TokenBucket(rpm / 60, max(rpm / 60, 1)) if rpm else None
+        # allow a minute worth of tokens as burst, like the API does
+        self._tokens = TokenBucket(tpm / 60, tpm) if tpm else None
+        # wakes the queue up once the buckets have refilled
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: Priority = Priority.NORMAL, tokens: int = 0):
+        if (
+            not self._waiters
+            and self.active < self.max_concurrency
+            and self._rate_delay(tokens) <= 0
+        ):
+            self._take(tokens)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise SchedulerBusyError(self.name)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), tokens, future)
+        heapq.heappush(self._waiters, entry)
+        self._dispatch()
+        try:
+            # _dispatch takes the slot and the rate for us
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._dispatch()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _rate_delay(self, tokens: int) -> float:
+        delay = 0.0
+        if self._requests is not None:
+            delay = self._requests.delay(1)
+        if self._tokens is not None and tokens:
+            delay = max(delay, self._tokens.delay(tokens))
+        return delay
+
+    def _take(self, tokens: int):
+        if self._requests is not None:
+            self._requests.try_acquire(1)
+        if self._tokens is not None and tokens:
+            self._tokens.try_acquire(tokens)
+        self.active += 1
+
+    def _dispatch(self):
+        """Start queued calls, highest priority first, while slots and the
+        rate limits allow."""
+        while self._waiters and self.active < self.max_concurrency:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._rate_delay(tokens)
+            if delay > 0:
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(
+                        delay, self._wake
+                    )
+                return
+            heapq.heappop(self._waiters)
+            self._take(tokens)
+            future.set_result(None)
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying ``error``, or None if it isn't retryable."""
+    if isinstance(error, RetryAfter):
+        return float(error.retry_after)
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    elif not isinstance(error, openai.APIConnectionError):
+        # Telegram errors other than RetryAfter may already have been
+        # delivered, retrying them could send duplicates
+        return None
+    # full jitter so a burst of failures doesn't retry in lockstep
+    return random.uniform(
+        0, min(SCHEDULER_BACKOFF_CAP, SCHEDULER_BACKOFF_BASE * 2**attempt)
+    )
+
+
+class OutboundScheduler(metaclass=Singleton):
+    """Single gate for calls to OpenAI and Telegram.
+
+    Each endpoint is a ``Lane`` with request and token buckets, a limit on
+    calls in flight and a bounded queue served by priority, so text replies
+    go ahead of image generation. When a queue is full the call fails fast
+    with ``SchedulerBusyError`` instead of piling up. 429s and 5xx are retried
+    with jittered exponential backoff, honouring Retry-After.
+    """
+
+    def __init__(self, limits: Dict[str, tuple] = None) -> None:
+        limits = limits or LANE_LIMITS
+        self.lanes = {name: Lane(name, *limit) for name, limit in limits.items()}
+        self._chat_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.retries: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        endpoint: str,
+        priority: Priority = Priority.NORMAL,
+        tokens: int = 0,
+        key: int = None,
+    ):
+        """Hold one slot of ``endpoint``, waiting for rate limits first."""
+        lane = self.lanes[endpoint]
+        if key is not None:
+            await self._chat_bucket(key).acquire(1)
+        try:
+            await lane.acquire(priority, tokens)
+        except SchedulerBusyError:
+            self.rejected[endpoint] = self.rejected.get(endpoint, 0) + 1
+            raise
+        try:
+            yield
+        finally:
+            lane.release()
+
+    async def run(
+        self,
+        endpoint: str,
+        fn,
+        *args,
+        priority: Priority = Priority.NORMAL,
+        tokens: int = 0,
+        key: int = None,
+        **kwargs,
+    ):
+        """Call ``await fn(*args, **kwargs)`` through the endpoint's lane, with retries."""
+        async with self.hold(
+            endpoint, fn, *args, priority=priority, tokens=tokens, key=key, **kwargs
+        ) as result:
+            return result
+
+    @asynccontextmanager
+    async def hold(
+        self,
+        endpoint: str,
+        fn,
+        *args,
+        priority: Priority = Priority.NORMAL,
+        tokens: int = 0,
+        key: int = None,
+        **kwargs,
+    ):
+        """Like ``run``, but the slot is kept until the block ends, for results
+        read after the call returned such as a stream."""
+        for attempt in range(SCHEDULER_MAX_RETRIES + 1):
+            async with self.slot(endpoint, priority, tokens, key):
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    delay = retry_delay(e, attempt)
+                    if delay is None or attempt == SCHEDULER_MAX_RETRIES:
+                        raise
+                    self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+                    logger.info(
+                        f"{endpoint} call failed ({e}), retrying in {delay:.1f}s"
+                    )
+                else:
+                    yield result
+                    return
+            # back off outside the slot so others can use it
+            await asyncio.sleep(delay)
+
+    def _chat_bucket(self, key: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+            self._chat_buckets[key] = bucket
+            if len(self._chat_buckets) > TELEGRAM_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(key)
+        return bucket
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Classic token bucket, ``rate`` tokens per second up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def delay(self, amount: float = 1) -> float:
+        """Seconds until ``amount`` tokens are available, without taking them."""
+        amount = min(amount, self.capacity)
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """Take ``amount`` tokens if possible, otherwise return the seconds to wait."""
+        # a request larger than the bucket would never fit, let it drain the bucket
+        amount = min(amount, self.capacity)
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    async def acquire(self, amount: float = 1):
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
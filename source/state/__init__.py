@@ -0,0 +1,27 @@
+import os
+
+from .backend import StateBackend
+from .memory import MemoryStateBackend
+from .sqlite import SQLiteStateBackend
+
+# memory, sqlite or redis
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_PATH = os.environ.get("STATE_PATH", "state.db")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+_backend = None
+
+
+def get_state_backend() -> StateBackend:
+    """The process wide state backend chosen by ``STATE_BACKEND``."""
+    global _backend
+    if _backend is None:
+        if STATE_BACKEND == "sqlite":
+            _backend = SQLiteStateBackend(STATE_PATH)
+        elif STATE_BACKEND == "redis":
+            from .redis_backend import RedisStateBackend
+
+            _backend = RedisStateBackend(REDIS_URL)
+        else:
+            _backend = MemoryStateBackend()
+    return _backend
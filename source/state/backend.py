@@ -0,0 +1,40 @@
+from typing import List, Optional
+
+
+class StateBackend:
+    """Key value and list storage for state that must outlive a process.
+
+    ``shared`` tells whether other processes see the same data. The memory
+    backend isn't shared, so callers can skip writing through to it.
+    """
+
+    shared = True
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def set(self, key: str, value: str, ttl: int = None):
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def set_if_absent(self, key: str, value: str, ttl: int = None) -> bool:
+        """Set the key only when it doesn't exist, return whether it was set."""
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def incr(self, key: str) -> int:
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def rpush(self, key: str, values: List[str]):
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def lrange(self, key: str) -> List[str]:
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def ltrim(self, key: str, keep: int):
+        """Keep only the last ``keep`` items of a list."""
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    async def close(self):
+        pass
@@ -0,0 +1,58 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .backend import StateBackend
+
+
+class MemoryStateBackend(StateBackend):
+    """Process local state, lost on restart."""
+
+    shared = False
+
+    def __init__(self) -> None:
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lists: Dict[str, List[str]] = {}
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: int = None):
+        expires = time.monotonic() + ttl if ttl else None
+        self._values[key] = (value, expires)
+
+    async def set_if_absent(self, key: str, value: str, ttl: int = None) -> bool:
+        if self._live(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+            self._lists.pop(key, None)
+
+    async def incr(self, key: str) -> int:
+        value = int(self._live(key) or 0) + 1
+        self._values[key] = (str(value), None)
+        return value
+
+    async def rpush(self, key: str, values: List[str]):
+        self._lists.setdefault(key, []).extend(values)
+
+    async def lrange(self, key: str) -> List[str]:
+        return list(self._lists.get(key, []))
+
+    async def ltrim(self, key: str, keep: int):
+        items = self._lists.get(key)
+        if items is not None and len(items) > keep:
+            del items[: len(items) - keep]
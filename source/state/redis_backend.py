@@ -0,0 +1,47 @@
+from typing import List, Optional
+
+from .backend import StateBackend
+
+
+class RedisStateBackend(StateBackend):
+    """State in Redis, or anything speaking its protocol, shared across hosts.
+
+    Needs the optional ``redis`` package.
+    """
+
+    def __init__(self, url: str) -> None:
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise ImportError(
+                "STATE_BACKEND=redis needs the redis package: pip install redis"
+            ) from e
+        self._redis = aioredis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: int = None):
+        await self._redis.set(key, value, ex=ttl)
+
+    async def set_if_absent(self, key: str, value: str, ttl: int = None) -> bool:
+        return bool(await self._redis.set(key, value, ex=ttl, nx=True))
+
+    async def delete(self, *keys: str):
+        await self._redis.delete(*keys)
+
+    async def incr(self, key: str) -> int:
+        return await self._redis.incr(key)
+
+    async def rpush(self, key: str, values: List[str]):
+        if values:
+            await self._redis.rpush(key, *values)
+
+    async def lrange(self, key: str) -> List[str]:
+        return await self._redis.lrange(key, 0, -1)
+
+    async def ltrim(self, key: str, keep: int):
+        await self._redis.ltrim(key, -keep, -1)
+
+    async def close(self):
+        await self._redis.aclose()
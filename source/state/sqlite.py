@@ -0,0 +1,111 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from .backend import StateBackend
+
+
+class SQLiteStateBackend(StateBackend):
+    """State in a SQLite file, shared by the worker processes of one host.
+
+    Queries run in a worker thread. WAL mode lets readers in other
+    processes go on while one of them writes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv "
+            "(key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lists "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, value TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS lists_key ON lists (key, id)")
+        self._db.commit()
+
+    def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                with self._db:
+                    return fn(*args)
+
+        return asyncio.to_thread(locked)
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires >= ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: int = None):
+        expires = time.time() + ttl if ttl else None
+        self._db.execute(
+            "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, expires)
+        )
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: int = None):
+        await self._run(self._set, key, value, ttl)
+
+    async def set_if_absent(self, key: str, value: str, ttl: int = None) -> bool:
+        def set_if_absent():
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, ttl)
+            return True
+
+        return await self._run(set_if_absent)
+
+    async def delete(self, *keys: str):
+        def delete():
+            for key in keys:
+                self._db.execute("DELETE FROM kv WHERE key = ?", (key,))
+                self._db.execute("DELETE FROM lists WHERE key = ?", (key,))
+
+        await self._run(delete)
+
+    async def incr(self, key: str) -> int:
+        def incr():
+            value = int(self._get(key) or 0) + 1
+            self._set(key, str(value))
+            return value
+
+        return await self._run(incr)
+
+    async def rpush(self, key: str, values: List[str]):
+        await self._run(
+            self._db.executemany,
+            "INSERT INTO lists (key, value) VALUES (?, ?)",
+            [(key, v) for v in values],
+        )
+
+    async def lrange(self, key: str) -> List[str]:
+        def lrange():
+            rows = self._db.execute(
+                "SELECT value FROM lists WHERE key = ? ORDER BY id", (key,)
+            ).fetchall()
+            return [row[0] for row in rows]
+
+        return await self._run(lrange)
+
+    async def ltrim(self, key: str, keep: int):
+        await self._run(
+            self._db.execute,
+            "DELETE FROM lists WHERE key = ? AND id NOT IN "
+            "(SELECT id FROM lists WHERE key = ? ORDER BY id DESC LIMIT ?)",
+            (key, key, keep),
+        )
+
+    async def close(self):
+        await self._run(lambda: None)
+        self._db.close()
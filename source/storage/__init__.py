@@ -0,0 +1,3 @@
+from .archiver import ChatArchiver
+from .blob_store import BlobStore
+from .backends import FileSystemBackend, S3Backend, StorageBackend, create_backend
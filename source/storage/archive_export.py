@@ -0,0 +1,138 @@
+import csv
+import json
+from datetime import datetime
+from typing import Iterable
+
+from .archive_reader import record_time
+
+COLUMNS = (
+    "chat_id",
+    "role",
+    "username",
+    "content",
+    "timestamp",
+    "type",
+    "image_url",
+    "image_ref",
+    "tokens",
+)
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP = 10000
+
+
+def normalize(record: dict) -> dict:
+    """A record with every column, the timestamp as epoch seconds."""
+    row = {column: record.get(column) for column in COLUMNS}
+    when = record_time(record)
+    row["timestamp"] = int(when.timestamp()) if when else None
+    row["type"] = row["type"] or "text"
+    row["tokens"] = row["tokens"] or 0
+    return row
+
+
+class ExportWriter:
+    """Writes normalized records to ``path`` one at a time."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+
+    def write(self, row: dict):
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    def close(self):
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlWriter(ExportWriter):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, row: dict):
+        self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+class CsvWriter(ExportWriter):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, row: dict):
+        self._writer.writerow(row)
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(ExportWriter):
+    """Columnar export in row groups of ``PARQUET_ROW_GROUP`` rows.
+
+    Needs the optional ``pyarrow`` package.
+    """
+
+    def __init__(self, path: str) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(
+                "--format parquet needs the pyarrow package: pip install pyarrow"
+            ) from e
+        super().__init__(path)
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                ("chat_id", pa.int64()),
+                ("role", pa.string()),
+                ("username", pa.string()),
+                ("content", pa.string()),
+                ("timestamp", pa.timestamp("s")),
+                ("type", pa.string()),
+                ("image_url", pa.string()),
+                ("image_ref", pa.string()),
+                ("tokens", pa.int32()),
+            ]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+        self._rows = []
+
+    def write(self, row: dict):
+        if row["timestamp"] is not None:
+            row = {**row, "timestamp": datetime.fromtimestamp(row["timestamp"])}
+        self._rows.append(row)
+        self.count += 1
+        if len(self._rows) >= PARQUET_ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows, schema=self._schema)
+            self._writer.write_table(table)
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+def export_records(records: Iterable[dict], writer: ExportWriter) -> int:
+    for record in records:
+        writer.write(normalize(record))
+    return writer.count
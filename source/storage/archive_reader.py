@@ -0,0 +1,160 @@
+import gzip
+import io
+import json
+import re
+from datetime import date, datetime
+from typing import Iterable, Iterator, Optional, Set
+
+from utils import logger
+
+from .backends import StorageBackend
+
+# Bytes read from an object at a time
+READ_CHUNK = 64 * 1024
+
+# {BOT_NAME}/{YYYYMMDD}/{BOT_NAME}_chat_{YYYYMMDD_HHMMSS}_{id}.jsonl[.gz]
+_PART_KEY = re.compile(r"/(\d{8})/[^/]+\.jsonl(\.gz)?$")
+# {BOT_NAME}/{BOT_NAME}_chat_{YYYYMMDD}.json, written before the archiver
+_LEGACY_KEY = re.compile(r"_chat_(\d{8})\.json$")
+
+_decoder = json.JSONDecoder()
+
+
+def key_date(key: str) -> Optional[date]:
+    """Day of an archive object from its key, None for keys that aren't one."""
+    match = _PART_KEY.search(key) or _LEGACY_KEY.search(key)
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d").date()
+
+
+def record_time(record: dict) -> Optional[datetime]:
+    """Time of a record, epoch seconds or the ``%Y%m%d_%H%M%S`` of old ones."""
+    value = record.get("timestamp")
+    if value is None:
+        return None
+    if isinstance(value, str) and not value.isdigit():
+        return datetime.strptime(value, "%Y%m%d_%H%M%S")
+    return datetime.fromtimestamp(int(value))
+
+
+def _open(backend: StorageBackend, key: str):
+    stream = backend.open(key)
+    if key.endswith(".gz"):
+        stream = gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def _iter_jsonl(stream) -> Iterator[dict]:
+    for line in io.TextIOWrapper(stream, encoding="utf-8"):
+        if line.strip():
+            yield json.loads(line)
+
+
+def _iter_json_array(stream) -> Iterator[dict]:
+    """Items of a JSON array read in chunks, never holding the whole document."""
+    reader = io.TextIOWrapper(stream, encoding="utf-8")
+    buffer = ""
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if buffer.startswith("["):
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer:
+                raise ValueError("Archive object is not a JSON array")
+        elif buffer.startswith(","):
+            buffer = buffer[1:]
+            continue
+        elif buffer.startswith("]"):
+            return
+        elif buffer:
+            try:
+                item, end = _decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+        if eof:
+            # the closing bracket returns above
+            if started:
+                raise ValueError("Archive object ended inside the JSON array")
+            return
+        chunk = reader.read(READ_CHUNK)
+        eof = not chunk
+        buffer += chunk
+
+
+def iter_objects(
+    backend: StorageBackend,
+    prefix: str,
+    start: date = None,
+    end: date = None,
+) -> Iterator[str]:
+    """Keys of the archive objects under ``prefix`` from ``start`` to ``end``
+    inclusive, by day and then key, which is time order within a day."""
+    keys = []
+    for key in backend.list(prefix):
+        day = key_date(key)
+        if day is None:
+            continue
+        if (start and day < start) or (end and day > end):
+            continue
+        keys.append((day, key))
+    return (key for _, key in sorted(keys))
+
+
+def iter_records(backend: StorageBackend, keys: Iterable[str]) -> Iterator[dict]:
+    """Records of archive objects, streamed one object and one record at a time."""
+    for key in keys:
+        try:
+            stream = _open(backend, key)
+        except Exception as e:
+            logger.error(f"Cannot open archive object {key}: {e}")
+            continue
+        with stream:
+            if ".jsonl" in key:
+                yield from _iter_jsonl(stream)
+            else:
+                yield from _iter_json_array(stream)
+
+
+class RecordFilter:
+    """Keeps records matching every given condition, None matches all."""
+
+    def __init__(
+        self,
+        chat_ids: Set[int] = None,
+        types: Set[str] = None,
+        roles: Set[str] = None,
+        start: datetime = None,
+        end: datetime = None,
+    ) -> None:
+        self.chat_ids = chat_ids
+        self.types = types
+        self.roles = roles
+        self.start = start
+        self.end = end
+
+    def __call__(self, record: dict) -> bool:
+        if self.chat_ids is not None and record.get("chat_id") not in self.chat_ids:
+            return False
+        if self.types is not None and record.get("type", "text") not in self.types:
+            return False
+        if self.roles is not None and record.get("role") not in self.roles:
+            return False
+        if self.start is not None or self.end is not None:
+            when = record_time(record)
+            if when is None:
+                return False
+            if self.start is not None and when < self.start:
+                return False
+            if self.end is not None and when >= self.end:
+                return False
+        return True
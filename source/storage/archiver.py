@@ -0,0 +1,149 @@
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+from chat import ChatMessage
+from metrics import STAGE_SECONDS
+from utils import Singleton, logger
+
+from .backends import StorageBackend, create_backend
+
+BOT_NAME = os.environ.get("BOT_NAME")
+
+# s3, fs (local directory) or none
+ARCHIVE_BACKEND = os.environ.get("ARCHIVE_BACKEND", "s3")
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+# Records per part object and seconds before a partial batch is written
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_FLUSH_INTERVAL = float(os.environ.get("ARCHIVE_FLUSH_INTERVAL", "60"))
+ARCHIVE_QUEUE_SIZE = int(os.environ.get("ARCHIVE_QUEUE_SIZE", "20000"))
+ARCHIVE_GZIP = os.environ.get("ARCHIVE_GZIP", "1") == "1"
+ARCHIVE_MAX_RETRIES = 3
+
+_STOP = object()
+
+
+class ChatArchiver(metaclass=Singleton):
+    """Writes chat messages to storage from a background thread.
+
+    Handlers only enqueue records. The writer thread groups them into
+    immutable JSONL part objects, one per batch, named
+    ``{BOT_NAME}/{YYYYMMDD}/{BOT_NAME}_chat_{YYYYMMDD_HHMMSS}_{id}.jsonl[.gz]``,
+    so archiving costs the same no matter how much was written that day and
+    concurrent turns never overwrite each other.
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend = None,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        flush_interval: float = ARCHIVE_FLUSH_INTERVAL,
+        queue_size: int = ARCHIVE_QUEUE_SIZE,
+        compress: bool = ARCHIVE_GZIP,
+    ) -> None:
+        if backend is None:
+            backend = create_backend(ARCHIVE_BACKEND, ARCHIVE_DIR)
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, chat_id: int, msgs: List[ChatMessage]):
+        """Queue messages for archiving without blocking the caller."""
+        if self.backend is None:
+            return
+        self._ensure_started()
+        for message in msgs:
+            record = message.jsonify_full()
+            record["chat_id"] = chat_id
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                logger.error("Archive queue is full, dropping message")
+
+    def close(self, timeout: float = 30):
+        """Write everything still queued and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="chat-archiver", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            if record is _STOP:
+                # drain whatever was queued before the stop marker
+                self._write(batch)
+                return
+            if record is not None:
+                batch.append(record)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch: List[dict]):
+        if not batch:
+            return
+        body = "".join(
+            json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for r in batch
+        ).encode("utf-8")
+        now = datetime.now()
+        key = (
+            f"{BOT_NAME}/{now.strftime('%Y%m%d')}/"
+            f"{BOT_NAME}_chat_{now.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+            ".jsonl"
+        )
+        if self.compress:
+            body = gzip.compress(body)
+            key += ".gz"
+
+        for attempt in range(ARCHIVE_MAX_RETRIES):
+            try:
+                with STAGE_SECONDS.time(stage="s3_archive"):
+                    self.backend.put(key, body)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                logger.error(f"Archive write failed ({attempt + 1}): {e}")
+                time.sleep(2**attempt)
+        self.dropped += len(batch)
+        logger.error(f"Dropping {len(batch)} archive records after retries")
@@ -0,0 +1,117 @@
+import os
+import threading
+import uuid
+from typing import Iterator, Optional
+
+from utils import logger
+
+BUCKET = os.environ.get("ARCHIVE_BUCKET", "bot-chat-dali")
+
+
+class StorageBackend:
+    """Minimal object storage used by the archiver."""
+
+    def put(self, key: str, data: bytes):
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        raise NotImplementedError("This method should be overridden by subclasses.")
+
+    def connect(self):
+        """Set up the connection ahead of the first call, see ``BotCore.warm_up``."""
+
+
+class S3Backend(StorageBackend):
+    def __init__(self, bucket: str = BUCKET, client=None) -> None:
+        self.bucket = bucket
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 is slow to import and its clients expensive to build, so
+        # build one on first use, usually from a background thread
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+
+                    self._client = boto3.client(
+                        "s3",
+                        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                    )
+        return self._client
+
+    def connect(self):
+        self.client
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def open(self, key: str):
+        """Return a file-like streaming body for the object."""
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+
+class FileSystemBackend(StorageBackend):
+    """Stores objects as files under a root directory, keys map to paths."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so readers never see a partial object
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def open(self, key: str):
+        return open(self._path(key), "rb")
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    yield key
+
+
+def create_backend(kind: str, root: str = None) -> Optional[StorageBackend]:
+    """Build a storage backend by name: ``s3``, ``fs`` or ``none``."""
+    if kind == "fs":
+        return FileSystemBackend(root)
+    if kind == "s3":
+        if (
+            os.getenv("AWS_ACCESS_KEY_ID") is None
+            or os.getenv("AWS_SECRET_ACCESS_KEY") is None
+        ):
+            logger.error("AWS credentials not found. Skipping storage..")
+            return None
+        return S3Backend()
+    return None
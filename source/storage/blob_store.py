@@ -0,0 +1,71 @@
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import STAGE_SECONDS
+from utils import Singleton, logger
+
+from .backends import StorageBackend, create_backend
+
+BOT_NAME = os.environ.get("BOT_NAME")
+
+# s3, fs (local directory) or none, defaults to the archive backend
+BLOB_BACKEND = os.environ.get("BLOB_BACKEND", os.environ.get("ARCHIVE_BACKEND", "s3"))
+BLOB_DIR = os.environ.get("BLOB_DIR", "blobs")
+BLOB_UPLOAD_WORKERS = int(os.environ.get("BLOB_UPLOAD_WORKERS", "2"))
+# Digests remembered as already stored, so repeated images skip the upload
+BLOB_KNOWN_LIMIT = 10000
+
+
+class BlobStore(metaclass=Singleton):
+    """Content addressed store for raw image bytes.
+
+    Blobs are keyed by their sha256 digest under ``{BOT_NAME}/blobs/`` and
+    messages only keep the returned ``sha256:<digest>`` reference, so neither
+    the chat history nor the archive carries image payloads.
+    """
+
+    def __init__(self, backend: StorageBackend = None) -> None:
+        if backend is None:
+            backend = create_backend(BLOB_BACKEND, BLOB_DIR)
+        self.backend = backend
+        self._known: "OrderedDict[str, None]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(
+            max_workers=BLOB_UPLOAD_WORKERS, thread_name_prefix="blob-upload"
+        )
+
+    @staticmethod
+    def ref_for(data: bytes) -> str:
+        return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+    @staticmethod
+    def key_for(ref: str) -> str:
+        digest = ref.split(":", 1)[1]
+        return f"{BOT_NAME}/blobs/{digest[:2]}/{digest}"
+
+    def put(self, data: bytes) -> str:
+        """Store bytes in a background thread and return their reference."""
+        ref = self.ref_for(data)
+        if self.backend is None or ref in self._known:
+            return ref
+        self._known[ref] = None
+        if len(self._known) > BLOB_KNOWN_LIMIT:
+            self._known.popitem(last=False)
+        self._executor.submit(self._upload, ref, data)
+        return ref
+
+    def get(self, ref: str) -> bytes:
+        return self.backend.get(self.key_for(ref))
+
+    def close(self):
+        """Wait for pending uploads."""
+        self._executor.shutdown(wait=True)
+
+    def _upload(self, ref: str, data: bytes):
+        try:
+            with STAGE_SECONDS.time(stage="s3_blob"):
+                self.backend.put(self.key_for(ref), data)
+        except Exception as e:
+            self._known.pop(ref, None)
+            logger.error(f"Blob upload failed for {ref}: {e}")
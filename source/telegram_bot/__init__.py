@@ -2,8 +2,11 @@ from .bot_core import BotCore
 from .handler import (
     BotErrorCallback,
     BotMessageCallback,
+    BotStateRefreshCallback,
+    BotSystemCancelCallback,
     BotSystemModelCallback,
     BotSystemResetCallback,
     BotSystemStartCallback,
     BotVisionCallback,
 )
+from .workers import ShardedWebhookServer
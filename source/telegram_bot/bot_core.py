@@ -1,57 +1,214 @@
+import asyncio
+import json
+import multiprocessing
 import os
+import signal
+from functools import partial
 
-from llm_models import Model
+from jobs import JobQueue
+from llm_models import (
+    ConversationSummarizer,
+    LongTermMemory,
+    Model,
+    OpenAIChatInterface,
+)
+from llm_models.openai_chat_interface import get_client
+from llm_models.tokenizer import count_tokens
+from metrics import (
+    METRICS_PORT,
+    STARTUP_SECONDS,
+    MetricsRegistry,
+    mount_metrics,
+    start_metrics_server,
+)
+from state import get_state_backend
+from storage import BlobStore, ChatArchiver
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
-from utils import Singleton, logger
+from telegram.request import BaseRequest
+from telegram.ext import (
+    ApplicationBuilder,
+    CommandHandler,
+    MessageHandler,
+    TypeHandler,
+    filters,
+)
+from utils import Singleton, logger, startup
 
 from .handler import (
     BotErrorCallback,
     BotMessageCallback,
+    BotStateRefreshCallback,
+    BotSystemCancelCallback,
     BotSystemModelCallback,
     BotSystemResetCallback,
     BotSystemStartCallback,
     BotVisionCallback,
+    fail_image_job,
+    run_image_job,
 )
+from .ingest import IngestQueue, new_deduplicator
+from .rate_limiter import TelegramRateLimiter
+from .stats import collect_component_stats
+from .workers import WEB_CONCURRENCY, ShardedWebhookServer
 
 HEROKU_DOMAIN = os.environ.get("HEROKU_DOMAIN")
+# Number of updates processed at the same time, 0 processes them one by one
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "256"))
 
 
 class BotCore(metaclass=Singleton):
-    def __init__(self) -> None:
+    def __init__(self, token: str = None, request: BaseRequest = None) -> None:
         # Set up Telegram API keys
-        self.telegram_bot_token = os.environ.get("TELEGRAM_TOKEN")
-        self.application = ApplicationBuilder().token(self.telegram_bot_token).build()
+        self.telegram_bot_token = token or os.environ.get("TELEGRAM_TOKEN")
+        builder = (
+            ApplicationBuilder()
+            .token(self.telegram_bot_token)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .update_queue(IngestQueue(dedup=new_deduplicator()))
+            .rate_limiter(TelegramRateLimiter())
+        )
+        if request is not None:
+            # e.g. the benchmark's fake Telegram API
+            builder = builder.request(request)
+        self.application = builder.build()
+        self.metrics_port = METRICS_PORT
+        # (index, count) of this worker, picks the stored image jobs it resumes
+        self.job_shard = None
+        self._warm_up_task = None
+        JobQueue().bind(
+            partial(run_image_job, self.application.bot),
+            partial(fail_image_job, self.application.bot),
+        )
+        MetricsRegistry().register_collector(collect_component_stats)
 
         Model().set_current_chat_model(Model.CHAT_MODEL)
         Model().set_current_image_model(Model.IMAGE_MODEL)
 
+    async def on_startup(self, application):
+        if self.metrics_port:
+            start_metrics_server(self.metrics_port)
+            logger.info(f"serving metrics on port {self.metrics_port}")
+        # don't hold up the first update, it builds what it needs if it wins
+        self._warm_up_task = asyncio.create_task(asyncio.to_thread(self.warm_up))
+        await JobQueue().resume(self.job_shard)
+
+    @staticmethod
+    def mark_ready():
+        """Report ready, once the application processes updates."""
+        STARTUP_SECONDS.set(startup.mark_ready())
+        logger.info(f"ready to serve updates after {startup.startup_seconds():.2f}s")
+
+    @staticmethod
+    def warm_up():
+        """Build the clients and load the data a turn needs, in a thread."""
+        try:
+            get_client()
+            count_tokens("warm up")
+            for backend in (ChatArchiver().backend, BlobStore().backend):
+                if backend is not None:
+                    backend.connect()
+        except Exception as e:
+            logger.error(f"Warm up failed: {e}")
+
+    @staticmethod
+    async def on_stop(application):
+        # finish what the job workers started while the bot can still send,
+        # on_shutdown only runs after the bot was shut down
+        await JobQueue().close()
+
+    @staticmethod
+    async def on_shutdown(application):
+        await LongTermMemory().close()
+        await ConversationSummarizer().close()
+        await OpenAIChatInterface.close()
+        # flush the archive queue before the process exits
+        await asyncio.to_thread(ChatArchiver().close)
+        await asyncio.to_thread(BlobStore().close)
+        await get_state_backend().close()
+
     def run_local(self):
         logger.info("running local")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        asyncio.run(self.serve())
 
     def run_webhook(self):
         logger.info("running webhook")
-        self.application.run_webhook(
+        webhook_args = dict(
             listen="0.0.0.0",
             port=int(os.environ.get("PORT", "8443")),
             url_path=self.telegram_bot_token,  # test leave it empty
             webhook_url=f"{HEROKU_DOMAIN}/{self.telegram_bot_token}",
         )
+        if WEB_CONCURRENCY > 1:
+            logger.info(f"sharding updates over {WEB_CONCURRENCY} workers")
+            server = ShardedWebhookServer(self.telegram_bot_token, WEB_CONCURRENCY)
+            server.run(**webhook_args)
+        else:
+            asyncio.run(self.serve(webhook_args))
+
+    async def serve(self, webhook_args: dict = None):
+        """``Application.run_webhook``, or ``run_polling`` without
+        ``webhook_args``, until SIGINT or SIGTERM. Unlike those, ``/metrics``
+        and ``/ready`` are served on the webhook port, the only one a Heroku
+        dyno can be reached on, and ready is only reported once updates are
+        processed."""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        async with self.application:
+            await self.on_startup(self.application)
+            updater = self.application.updater
+            if webhook_args is None:
+                await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            else:
+                await updater.start_webhook(**webhook_args)
+                mount_metrics(updater)
+            await self.application.start()
+            self.mark_ready()
+            try:
+                await stop.wait()
+            finally:
+                await updater.stop()
+                await self.application.stop()
+                await self.on_stop(self.application)
+        await self.on_shutdown(self.application)
+
+    async def serve_queue(self, queue: multiprocessing.Queue):
+        """Process updates forwarded by ``ShardedWebhookServer`` until None arrives."""
+        # the webhook process already dropped the duplicates
+        self.application.update_queue.dedup = None
+        async with self.application:
+            await self.application.start()
+            await self.on_startup(self.application)
+            self.mark_ready()
+            while True:
+                payload = await asyncio.to_thread(queue.get)
+                if payload is None:
+                    break
+                update = Update.de_json(json.loads(payload), self.application.bot)
+                await self.application.update_queue.put(update)
+            await self.application.stop()
+            await self.on_stop(self.application)
+        await self.on_shutdown(self.application)
 
     def attach_handlers(self):
         start_handler = CommandHandler("start", BotSystemStartCallback.callback)
         reset_handler = CommandHandler("reset", BotSystemResetCallback.callback)
         model_handler = CommandHandler("model", BotSystemModelCallback.callback)
+        cancel_handler = CommandHandler("cancel", BotSystemCancelCallback.callback)
         gpt_handler = MessageHandler(
             filters.TEXT & (~filters.COMMAND), BotMessageCallback.callback
         )
         vision_handler = MessageHandler(filters.PHOTO, BotVisionCallback.callback)
 
         # Add handlers
+        self.application.add_handler(
+            TypeHandler(Update, BotStateRefreshCallback.callback), group=-1
+        )
         self.application.add_handler(start_handler)
         self.application.add_handler(reset_handler)
         self.application.add_handler(model_handler)
+        self.application.add_handler(cancel_handler)
         self.application.add_handler(gpt_handler)
         self.application.add_handler(vision_handler)
         self.application.add_error_handler(BotErrorCallback.callback)
@@ -0,0 +1,130 @@
+import asyncio
+import os
+from typing import Dict, Hashable, List, Optional
+
+from telegram import Message
+from utils import Singleton
+
+# Seconds to wait for a second message; a lone message is answered after it
+COALESCE_GRACE = float(os.environ.get("COALESCE_GRACE", "0.25"))
+# Seconds without a new message before a burst is answered, 0 turns it off
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", "0.8"))
+# Longest a burst is held open, counted from its first message
+COALESCE_MAX_WAIT = float(os.environ.get("COALESCE_MAX_WAIT", "4"))
+# Messages merged into one turn at most
+COALESCE_MAX_MESSAGES = 10
+# Seconds without a new photo before an album is answered
+ALBUM_WINDOW = float(os.environ.get("ALBUM_WINDOW", "1.0"))
+ALBUM_MAX_WAIT = 5.0
+# Telegram albums hold up to 10 items
+ALBUM_MAX_PHOTOS = 10
+
+
+class _Burst:
+    __slots__ = ("items", "arrived")
+
+    def __init__(self, item) -> None:
+        self.items: list = [item]
+        self.arrived = asyncio.Event()
+
+
+class _Batcher(metaclass=Singleton):
+    """Groups updates that arrive close together under the same key.
+
+    The first update of a key opens a burst and its handler waits until no
+    new update came for ``window`` seconds, or ``max_wait`` passed; only
+    ``grace`` seconds for the second update, so a lone one isn't held for
+    the whole window. Updates
+    arriving meanwhile are added to the burst and their handlers return at
+    once, so the handler of the first one answers the whole burst. Needs
+    ``CONCURRENT_UPDATES`` above 0, otherwise the next update is only read
+    after the burst is closed.
+    """
+
+    def __init__(
+        self, window: float, max_wait: float, max_items: int, grace: float = None
+    ) -> None:
+        self.window = window
+        self.grace = window if grace is None else grace
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self._bursts: Dict[Hashable, _Burst] = {}
+        self.bursts = 0
+        self.merged = 0
+
+    async def _gather(self, key: Hashable, item) -> Optional[list]:
+        """The items of the burst ``item`` opens, or None when ``item``
+        joined a burst another handler answers."""
+        if self.window <= 0:
+            return [item]
+        burst = self._bursts.get(key)
+        if burst is not None:
+            burst.items.append(item)
+            burst.arrived.set()
+            self.merged += 1
+            if len(burst.items) >= self.max_items:
+                self._bursts.pop(key, None)
+            return None
+
+        burst = self._bursts[key] = _Burst(item)
+        self.bursts += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        try:
+            while self._bursts.get(key) is burst:
+                gap = self.grace if len(burst.items) == 1 else self.window
+                timeout = min(gap, deadline - loop.time())
+                if timeout <= 0:
+                    break
+                burst.arrived.clear()
+                try:
+                    await asyncio.wait_for(burst.arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            if self._bursts.get(key) is burst:
+                del self._bursts[key]
+        return burst.items
+
+
+class MessageCoalescer(_Batcher):
+    """Merges texts a user sends in quick succession into one turn, so the
+    whole burst costs one intent check, one completion and one reply. In a
+    group, each sender's messages form their own bursts."""
+
+    def __init__(
+        self,
+        window: float = COALESCE_WINDOW,
+        max_wait: float = COALESCE_MAX_WAIT,
+        max_messages: int = COALESCE_MAX_MESSAGES,
+        grace: float = COALESCE_GRACE,
+    ) -> None:
+        super().__init__(window, max_wait, max_messages, grace)
+
+    async def collect(
+        self, chat_id: int, text: str, user_id: int = None
+    ) -> Optional[str]:
+        """The merged text of the burst ``text`` opens, or None when ``text``
+        joined a burst another handler answers."""
+        texts = await self._gather((chat_id, user_id), text)
+        return None if texts is None else "\n".join(texts)
+
+
+class AlbumCollector(_Batcher):
+    """Collects the photos of a Telegram album, which arrive as one update
+    each sharing a ``media_group_id``, so the album gets one reply."""
+
+    def __init__(
+        self,
+        window: float = ALBUM_WINDOW,
+        max_wait: float = ALBUM_MAX_WAIT,
+        max_photos: int = ALBUM_MAX_PHOTOS,
+    ) -> None:
+        super().__init__(window, max_wait, max_photos)
+
+    async def collect(self, message: Message) -> Optional[List[Message]]:
+        """The messages of the album ``message`` opens, in the order they
+        arrived, or None when another handler answers its album."""
+        if message.media_group_id is None:
+            return [message]
+        return await self._gather(message.media_group_id, message)
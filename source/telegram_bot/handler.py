@@ -1,21 +1,92 @@
+import asyncio
 import html
 import json
 import os
+import time
 import traceback
-import base64
-from io import BytesIO
+from typing import List
 
 from chat import ChatMessage
-from constants import Role, ChatType, system_prompts
-from llm_models import ChatHistory, Model, OpenAIChatInterface
-from telegram import Update
-from telegram.constants import ParseMode
+from constants import ChatType, Intent, Role
+from jobs import EDIT, IMAGE, Job, JobQueue, JobQueueFullError
+from llm_models import (
+    ChatHistory,
+    ConversationStore,
+    IntentRouter,
+    LongTermMemory,
+    Model,
+    OpenAIChatInterface,
+    ResponseCache,
+)
+from llm_models import model_registry
+from llm_models.image_pipeline import BytesSink
+from llm_models.model import MODEL_ROUTING, ROUTING_SMALL_MODEL
+from llm_models.response_cache import RESPONSE_CACHE_IMAGES
+from llm_models.tokenizer import count_message_tokens
+from metrics import ERRORS, STAGE_SECONDS, TURN_SECONDS, UPDATES
+from openai import RateLimitError
+from scheduler import Priority, SchedulerBusyError
+from storage import BlobStore, ChatArchiver
+from telegram import Bot, Message, Update
+from telegram.constants import ChatAction, ParseMode
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 from utils import logger
 
-BOT_NAME = os.environ.get("BOT_NAME")
+from .coalescer import AlbumCollector, MessageCoalescer
+from .ingest import IngestQueue
+from .speculation import Draft, Speculation
+from .streaming import STREAM_REPLIES, StreamingReply
 
-chatHistory = ChatHistory.getInstance()
+BOT_NAME = os.environ.get("BOT_NAME")
+BUSY_REPLY = "I'm handling a lot of requests right now, please try again in a minute."
+# Errors that mean we are over capacity, answered with BUSY_REPLY
+BUSY_ERRORS = (SchedulerBusyError, RateLimitError, JobQueueFullError)
+# Characters of the update and of the traceback in an error report, the
+# escaped report has to fit in one Telegram message
+ERROR_UPDATE_CHARS = 1000
+ERROR_TRACEBACK_CHARS = 2000
+WORKING_REPLY = "Working on your image, I'll send it when it's ready. /cancel stops it."
+IMAGE_FAILED_REPLY = "Sorry, I couldn't make your image. Please try again."
+
+conversations = ConversationStore()
+archiver = ChatArchiver()
+blobs = BlobStore()
+router = IntentRouter()
+memory = LongTermMemory()
+response_cache = ResponseCache()
+coalescer = MessageCoalescer()
+albums = AlbumCollector()
+image_jobs = JobQueue()
+speculation = Speculation()
+
+
+async def generate_image(prompt: str, model: str) -> bytes:
+    """Generate an image, reusing the stored one for a repeated prompt when
+    ``RESPONSE_CACHE_IMAGES`` is on."""
+    cache_key = None
+    if RESPONSE_CACHE_IMAGES and blobs.backend is not None:
+        cache_key = ResponseCache.make_key("image", model, prompt)
+        image_ref = await response_cache.get(cache_key)
+        if image_ref is not None:
+            try:
+                return await asyncio.to_thread(blobs.get, image_ref)
+            except Exception as e:
+                logger.error(f"Cached image {image_ref} unavailable: {e}")
+
+    with STAGE_SECONDS.time(stage="image"):
+        image_data = await OpenAIChatInterface.chat_image(prompt=prompt, model=model)
+    if cache_key is not None:
+        await response_cache.put(cache_key, BlobStore.ref_for(image_data))
+    return image_data
+
+
+def log_turn(chat_id: int, kind: str, start: float):
+    latency_ms = round(1000 * (time.perf_counter() - start), 1)
+    logger.info(
+        f"{kind} turn done in {latency_ms}ms",
+        extra={"chat_id": chat_id, "stage": "turn", "latency_ms": latency_ms},
+    )
 
 
 class Handler:
@@ -24,6 +95,101 @@ class Handler:
         raise NotImplementedError("This method should be overridden by subclasses.")
 
 
+async def submit_image_job(bot: Bot, job: Job):
+    """Queue an image job and tell the user it is on its way."""
+    placeholder = await bot.send_message(chat_id=job.chat_id, text=WORKING_REPLY)
+    job.placeholder_id = placeholder.message_id
+    try:
+        await image_jobs.submit(job)
+    except JobQueueFullError:
+        await _delete_placeholder(bot, job)
+        raise
+
+
+async def run_image_job(bot: Bot, job: Job):
+    """Generate or edit the image of a job and deliver it, in a job worker."""
+    await bot.send_chat_action(chat_id=job.chat_id, action=ChatAction.UPLOAD_PHOTO)
+    if job.kind == EDIT:
+        # Download the files from Telegram without copying them
+        input_photos = await asyncio.gather(
+            *(bot.get_file(file_id) for file_id in job.file_ids)
+        )
+        sinks = [BytesSink() for _ in input_photos]
+        with STAGE_SECONDS.time(stage="download"):
+            await asyncio.gather(
+                *(
+                    input_photo.download_to_memory(sink)
+                    for input_photo, sink in zip(input_photos, sinks)
+                )
+            )
+        with STAGE_SECONDS.time(stage="edit"):
+            image_data = await OpenAIChatInterface.edit_image(
+                prompt=job.prompt, images=[sink.data for sink in sinks], model=job.model
+            )
+        filename = "edited_image.png"
+        caption = f"Here's your edited image based on: {job.prompt}"
+    else:
+        image_data = await generate_image(job.prompt, job.model)
+        filename = "image.png"
+        caption = None
+
+    # Store the image reference in chat history
+    assistant_msg = ChatMessage(
+        role=Role.ASSISTANT,
+        username="Assistant",
+        type=ChatType.IMAGE,
+        content=job.content,
+        image_ref=blobs.put(image_data),
+    )
+    async with conversations.session(job.chat_id) as chat_history:
+        chat_history.insert(assistant_msg)
+    archiver.submit(job.chat_id, [assistant_msg])
+    memory.remember(job.chat_id, [assistant_msg])
+
+    # Send the image, the bytes are uploaded as they are
+    with STAGE_SECONDS.time(stage="send"):
+        await bot.send_photo(
+            chat_id=job.chat_id, photo=image_data, filename=filename, caption=caption
+        )
+    await _delete_placeholder(bot, job)
+
+
+async def fail_image_job(bot: Bot, job: Job, error: Exception):
+    """Tell the user a job failed, in place of its "working on it" message."""
+    text = BUSY_REPLY if isinstance(error, BUSY_ERRORS) else IMAGE_FAILED_REPLY
+    if job.placeholder_id is not None:
+        try:
+            await bot.edit_message_text(
+                text=text, chat_id=job.chat_id, message_id=job.placeholder_id
+            )
+            return
+        except TelegramError as e:
+            logger.info(f"Cannot edit the placeholder of job {job.id}: {e}")
+    await bot.send_message(chat_id=job.chat_id, text=text)
+
+
+async def _delete_placeholder(bot: Bot, job: Job):
+    if job.placeholder_id is None:
+        return
+    try:
+        await bot.delete_message(chat_id=job.chat_id, message_id=job.placeholder_id)
+    except TelegramError as e:
+        logger.info(f"Cannot delete the placeholder of job {job.id}: {e}")
+
+
+class BotStateRefreshCallback(Handler):
+    """Runs before every other handler to count the update and pick up state
+    shared by other workers."""
+
+    @staticmethod
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        UPDATES.inc()
+        if isinstance(context.application.update_queue, IngestQueue):
+            context.application.update_queue.started(update.update_id)
+        if update.effective_chat is not None:
+            await Model().refresh(update.effective_chat.id)
+
+
 class BotSystemStartCallback(Handler):
     @staticmethod
     async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -36,28 +202,94 @@ class BotSystemStartCallback(Handler):
 class BotSystemResetCallback(Handler):
     @staticmethod
     async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        ChatHistory.getInstance().reset()
+        await conversations.reset(update.effective_chat.id)
+        memory.forget(update.effective_chat.id)
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Reset..")
 
 
+class BotSystemCancelCallback(Handler):
+    @staticmethod
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        cancelled = await image_jobs.cancel(update.effective_chat.id)
+        for job in cancelled:
+            await _delete_placeholder(context.bot, job)
+        if cancelled:
+            text = f"Cancelled {len(cancelled)} image request(s)."
+        else:
+            text = "Nothing to cancel."
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+
+
 class BotSystemModelCallback(Handler):
     @staticmethod
     async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        model = (" ").join(context.args)
-        if "4" in model:
-            Model().set_current_chat_model("gpt-4-turbo")
-        elif "3" in model:
-            Model().set_current_chat_model("gpt-3.5-turbo")
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"Changing model to {Model().get_current_chat_model()}",
+        chat_id = update.effective_chat.id
+        name = (" ").join(context.args)
+        if not name:
+            text = BotSystemModelCallback.describe(chat_id)
+        elif name.strip().lower() == "auto":
+            await Model().set_chat_model(chat_id, model_registry.CHAT)
+            text = "Choosing the chat model automatically"
+        else:
+            spec = model_registry.resolve(name)
+            if spec is None:
+                details = BotSystemModelCallback.describe(chat_id)
+                text = f"Unknown model {name}\n\n{details}"
+            else:
+                await Model().set_chat_model(chat_id, spec.kind, spec.name)
+                text = f"Changing {spec.kind} model to {spec.name}"
+        await context.bot.send_message(chat_id=chat_id, text=text)
+
+    @staticmethod
+    def describe(chat_id: int) -> str:
+        chat_model = Model().chat_override(chat_id)
+        if chat_model is None:
+            default = Model().get_current_chat_model()
+            if MODEL_ROUTING:
+                chat_model = (
+                    f"auto ({ROUTING_SMALL_MODEL} for short turns, {default} otherwise)"
+                )
+            else:
+                chat_model = f"auto ({default})"
+        chat_models = [s.name for s in model_registry.models_of(model_registry.CHAT)]
+        image_models = [s.name for s in model_registry.models_of(model_registry.IMAGE)]
+        return (
+            f"Chat model: {chat_model}\n"
+            f"Image model: {Model().image_model_for(chat_id)}\n\n"
+            f"Chat models: auto, {', '.join(chat_models)}\n"
+            f"Image models: {', '.join(image_models)}\n"
+            "Use /model <name> to switch."
         )
 
 
 class BotMessageCallback(Handler):
     @staticmethod
     async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        def gpt_chat_response(text: str, chat) -> str:
+        # a burst of messages is answered once, by the handler of its first one
+        user = update.effective_user
+        input_text = await coalescer.collect(
+            update.effective_chat.id,
+            update.message.text,
+            user.id if user is not None else None,
+        )
+        if input_text is None:
+            return
+        start = time.perf_counter()
+        with TURN_SECONDS.time(kind="text"):
+            async with conversations.session(update.effective_chat.id) as chat_history:
+                await BotMessageCallback.respond(
+                    update, context, chat_history, input_text
+                )
+        log_turn(update.effective_chat.id, "text", start)
+
+    @staticmethod
+    async def respond(
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        chat_history: ChatHistory,
+        input_text: str,
+    ):
+        async def gpt_chat_response(text: str, chat, draft: Draft) -> str:
             username = f"{chat.first_name} {chat.last_name}"
 
             user_msg = ChatMessage(
@@ -65,177 +297,276 @@ class BotMessageCallback(Handler):
                 username=username,
                 content=text,
             )
-            chatHistory.insert(user_msg)
-
-            messages = chatHistory.truncate_messages()
-            response_msg = OpenAIChatInterface.chat_text(
-                messages=messages,
+            user_msg.tokens = count_message_tokens(text)
+
+            spec = Model().route(
+                chat_history.chat_id,
+                text,
+                chat_history.total_tokens
+                + chat_history.system_msg.tokens
+                + user_msg.tokens,
+            )
+            logger.info(
+                f"chat model: {spec.name}",
+                extra={"chat_id": chat_history.chat_id, "stage": "routing"},
+            )
+            # recall turns that already left the short history
+            oldest = chat_history.short_msgs[0] if chat_history.short_msgs else user_msg
+            recalled = await memory.recall(
+                chat_history.chat_id, text, before=oldest.timestamp
             )
+            # the user message joins the history once the draft is released,
+            # until then it is only appended to the prompt
+            budget = spec.prompt_budget - user_msg.tokens
+            recalled_tokens = 0
+            if recalled is not None:
+                recalled_tokens = count_message_tokens(recalled["content"])
+            messages = chat_history.truncate_messages(budget - recalled_tokens)
+            if recalled is not None:
+                messages.insert(1, recalled)
+            messages.append(user_msg.jsonify_openai())
+            draft.prompt_tokens = (
+                chat_history.system_msg.tokens
+                + chat_history.total_tokens
+                + recalled_tokens
+                + user_msg.tokens
+            )
+            if STREAM_REPLIES and spec.stream:
+                reply = StreamingReply(context.bot, update.effective_chat.id)
+                start = time.perf_counter()
+                first = True
+                try:
+                    # the stream interleaves with message edits, so "completion"
+                    # includes them, "first_token" shows the model's own delay
+                    with STAGE_SECONDS.time(stage="completion"):
+                        async for delta in OpenAIChatInterface.chat_text_stream(
+                            messages=messages,
+                            model=spec.name,
+                            chat_id=chat_history.chat_id,
+                        ):
+                            if first:
+                                first = False
+                                STAGE_SECONDS.observe(
+                                    time.perf_counter() - start, stage="first_token"
+                                )
+                            draft.add(delta)
+                            if draft.released.is_set():
+                                await reply.feed(draft.take())
+                    await draft.released.wait()
+                    with STAGE_SECONDS.time(stage="send"):
+                        await reply.feed(draft.take())
+                        response_msg = await reply.finish()
+                except BaseException:
+                    # don't leave a half written message with its cursor
+                    await reply.abort()
+                    raise
+            else:
+                with STAGE_SECONDS.time(stage="completion"):
+                    response_msg = await OpenAIChatInterface.chat_text(
+                        messages=messages,
+                        model=spec.name,
+                        chat_id=chat_history.chat_id,
+                    )
+                draft.add(response_msg)
+                await draft.released.wait()
+                with STAGE_SECONDS.time(stage="send"):
+                    await context.bot.send_message(
+                        chat_id=update.effective_chat.id,
+                        text=response_msg,
+                        parse_mode=ParseMode.MARKDOWN,
+                    )
             assistant_msg = ChatMessage(
                 role=Role.ASSISTANT,
                 username="Assistant",
                 content=response_msg,
             )
-            chatHistory.insert(assistant_msg)
-            # push msgs to s3
-            chatHistory.push_msgs_to_s3([user_msg, assistant_msg])
+            chat_history.insert(user_msg)
+            chat_history.insert(assistant_msg)
+            archiver.submit(chat_history.chat_id, [user_msg, assistant_msg])
+            memory.remember(chat_history.chat_id, [user_msg, assistant_msg])
             return response_msg
 
-        input_text = update.message.text
-        logger.info(f"input text: {input_text}")
-
-        image_prompt = OpenAIChatInterface.chat_text(
-            messages=[
-                {"role": Role.SYSTEM.value, "content": system_prompts.IMAGE_PROMPT},
-                {
-                    "role": Role.USER.value,
-                    # make sure it's sending less than text limit
-                    "content": input_text[:2048],
-                },
-            ]
-        )
-        logger.info(f"image prompt: {image_prompt}")
+        log_fields = {"chat_id": chat_history.chat_id, "stage": "intent"}
+        logger.info(f"input text: {input_text}", extra={**log_fields, "stage": "input"})
 
-        if "@image" in image_prompt:
-            # Set response_format to b64_json to get base64 encoded image
-            image_b64 = OpenAIChatInterface.chat_image(
-                prompt=image_prompt,
-            )
-            # Store image data in chat history
-            assistant_msg = ChatMessage(
-                role=Role.ASSISTANT,
-                username="Assistant",
-                type=ChatType.IMAGE,
-                content=input_text,
-                image_b64=image_b64,
+        chat = update.message.chat
+        with STAGE_SECONDS.time(stage="intent"):
+            decision = await router.settle(input_text)
+            if decision is None and not speculation.wanted(input_text):
+                decision = await router.route(input_text)
+        if decision is None:
+            # only a model can tell, start answering as text meanwhile
+            decision, response_msg = await speculation.race(
+                router.route(input_text),
+                lambda draft: gpt_chat_response(input_text, chat, draft),
             )
-            chatHistory.insert(assistant_msg)
-            chatHistory.push_msgs_to_s3([assistant_msg])
-
-            # Decode base64 string to binary
-            image_data = base64.b64decode(image_b64)
-            # Create an in-memory file-like object
-            bio = BytesIO(image_data)
-            bio.name = "image.png"  # Name is required for Telegram API
-
-            # Send the image
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=bio,
+            logger.info(
+                f"intent: {decision.intent.name} ({decision.stage}, speculative)",
+                extra=log_fields,
             )
+            if response_msg is not None:
+                return
         else:
-            gpt_response = gpt_chat_response(input_text, update.message.chat)
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=gpt_response,
-                parse_mode=ParseMode.MARKDOWN,
+            logger.info(
+                f"intent: {decision.intent.name} ({decision.stage})", extra=log_fields
             )
 
+        if decision.intent == Intent.IMAGE:
+            # generated by a job worker, the update is done once it is queued
+            await submit_image_job(
+                context.bot,
+                Job(
+                    chat_id=chat_history.chat_id,
+                    kind=IMAGE,
+                    prompt=decision.prompt,
+                    model=Model().image_model_for(chat_history.chat_id),
+                    content=input_text,
+                ),
+            )
+        else:
+            await gpt_chat_response(input_text, chat, Draft(released=True))
+
 
 class BotVisionCallback(Handler):
     @staticmethod
     async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # the photos of an album are answered once, by the handler of the first
+        messages = await albums.collect(update.message)
+        if messages is None:
+            return
+        kind = "photo" if len(messages) == 1 else "album"
+        start = time.perf_counter()
+        with TURN_SECONDS.time(kind=kind):
+            async with conversations.session(update.effective_chat.id) as chat_history:
+                await BotVisionCallback.respond(
+                    update, context, chat_history, messages
+                )
+        log_turn(update.effective_chat.id, kind, start)
+
+    @staticmethod
+    async def respond(
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        chat_history: ChatHistory,
+        messages: List[Message],
+    ):
         chat = update.message.chat
         username = f"{chat.first_name} {chat.last_name}"
         # chooser the largest photo size
-        input_photo = await context.bot.get_file(update.message.photo[-1].file_id)
-        image_url = input_photo.file_path
-
-        input_text = update.message.caption if update.message.caption else None
-        logger.info(f"input_photo: {image_url}")
-        logger.info(f"input_text: {input_text}")
-
-        # Create user message with the image
-        user_msg = ChatMessage(
-            role=Role.USER,
-            username=username,
-            content=input_text if input_text else "",
-            type=ChatType.IMAGE,
-            image_url=image_url,
-        )
-        chatHistory.insert(user_msg)
+        photos = [message.photo[-1] for message in messages]
+        with STAGE_SECONDS.time(stage="get_file"):
+            input_photos = await asyncio.gather(
+                *(context.bot.get_file(photo.file_id) for photo in photos)
+            )
+        image_urls = [input_photo.file_path for input_photo in input_photos]
+
+        # an album carries its caption on one of the photos, usually the first
+        captions = [message.caption for message in messages if message.caption]
+        input_text = captions[0] if captions else None
+        log_fields = {"chat_id": chat_history.chat_id, "stage": "input"}
+        logger.info(f"input_photo: {', '.join(image_urls)}", extra=log_fields)
+        logger.info(f"input_text: {input_text}", extra=log_fields)
+
+        # Create user messages with the images, the caption on the first
+        user_msgs = [
+            ChatMessage(
+                role=Role.USER,
+                username=username,
+                content=input_text if input_text and i == 0 else "",
+                type=ChatType.IMAGE,
+                image_url=image_url,
+            )
+            for i, image_url in enumerate(image_urls)
+        ]
+        for user_msg in user_msgs:
+            chat_history.insert(user_msg)
 
         is_edit_request = False
 
         # Check if this is an edit request
         if input_text is not None:
-            image_prompt = OpenAIChatInterface.chat_text(
-                messages=[
-                    {"role": Role.SYSTEM.value, "content": system_prompts.IMAGE_PROMPT},
-                    {
-                        "role": Role.USER.value,
-                        # make sure it's sending less than text limit
-                        "content": input_text[:2048],
-                    },
-                ]
+            with STAGE_SECONDS.time(stage="intent"):
+                decision = await router.route(input_text, edit=True)
+            logger.info(
+                f"intent: {decision.intent.name} ({decision.stage})",
+                extra={**log_fields, "stage": "intent"},
             )
-            logger.info(f"image prompt: {image_prompt}")
 
-            if "@edit" in image_prompt:
+            if decision.intent == Intent.EDIT:
                 is_edit_request = True
-                # Download the file from Telegram
-                image_bytes = await input_photo.download_as_bytearray()
-                # Convert to base64
-                base64_image = base64.b64encode(image_bytes).decode("utf-8")
-
-                # Extract the edit prompt
-                edit_prompt = image_prompt
-                if "@edit" in image_prompt:
-                    edit_prompt = image_prompt.split("@edit")[1].strip()
-
-                # Edit the image
-                image_b64 = OpenAIChatInterface.edit_image(
-                    prompt=edit_prompt, base64_image=base64_image
-                )
-                # Store image data in chat history
-                assistant_msg = ChatMessage(
-                    role=Role.ASSISTANT,
-                    username="Assistant",
-                    type=ChatType.IMAGE,
-                    content=input_text,
-                    image_b64=image_b64,
-                )
-                chatHistory.insert(assistant_msg)
-                chatHistory.push_msgs_to_s3([user_msg, assistant_msg])
-
-                # Decode base64 string to binary
-                image_data = base64.b64decode(image_b64)
-                # Create an in-memory file-like object
-                bio = BytesIO(image_data)
-                bio.name = "edited_image.png"  # Name is required for Telegram API
-
-                # Send the edited image
-                await context.bot.send_photo(
-                    chat_id=update.effective_chat.id,
-                    photo=bio,
-                    caption=f"Here's your edited image based on: {edit_prompt}",
+                edit_prompt = decision.prompt
+
+                # Edit the image, not every image model can edit
+                image_model = Model().image_model_for(chat_history.chat_id)
+                if not model_registry.get_spec(image_model).edit:
+                    image_model = Model.IMAGE_MODEL
+                # only as many photos as the model takes in one edit
+                count = model_registry.get_spec(image_model).edit_images
+                archiver.submit(chat_history.chat_id, user_msgs)
+                memory.remember(chat_history.chat_id, user_msgs)
+                # edited by a job worker, the update is done once it is queued
+                await submit_image_job(
+                    context.bot,
+                    Job(
+                        chat_id=chat_history.chat_id,
+                        kind=EDIT,
+                        prompt=edit_prompt,
+                        model=image_model,
+                        content=input_text,
+                        file_ids=[photo.file_id for photo in photos[:count]],
+                    ),
                 )
 
         # If this is not an edit request, perform vision analysis
         if not is_edit_request:
-            out_text = OpenAIChatInterface.chat_vision(
-                caption=input_text if input_text else "Describe the image",
-                image_url=image_url,
-            )
+            spec = Model().route(chat_history.chat_id, input_text or "", vision=True)
+            if input_text:
+                caption = input_text
+            elif len(image_urls) > 1:
+                caption = "Describe the images"
+            else:
+                caption = "Describe the image"
+            with STAGE_SECONDS.time(stage="vision"):
+                out_text = await OpenAIChatInterface.chat_vision(
+                    model=spec.name,
+                    caption=caption,
+                    image_urls=image_urls,
+                    image_ids=[photo.file_unique_id for photo in photos],
+                    chat_id=chat_history.chat_id,
+                )
             assistant_msg = ChatMessage(
                 role=Role.ASSISTANT,
                 username="Assistant",
                 type=ChatType.TEXT,
                 content=out_text,
             )
-            chatHistory.insert(assistant_msg)
-            chatHistory.push_msgs_to_s3([user_msg, assistant_msg])
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=out_text,
-                parse_mode=ParseMode.MARKDOWN,
-            )
+            chat_history.insert(assistant_msg)
+            archiver.submit(chat_history.chat_id, [*user_msgs, assistant_msg])
+            memory.remember(chat_history.chat_id, [*user_msgs, assistant_msg])
+            with STAGE_SECONDS.time(stage="send"):
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text=out_text,
+                    parse_mode=ParseMode.MARKDOWN,
+                )
 
 
 class BotErrorCallback(Handler):
     @staticmethod
     async def callback(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Log the error and send a telegram message to notify the developer."""
+        ERRORS.inc(error=type(context.error).__name__)
+        if isinstance(context.error, BUSY_ERRORS):
+            # overload, not a bug: tell the user instead of dumping a traceback
+            logger.warning(f"Rejected update while busy: {context.error}")
+            if isinstance(update, Update) and update.effective_chat:
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text=BUSY_REPLY,
+                    rate_limit_args=Priority.HIGH,
+                )
+            return
+
         # Log the error before we do anything else, so we can see it even if something breaks.
         logger.error("Exception while handling an update:", exc_info=context.error)
 
@@ -247,11 +578,17 @@ class BotErrorCallback(Handler):
         tb_string = "".join(tb_list)
 
         # Build the message with some markup and additional information about what happened.
-        # You might need to add some logic to deal with messages longer than the 4096 character limit.
+        # Both parts are cut to stay within Telegram's 4096 character limit, the
+        # end of the traceback is the part worth keeping.
         update_str = update.to_dict() if isinstance(update, Update) else str(update)
+        update_json = json.dumps(update_str, indent=2, ensure_ascii=False)
+        if len(update_json) > ERROR_UPDATE_CHARS:
+            update_json = update_json[:ERROR_UPDATE_CHARS] + "\n..."
+        if len(tb_string) > ERROR_TRACEBACK_CHARS:
+            tb_string = "...\n" + tb_string[-ERROR_TRACEBACK_CHARS:]
         message = (
             "An exception was raised while handling an update\n"
-            f"<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}"
+            f"<pre>update = {html.escape(update_json)}"
             "</pre>\n\n"
             f"<pre>{html.escape(tb_string)}</pre>"
         )
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from metrics import Counter, Gauge, Histogram
+from state import StateBackend, get_state_backend
+from telegram import Update
+from utils import logger
+
+# Updates received but not yet picked up; when full, the webhook answers
+# only once there is room, so Telegram slows down instead of the bot
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", "10000"))
+# Recent update ids remembered to drop Telegram's redeliveries
+DEDUP_WINDOW = int(os.environ.get("DEDUP_WINDOW", "10000"))
+# Also check update ids in the state backend, for several hosts or restarts
+DEDUP_SHARED = os.environ.get("DEDUP_SHARED", "0") == "1"
+# Telegram keeps undelivered updates for a day
+DEDUP_TTL = 24 * 3600
+
+DUPLICATE_UPDATES = Counter(
+    "dalibot_duplicate_updates_total",
+    "Updates dropped because their update_id was already received",
+)
+UPDATE_QUEUE_DEPTH = Gauge(
+    "dalibot_update_queue_depth",
+    "Updates received and waiting to be processed",
+)
+INGEST_SECONDS = Histogram(
+    "dalibot_ingest_seconds",
+    "Seconds from receiving an update until its first handler started",
+)
+
+
+class UpdateDeduplicator:
+    """Sliding window of the last ``window`` update ids.
+
+    With a shared ``backend`` an id is also claimed there, so a redelivery
+    that reaches another process or a restarted one is dropped as well.
+    """
+
+    def __init__(self, window: int = DEDUP_WINDOW, backend: StateBackend = None):
+        self.window = window
+        self.backend = backend if backend is not None and backend.shared else None
+        self._ids: "OrderedDict[int, None]" = OrderedDict()
+
+    async def seen(self, update_id: int) -> bool:
+        if update_id in self._ids:
+            return True
+        self._ids[update_id] = None
+        if len(self._ids) > self.window:
+            self._ids.popitem(last=False)
+        if self.backend is None:
+            return False
+        try:
+            claimed = await self.backend.set_if_absent(
+                f"update:{update_id}", "1", ttl=DEDUP_TTL
+            )
+        except Exception as e:
+            logger.error(f"Cannot check update {update_id} in the state backend: {e}")
+            return False
+        return not claimed
+
+
+def new_deduplicator() -> UpdateDeduplicator:
+    """A deduplicator sharing ids through the state backend if ``DEDUP_SHARED``."""
+    return UpdateDeduplicator(backend=get_state_backend() if DEDUP_SHARED else None)
+
+
+class IngestQueue(asyncio.Queue):
+    """Bounded update queue between the webhook or poller and the handlers.
+
+    The webhook answers Telegram as soon as ``put`` returns, so model
+    latency never holds up ingestion. Duplicates are dropped before they
+    are queued, and the arrival time of every update is kept until
+    ``started`` is called from its first handler.
+    """
+
+    def __init__(
+        self, maxsize: int = UPDATE_QUEUE_SIZE, dedup: UpdateDeduplicator = None
+    ) -> None:
+        super().__init__(maxsize)
+        self.dedup = dedup
+        self._arrived: "OrderedDict[int, float]" = OrderedDict()
+
+    async def put(self, item):
+        # the application also queues its own stop signal
+        if isinstance(item, Update):
+            if self.dedup is not None and await self.dedup.seen(item.update_id):
+                DUPLICATE_UPDATES.inc()
+                logger.info(f"Dropped duplicate update {item.update_id}")
+                return
+            self._arrived[item.update_id] = time.monotonic()
+            if len(self._arrived) > DEDUP_WINDOW:
+                self._arrived.popitem(last=False)
+        await super().put(item)
+
+    def started(self, update_id: int):
+        arrived = self._arrived.pop(update_id, None)
+        if arrived is not None:
+            INGEST_SECONDS.observe(time.monotonic() - arrived)
+
+    def _put(self, item):
+        super()._put(item)
+        UPDATE_QUEUE_DEPTH.set(self.qsize())
+
+    def _get(self):
+        item = super()._get()
+        UPDATE_QUEUE_DEPTH.set(self.qsize())
+        return item
@@ -0,0 +1,35 @@
+from scheduler import OutboundScheduler, Priority
+from telegram.ext import BaseRateLimiter
+
+# Bot API methods that post into a chat and count against its send limit
+_CHAT_SEND_PREFIXES = ("send", "edit", "copy", "forward")
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Sends every Bot API request through the ``telegram`` scheduler lane.
+
+    Requests that post into a chat also wait on that chat's bucket.
+    ``rate_limit_args`` may carry a ``Priority`` for the request.
+    """
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        chat_id = data.get("chat_id")
+        key = None
+        if isinstance(chat_id, int) and endpoint.startswith(_CHAT_SEND_PREFIXES):
+            key = chat_id
+        priority = (
+            rate_limit_args
+            if isinstance(rate_limit_args, Priority)
+            else Priority.NORMAL
+        )
+        return await OutboundScheduler().run(
+            "telegram", callback, *args, priority=priority, key=key, **kwargs
+        )
@@ -0,0 +1,101 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional, Tuple
+
+from constants import Intent
+from llm_models import IntentDecision
+from llm_models.intent_router import likely_text
+from llm_models.tokenizer import count_tokens
+from utils import Singleton, logger
+
+# Start the chat completion while a model still decides the intent: "always",
+# "heuristic" for messages that read like chat, or "off"
+SPECULATIVE_MODE = os.environ.get("SPECULATIVE_MODE", "off")
+SPECULATIVE_MODES = ("always", "heuristic", "off")
+
+
+class Draft:
+    """Output of a completion, held back until ``release``.
+
+    A speculative completion collects its reply here while the intent is
+    still open; nothing is sent or written to the history before the
+    draft is released.
+    """
+
+    def __init__(self, released: bool = False) -> None:
+        self.released = asyncio.Event()
+        if released:
+            self.released.set()
+        # approximate, for counting what a cancelled draft cost
+        self.prompt_tokens = 0
+        self.text = ""
+        self._pending = ""
+
+    def add(self, delta: str):
+        self.text += delta
+        self._pending += delta
+
+    def take(self) -> str:
+        """Text added since the last call."""
+        pending, self._pending = self._pending, ""
+        return pending
+
+    def release(self):
+        self.released.set()
+
+
+class Speculation(metaclass=Singleton):
+    """Runs the chat completion of a turn next to the intent model.
+
+    Only used when the rules and the cache could not settle the intent, so
+    a model call would otherwise come before the completion. The completion
+    starts at once on a ``Draft``; a text decision releases it, any other
+    decision cancels it and its tokens are counted as wasted.
+    """
+
+    def __init__(self, mode: str = SPECULATIVE_MODE) -> None:
+        if mode not in SPECULATIVE_MODES:
+            raise ValueError(f"SPECULATIVE_MODE must be one of {SPECULATIVE_MODES}")
+        self.mode = mode
+        self.won = 0
+        self.lost = 0
+        self.wasted_tokens = 0
+
+    def wanted(self, text: str) -> bool:
+        if self.mode == "always":
+            return True
+        return self.mode == "heuristic" and likely_text(text)
+
+    async def race(
+        self,
+        decide: Awaitable[IntentDecision],
+        answer: Callable[[Draft], Awaitable[str]],
+    ) -> Tuple[IntentDecision, Optional[str]]:
+        """The decision and, when it is a text reply, what ``answer`` returned."""
+        draft = Draft()
+        task = asyncio.ensure_future(answer(draft))
+        try:
+            decision = await decide
+        except BaseException:
+            await self._cancel(task)
+            raise
+
+        if decision.intent == Intent.TEXT:
+            self.won += 1
+            draft.release()
+            return decision, await task
+
+        self.lost += 1
+        await self._cancel(task)
+        self.wasted_tokens += draft.prompt_tokens + count_tokens(draft.text)
+        return decision, None
+
+    @staticmethod
+    async def _cancel(task: asyncio.Task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Speculative completion failed: {e}")
@@ -0,0 +1,236 @@
+from typing import Iterable
+
+from jobs import JobQueue
+from llm_models import (
+    ConversationStore,
+    ConversationSummarizer,
+    IntentRouter,
+    LongTermMemory,
+    Model,
+    ResponseCache,
+)
+from metrics.registry import Family
+from scheduler import OutboundScheduler
+from storage import ChatArchiver
+from utils.logger import dropped_records
+
+from .coalescer import AlbumCollector, MessageCoalescer
+from .speculation import Speculation
+
+
+def collect_component_stats() -> Iterable[Family]:
+    """Counters and queue depths kept by the bot's components, read on scrape."""
+    scheduler = OutboundScheduler()
+    lanes = scheduler.lanes.values()
+    yield (
+        "dalibot_scheduler_active",
+        "gauge",
+        "Calls in flight per scheduler lane",
+        [({"lane": lane.name}, lane.active) for lane in lanes],
+    )
+    yield (
+        "dalibot_scheduler_queued",
+        "gauge",
+        "Calls waiting per scheduler lane",
+        [({"lane": lane.name}, lane.queued) for lane in lanes],
+    )
+    yield (
+        "dalibot_scheduler_retries_total",
+        "counter",
+        "Calls retried after a 429, 5xx or connection error",
+        [({"lane": k}, v) for k, v in scheduler.retries.items()],
+    )
+    yield (
+        "dalibot_scheduler_rejected_total",
+        "counter",
+        "Calls rejected because the lane queue was full",
+        [({"lane": k}, v) for k, v in scheduler.rejected.items()],
+    )
+
+    router = IntentRouter()
+    yield (
+        "dalibot_intent_decisions_total",
+        "counter",
+        "Intent decisions by the stage that settled them",
+        [({"stage": k}, v) for k, v in router.stage_counts.items()],
+    )
+    yield (
+        "dalibot_intent_seconds_total",
+        "counter",
+        "Seconds spent deciding intents, by the stage that settled them",
+        [({"stage": k}, v) for k, v in router.stage_seconds.items()],
+    )
+
+    cache = ResponseCache()
+    yield (
+        "dalibot_response_cache_hits_total",
+        "counter",
+        "Response cache hits by call kind",
+        [({"kind": k}, v) for k, v in cache.hits.items()],
+    )
+    yield (
+        "dalibot_response_cache_misses_total",
+        "counter",
+        "Response cache misses by call kind",
+        [({"kind": k}, v) for k, v in cache.misses.items()],
+    )
+
+    yield (
+        "dalibot_model_routes_total",
+        "counter",
+        "Turns answered by each chat model",
+        [({"model": k}, v) for k, v in Model().routes.items()],
+    )
+
+    image_jobs = JobQueue()
+    yield (
+        "dalibot_image_jobs",
+        "gauge",
+        "Image jobs waiting for or held by a worker",
+        [
+            ({"state": "queued"}, image_jobs.queued),
+            ({"state": "running"}, image_jobs.running),
+        ],
+    )
+    yield (
+        "dalibot_image_jobs_total",
+        "counter",
+        "Image jobs that ended, by how",
+        [
+            ({"outcome": "done"}, image_jobs.done),
+            ({"outcome": "failed"}, image_jobs.failed),
+            ({"outcome": "cancelled"}, image_jobs.cancelled),
+        ],
+    )
+
+    conversations = ConversationStore()
+    yield (
+        "dalibot_conversations",
+        "gauge",
+        "Chat histories held in memory",
+        [({}, len(conversations))],
+    )
+    yield (
+        "dalibot_conversation_bytes",
+        "gauge",
+        "Approximate memory used by the chat histories",
+        [({}, conversations.total_bytes)],
+    )
+
+    coalescer = MessageCoalescer()
+    yield (
+        "dalibot_coalesced_bursts_total",
+        "counter",
+        "Message bursts answered as one turn",
+        [({}, coalescer.bursts)],
+    )
+    yield (
+        "dalibot_coalesced_messages_total",
+        "counter",
+        "Messages merged into the turn of an earlier one",
+        [({}, coalescer.merged)],
+    )
+
+    albums = AlbumCollector()
+    yield (
+        "dalibot_albums_total",
+        "counter",
+        "Photo albums answered as one turn",
+        [({}, albums.bursts)],
+    )
+    yield (
+        "dalibot_album_photos_merged_total",
+        "counter",
+        "Photos answered together with the first photo of their album",
+        [({}, albums.merged)],
+    )
+
+    speculation = Speculation()
+    yield (
+        "dalibot_speculative_turns_total",
+        "counter",
+        "Completions started before the intent was known, by whether it was text",
+        [
+            ({"outcome": "won"}, speculation.won),
+            ({"outcome": "lost"}, speculation.lost),
+        ],
+    )
+    yield (
+        "dalibot_speculative_wasted_tokens_total",
+        "counter",
+        "Approximate tokens of speculative completions that were cancelled",
+        [({}, speculation.wasted_tokens)],
+    )
+
+    summarizer = ConversationSummarizer()
+    yield (
+        "dalibot_summaries_total",
+        "counter",
+        "Conversation summaries written",
+        [({}, summarizer.summaries)],
+    )
+    yield (
+        "dalibot_summaries_failed_total",
+        "counter",
+        "Conversation summaries that failed",
+        [({}, summarizer.failed)],
+    )
+
+    archiver = ChatArchiver()
+    yield (
+        "dalibot_archive_pending",
+        "gauge",
+        "Messages waiting to be archived",
+        [({}, archiver.pending)],
+    )
+    yield (
+        "dalibot_archive_written_total",
+        "counter",
+        "Messages archived",
+        [({}, archiver.written)],
+    )
+    yield (
+        "dalibot_archive_dropped_total",
+        "counter",
+        "Messages dropped by the archiver",
+        [({}, archiver.dropped)],
+    )
+
+    memory = LongTermMemory()
+    yield (
+        "dalibot_memory_turns",
+        "gauge",
+        "Past turns held in the long term memory indexes",
+        [({}, len(memory))],
+    )
+    yield (
+        "dalibot_memory_pending",
+        "gauge",
+        "Turns waiting to be embedded",
+        [({}, memory.pending)],
+    )
+    yield (
+        "dalibot_memory_embedded_total",
+        "counter",
+        "Turns embedded into long term memory",
+        [({}, memory.embedded)],
+    )
+    yield (
+        "dalibot_memory_failed_total",
+        "counter",
+        "Turns that could not be embedded",
+        [({}, memory.failed)],
+    )
+    yield (
+        "dalibot_memory_recalled_total",
+        "counter",
+        "Past turns recalled into prompts",
+        [({}, memory.recalled)],
+    )
+
+    yield (
+        "dalibot_log_records_dropped_total",
+        "counter",
+        "Log records dropped because the log writer fell behind",
+        [({}, dropped_records())],
+    )
@@ -0,0 +1,121 @@
+import os
+import time
+
+from telegram import Bot
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from utils import logger
+
+# Stream replies into an edited message instead of waiting for the full answer
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "1") == "1"
+# Telegram allows about one edit per second in a chat
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))
+# Characters collected before the first message is posted
+STREAM_FIRST_CHARS = 20
+TELEGRAM_MESSAGE_LIMIT = 4096
+CURSOR = " ▌"
+INTERRUPTED = "\n\n(reply interrupted)"
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """Split text into Telegram sized chunks, preferring line breaks."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    """Post a reply early and keep editing it while the completion streams.
+
+    Pieces are collected and written at most once per ``edit_interval`` so
+    the edits stay within Telegram's rate limits. Partial text is sent
+    without a parse mode, since half written Markdown is often invalid; the
+    final text is written with Markdown, falling back to plain text.
+    """
+
+    def __init__(
+        self, bot: Bot, chat_id: int, edit_interval: float = STREAM_EDIT_INTERVAL
+    ) -> None:
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.message = None
+        self.text = ""
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def feed(self, delta: str):
+        self.text += delta
+        if self.message is None and len(self.text.strip()) < STREAM_FIRST_CHARS:
+            return
+        if time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._show(self.text[: TELEGRAM_MESSAGE_LIMIT - len(CURSOR)] + CURSOR)
+
+    async def finish(self) -> str:
+        """Write the final text and return it."""
+        text = self.text.strip()
+        if not text:
+            return text
+        chunks = split_message(text)
+        await self._show(chunks[0], final=True)
+        for chunk in chunks[1:]:
+            await self._send(chunk)
+        return text
+
+    async def abort(self):
+        """Replace the cursor of a reply whose stream failed with a note, so
+        the message doesn't look like it is still being written."""
+        if self.message is None:
+            return
+        text = self.text.strip()[: TELEGRAM_MESSAGE_LIMIT - len(INTERRUPTED)]
+        try:
+            await self._show(text + INTERRUPTED)
+        except Exception as e:
+            # keep the error that stopped the stream
+            logger.info(f"Cannot mark the reply as interrupted: {e}")
+
+    async def _show(self, text: str, final: bool = False):
+        self._last_edit = time.monotonic()
+        if self.message is None:
+            self.message = await self._send(text, final)
+            self._shown = text
+            return
+        if text == self._shown and not final:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=self.chat_id,
+                message_id=self.message.message_id,
+                parse_mode=ParseMode.MARKDOWN if final else None,
+            )
+        except BadRequest as e:
+            if "not modified" in str(e):
+                pass
+            elif final:
+                logger.info(f"Markdown rejected, sending plain text: {e}")
+                await self.bot.edit_message_text(
+                    text=text, chat_id=self.chat_id, message_id=self.message.message_id
+                )
+            else:
+                raise
+        self._shown = text
+
+    async def _send(self, text: str, markdown: bool = True):
+        try:
+            return await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=text,
+                parse_mode=ParseMode.MARKDOWN if markdown else None,
+            )
+        except BadRequest as e:
+            if not markdown:
+                raise
+            logger.info(f"Markdown rejected, sending plain text: {e}")
+            return await self.bot.send_message(chat_id=self.chat_id, text=text)
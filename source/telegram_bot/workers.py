@@ -0,0 +1,120 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from typing import List
+
+from metrics import METRICS_PORT, Counter, mount_metrics, start_metrics_server
+from telegram import Bot, Update
+from telegram.ext import Updater
+from utils import logger, startup
+
+from .ingest import IngestQueue, new_deduplicator
+
+# Worker processes handling updates, 1 keeps everything in one process
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Updates waiting for a worker before the webhook server blocks
+WORKER_QUEUE_SIZE = 1024
+
+FORWARDED = Counter(
+    "dalibot_forwarded_updates_total",
+    "Updates forwarded by the webhook process, per worker",
+    labels=("worker",),
+)
+
+
+def shard_for(update: Update, workers: int) -> int:
+    """Worker index of an update; all updates of one chat go to one worker."""
+    chat = update.effective_chat
+    key = chat.id if chat is not None else update.update_id
+    return key % workers
+
+
+def _worker_main(index: int, queue: multiprocessing.Queue):
+    # the parent handles Ctrl-C and tells the workers to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from .bot_core import BotCore
+
+    core = BotCore()
+    # the webhook process serves METRICS_PORT, workers take the next ports;
+    # only the webhook process also serves them on the webhook port
+    core.metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+    core.job_shard = (index, WEB_CONCURRENCY)
+    core.attach_handlers()
+    logger.info(f"worker {index} started")
+    asyncio.run(core.serve_queue(queue))
+    logger.info(f"worker {index} stopped")
+
+
+class ShardedWebhookServer:
+    """Receive the webhook in this process and fan updates out to workers.
+
+    Updates are sharded by chat id, so each chat's turns stay ordered in one
+    worker and its in-memory history and locks stay valid there. Workers
+    share everything else through the state backend.
+    """
+
+    def __init__(self, token: str, workers: int = WEB_CONCURRENCY) -> None:
+        self.token = token
+        self.workers = workers
+        context = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [
+            context.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)
+        ]
+        self.processes = [
+            context.Process(
+                target=_worker_main, args=(i, queue), name=f"bot-worker-{i}"
+            )
+            for i, queue in enumerate(self.queues)
+        ]
+
+    def run(self, listen: str, port: int, url_path: str, webhook_url: str):
+        for process in self.processes:
+            process.start()
+        try:
+            asyncio.run(self._serve(listen, port, url_path, webhook_url))
+        finally:
+            for queue in self.queues:
+                queue.put(None)
+            for process in self.processes:
+                process.join()
+
+    async def _serve(self, listen: str, port: int, url_path: str, webhook_url: str):
+        update_queue = IngestQueue(dedup=new_deduplicator())
+        updater = Updater(Bot(self.token), update_queue)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
+
+        async with updater:
+            await updater.start_webhook(
+                listen=listen,
+                port=port,
+                url_path=url_path,
+                webhook_url=webhook_url,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            mount_metrics(updater)
+            logger.info(f"webhook ready after {startup.mark_ready():.2f}s")
+            stopping = asyncio.create_task(stop.wait())
+            while not stop.is_set():
+                getting = asyncio.create_task(update_queue.get())
+                await asyncio.wait(
+                    {getting, stopping}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not getting.done():
+                    getting.cancel()
+                    break
+                await self._forward(getting.result())
+            await updater.stop()
+
+    async def _forward(self, update: Update):
+        shard = shard_for(update, self.workers)
+        FORWARDED.inc(worker=shard)
+        queue = self.queues[shard]
+        payload = update.to_json()
+        # put blocks when the worker is far behind, keep the event loop free
+        await asyncio.to_thread(queue.put, payload)
@@ -1,2 +1,3 @@
+from . import startup
 from .logger import logger
 from .singleton import Singleton
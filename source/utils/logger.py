@@ -1,9 +1,143 @@
+import atexit
+import json
 import logging
 import os
+import queue
+import random
+import sys
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 
 BOT_NAME = os.environ.get("BOT_NAME")
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-logger = logging.getLogger(BOT_NAME)
+# json for one JSON object per line, text for the classic format
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Levels of single stages, e.g. "intent=WARNING,completion=DEBUG"
+LOG_STAGE_LEVELS = os.environ.get("LOG_STAGE_LEVELS", "")
+# Share of records below WARNING that are written
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1"))
+# Longest string written per field, longer ones are cut
+LOG_MAX_FIELD = int(os.environ.get("LOG_MAX_FIELD", "1000"))
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = 10000
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# attributes every LogRecord has, anything else was passed in ``extra``
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _stage_levels(text: str) -> dict:
+    levels = {}
+    for item in text.split(","):
+        if "=" in item:
+            stage, level = item.split("=", 1)
+            levels[stage.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def _truncate(value, limit: int = LOG_MAX_FIELD):
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}... ({len(value)} chars)"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, and the
+    fields passed in ``extra`` such as ``chat_id``, ``stage`` and
+    ``latency_ms``. Long strings are cut to ``LOG_MAX_FIELD`` characters."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = _truncate(value)
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic line format with long messages cut."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = _truncate(record.message)
+        return super().formatMessage(record)
+
+
+class _SamplingFilter(logging.Filter):
+    """Per stage levels and sampling, applied before a record is queued."""
+
+    def __init__(self, level: int, stage_levels: dict, sample_rate: float) -> None:
+        super().__init__()
+        self.level = level
+        self.stage_levels = stage_levels
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        level = self.stage_levels.get(getattr(record, "stage", None), self.level)
+        if record.levelno < level:
+            return False
+        if record.levelno < logging.WARNING and self.sample_rate < 1:
+            return random.random() < self.sample_rate
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread and never waits for it.
+
+    Formatting, tracebacks included, is left to the writer thread; only the
+    message arguments are merged here. A full queue drops the record.
+    """
+
+    # records lost to a full queue, see ``dropped_records``
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
+
+
+def dropped_records() -> int:
+    return _NonBlockingQueueHandler.dropped
+
+
+def _setup() -> logging.Logger:
+    stream = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(TextFormatter(TEXT_FORMAT))
+
+    level = logging.getLevelName(LOG_LEVEL)
+    stage_levels = _stage_levels(LOG_STAGE_LEVELS)
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _NonBlockingQueueHandler(records)
+    handler.addFilter(_SamplingFilter(level, stage_levels, LOG_SAMPLE_RATE))
+    listener = QueueListener(records, stream)
+    listener.start()
+    # write what is still queued before the process exits
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    # a stage may log below LOG_LEVEL, the filter keeps the rest out
+    root.setLevel(min([level, *stage_levels.values()]))
+    root.addHandler(handler)
+    return logging.getLogger(BOT_NAME)
+
+
+logger = _setup()
@@ -0,0 +1,23 @@
+import time
+
+# Taken when the bot's first module is imported, before the heavy ones
+PROCESS_START = time.monotonic()
+
+_ready_after = None
+
+
+def mark_ready() -> float:
+    """Record that updates can be served, returns the seconds it took."""
+    global _ready_after
+    if _ready_after is None:
+        _ready_after = time.monotonic() - PROCESS_START
+    return _ready_after
+
+
+def is_ready() -> bool:
+    return _ready_after is not None
+
+
+def startup_seconds() -> float:
+    """Seconds from import to ready, 0 until then."""
+    return _ready_after or 0.0
@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+from storage import archive_reader
+from storage.archive_reader import _iter_json_array
+
+RECORDS = [
+    {"role": "user", "content": "hi, [not] the end", "chat_id": 1},
+    {"role": "assistant", "content": "画 {}", "chat_id": 1},
+    {"role": "user", "content": "x" * 100, "chat_id": 2},
+]
+
+
+def read(data: str):
+    return list(_iter_json_array(io.BytesIO(data.encode("utf-8"))))
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # items and multi-byte characters cross the chunk boundaries
+    monkeypatch.setattr(archive_reader, "READ_CHUNK", 7)
+
+
+@pytest.mark.usefixtures("small_chunks")
+@pytest.mark.parametrize(
+    "data",
+    [
+        json.dumps(RECORDS),
+        json.dumps(RECORDS, indent=2, ensure_ascii=False),
+        "  \n" + json.dumps(RECORDS, separators=(",", ":")) + "\n",
+    ],
+)
+def test_items_are_read_across_chunks(data):
+    assert read(data) == RECORDS
+
+
+def test_empty_array():
+    assert read("[]") == []
+    assert read(" [ \n ] ") == []
+
+
+def test_not_an_array():
+    with pytest.raises(ValueError):
+        read('{"role": "user"}')
+
+
+@pytest.mark.usefixtures("small_chunks")
+def test_truncated_array():
+    data = json.dumps(RECORDS)
+    with pytest.raises(ValueError):
+        read(data[:-1])
+    with pytest.raises(ValueError):
+        read(data[: len(data) // 2])
@@ -0,0 +1,47 @@
+import json
+from datetime import datetime
+
+from chat import ChatMessage
+from constants import ChatType, Role
+
+
+def test_encode_round_trips_every_field():
+    message = ChatMessage(
+        role=Role.ASSISTANT,
+        username="dali",
+        content="here is your cat",
+        timestamp=1700000000,
+        type=ChatType.IMAGE,
+        image_url="https://example.com/cat.png",
+        image_ref="ab/cd.png",
+        tokens=12,
+    )
+    decoded = ChatMessage.decode(message.encode())
+    assert decoded.jsonify_full() == message.jsonify_full()
+    assert decoded.role is Role.ASSISTANT
+    assert decoded.type is ChatType.IMAGE
+
+
+def test_encode_leaves_out_empty_fields():
+    message = ChatMessage(role=Role.USER, content="hi", timestamp=1700000000)
+    assert json.loads(message.encode()) == {"r": "user", "t": 1700000000, "c": "hi"}
+
+
+def test_encode_keeps_non_ascii_text():
+    message = ChatMessage(role=Role.USER, content="画一只猫", timestamp=1)
+    assert "画一只猫" in message.encode()
+    assert ChatMessage.decode(message.encode()).content == "画一只猫"
+
+
+def test_decode_reads_full_records():
+    message = ChatMessage(role=Role.USER, username="u", content="hi", timestamp=5)
+    decoded = ChatMessage.decode(json.dumps(message.jsonify_full()))
+    assert decoded.jsonify_full() == message.jsonify_full()
+
+
+def test_from_json_reads_old_string_timestamps():
+    decoded = ChatMessage.from_json(
+        {"role": "user", "content": "hi", "timestamp": "20240102_030405"}
+    )
+    assert decoded.timestamp == int(datetime(2024, 1, 2, 3, 4, 5).timestamp())
+    assert decoded.type is ChatType.TEXT
@@ -0,0 +1,61 @@
+import asyncio
+
+from telegram_bot.coalescer import MessageCoalescer
+
+
+def new_coalescer(**kwargs) -> MessageCoalescer:
+    coalescer = MessageCoalescer.__new__(MessageCoalescer)
+    coalescer.__init__(**kwargs)
+    return coalescer
+
+
+async def send_after(coalescer, delay, chat_id, text, user_id=None):
+    await asyncio.sleep(delay)
+    return await coalescer.collect(chat_id, text, user_id)
+
+
+def test_burst_is_merged_into_the_first_message():
+    async def main():
+        coalescer = new_coalescer(window=0.1, max_wait=1, grace=0.05)
+        return await asyncio.gather(
+            send_after(coalescer, 0, 1, "hello"),
+            send_after(coalescer, 0.02, 1, "how are"),
+            send_after(coalescer, 0.08, 1, "you"),
+        )
+
+    assert asyncio.run(main()) == ["hello\nhow are\nyou", None, None]
+
+
+def test_lone_message_is_answered_after_the_grace_period():
+    async def main():
+        coalescer = new_coalescer(window=5, max_wait=10, grace=0.01)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        text = await coalescer.collect(1, "hi")
+        return text, loop.time() - start
+
+    text, waited = asyncio.run(main())
+    assert text == "hi"
+    assert waited < 1
+
+
+def test_senders_in_a_group_get_their_own_bursts():
+    async def main():
+        coalescer = new_coalescer(window=0.1, max_wait=1, grace=0.05)
+        return await asyncio.gather(
+            send_after(coalescer, 0, -100, "from alice", user_id=1),
+            send_after(coalescer, 0.01, -100, "from bob", user_id=2),
+            send_after(coalescer, 0.02, -100, "alice again", user_id=1),
+        )
+
+    assert asyncio.run(main()) == ["from alice\nalice again", "from bob", None]
+
+
+def test_zero_window_answers_every_message():
+    async def main():
+        coalescer = new_coalescer(window=0, max_wait=1)
+        return await asyncio.gather(
+            coalescer.collect(1, "a"), coalescer.collect(1, "b")
+        )
+
+    assert asyncio.run(main()) == ["a", "b"]
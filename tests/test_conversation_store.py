@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+from chat import ChatMessage
+from constants import Role
+from llm_models.conversation_store import ConversationStore
+from state import MemoryStateBackend
+
+
+def new_store(**kwargs) -> ConversationStore:
+    store = ConversationStore.__new__(ConversationStore)
+    store.__init__(backend=MemoryStateBackend(), **kwargs)
+    store.summarizer = SimpleNamespace(schedule=lambda store, history: None)
+    return store
+
+
+async def turn(store, chat_id, log, delay=0.02, content="hi"):
+    async with store.session(chat_id) as history:
+        log.append(("start", chat_id))
+        await asyncio.sleep(delay)
+        history.insert(ChatMessage(role=Role.USER, content=content))
+        log.append(("end", chat_id))
+
+
+def test_turns_of_one_chat_run_in_order():
+    async def main():
+        store, log = new_store(), []
+        await asyncio.gather(turn(store, 1, log), turn(store, 1, log))
+        return log
+
+    assert asyncio.run(main()) == [("start", 1), ("end", 1)] * 2
+
+
+def test_turns_of_different_chats_run_in_parallel():
+    async def main():
+        store, log = new_store(), []
+        await asyncio.gather(turn(store, 1, log), turn(store, 2, log))
+        return log
+
+    assert asyncio.run(main())[:2] == [("start", 1), ("start", 2)]
+
+
+def test_least_recently_used_chat_is_evicted():
+    async def main():
+        store, log = new_store(max_chats=2), []
+        await turn(store, 1, log, delay=0)
+        await turn(store, 2, log, delay=0)
+        await turn(store, 1, log, delay=0)
+        await turn(store, 3, log, delay=0)
+        return store
+
+    store = asyncio.run(main())
+    assert (1 in store, 2 in store, 3 in store) == (True, False, True)
+
+
+def test_eviction_by_bytes_keeps_the_total_in_step():
+    async def main():
+        store, log = new_store(max_bytes=1000), []
+        for chat_id in range(5):
+            await turn(store, chat_id, log, delay=0, content="x" * 300)
+        return store
+
+    store = asyncio.run(main())
+    assert 0 < len(store) < 5
+    assert store.total_bytes <= 1000
+    assert store.total_bytes == sum(
+        store.get(chat_id).size_bytes for chat_id in range(5) if chat_id in store
+    )
+
+
+def test_chat_with_a_running_turn_is_not_evicted():
+    async def main():
+        store, log = new_store(max_chats=1), []
+        running = asyncio.create_task(turn(store, 1, log, delay=0.05))
+        await asyncio.sleep(0.01)
+        await turn(store, 2, log, delay=0)
+        kept = 1 in store
+        await running
+        return kept
+
+    assert asyncio.run(main())
+
+
+def test_reset_waits_for_the_running_turn():
+    async def main():
+        store, log = new_store(), []
+        running = asyncio.create_task(turn(store, 1, log, delay=0.05))
+        await asyncio.sleep(0.01)
+        await store.reset(1)
+        log.append(("reset", 1))
+        await running
+        return store, log
+
+    store, log = asyncio.run(main())
+    assert log == [("start", 1), ("end", 1), ("reset", 1)]
+    assert 1 not in store and store.total_bytes == 0
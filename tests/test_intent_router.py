@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from constants import Intent
+from llm_models.intent_router import RuleStage
+
+
+def classify(text: str, edit: bool = False):
+    decision = asyncio.run(RuleStage().classify(text, edit))
+    return None if decision is None else decision.intent
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "draw a cat",
+        "please make a picture of a dog",
+        "I want you to draw a horse",
+        "画一只猫",
+    ],
+)
+def test_obvious_image_requests(text):
+    assert classify(text) == Intent.IMAGE
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "what is the capital of France",
+        "tell me a joke",
+        "hi",
+        "thanks!",
+        "why does `x += 1` fail here?",
+        "def add(a, b):\n    return a + b",
+    ],
+)
+def test_clear_chat(text):
+    assert classify(text) == Intent.TEXT
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # image requests the rules can't settle are left to a model
+        "can you draw a cat",
+        "Could you draw me a dog please",
+        "generate a sunset",
+        "create a sunset over the mountains",
+        "make a cute cat for me",
+        "a dog in a space suit",
+        "Dessine-moi un mouton",
+        "Bonjour",
+        # talks about images without asking for one
+        "how do I draw a circle in OpenGL?",
+        "I paint on weekends",
+    ],
+)
+def test_unclear_texts_go_to_a_model(text):
+    assert classify(text) is None
+
+
+def test_captions():
+    assert classify("make it black and white", edit=True) == Intent.EDIT
+    assert classify("what is in this photo?", edit=True) == Intent.TEXT
+    assert classify("a sunny day", edit=True) is None
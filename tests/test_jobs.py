@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from jobs import IMAGE, Job, JobQueue, JobQueueFullError, JobStore
+
+
+def new_queue(tmp_path, **kwargs) -> JobQueue:
+    queue = JobQueue.__new__(JobQueue)
+    queue.__init__(store=JobStore(str(tmp_path / "jobs.db")), **kwargs)
+    return queue
+
+
+def new_job(chat_id=1) -> Job:
+    return Job(chat_id, IMAGE, "a cat", "dall-e-3")
+
+
+def test_cancel_stops_running_and_queued_jobs(tmp_path):
+    async def main():
+        queue = new_queue(tmp_path, workers=1)
+        started = asyncio.Event()
+        finished = []
+
+        async def runner(job):
+            started.set()
+            await asyncio.sleep(10)
+            finished.append(job.id)
+
+        queue.bind(runner)
+        await queue.submit(new_job())
+        await queue.submit(new_job())
+        await started.wait()
+        cancelled = await queue.cancel(1)
+        await asyncio.sleep(0)
+        pending = await queue.store.pending()
+        await queue.close(timeout=1)
+        return queue, cancelled, finished, pending
+
+    queue, cancelled, finished, pending = asyncio.run(main())
+    assert len(cancelled) == 2
+    assert queue.cancelled == 2
+    assert (queue.queued, queue.running) == (0, 0)
+    assert finished == [] and pending == []
+
+
+def test_close_waits_for_the_jobs(tmp_path):
+    async def main():
+        queue = new_queue(tmp_path, workers=2)
+        finished = []
+
+        async def runner(job):
+            await asyncio.sleep(0.02)
+            finished.append(job.id)
+
+        queue.bind(runner)
+        jobs = [new_job(chat_id) for chat_id in range(3)]
+        for job in jobs:
+            await queue.submit(job)
+        await queue.close(timeout=5)
+        return queue, jobs, finished, await queue.store.pending()
+
+    queue, jobs, finished, pending = asyncio.run(main())
+    assert sorted(finished) == sorted(job.id for job in jobs)
+    assert queue.done == 3
+    assert pending == []
+
+
+def test_close_keeps_unfinished_jobs_for_resume(tmp_path):
+    async def main():
+        queue = new_queue(tmp_path, workers=1)
+
+        async def runner(job):
+            await asyncio.sleep(10)
+
+        queue.bind(runner)
+        job = new_job()
+        await queue.submit(job)
+        await queue.close(timeout=0.05)
+        return job, await queue.store.pending()
+
+    job, pending = asyncio.run(main())
+    assert [stored.id for stored in pending] == [job.id]
+
+
+def test_failures_are_reported(tmp_path):
+    async def main():
+        queue = new_queue(tmp_path, workers=1)
+        reported = []
+
+        async def runner(job):
+            raise RuntimeError("boom")
+
+        async def on_failure(job, error):
+            reported.append((job.id, str(error)))
+
+        queue.bind(runner, on_failure)
+        job = new_job()
+        await queue.submit(job)
+        await queue.close(timeout=1)
+        return queue, job, reported, await queue.store.pending()
+
+    queue, job, reported, pending = asyncio.run(main())
+    assert reported == [(job.id, "boom")]
+    assert queue.failed == 1
+    assert pending == []
+
+
+def test_submit_refuses_jobs_over_the_limits(tmp_path):
+    async def main():
+        queue = new_queue(tmp_path, workers=1, max_queued=3, max_per_chat=2)
+
+        async def runner(job):
+            await asyncio.sleep(10)
+
+        queue.bind(runner)
+        await queue.submit(new_job(1))
+        await queue.submit(new_job(1))
+        with pytest.raises(JobQueueFullError) as per_chat:
+            await queue.submit(new_job(1))
+        await queue.submit(new_job(2))
+        await queue.submit(new_job(3))
+        await asyncio.sleep(0)
+        with pytest.raises(JobQueueFullError) as total:
+            await queue.submit(new_job(4))
+        await queue.cancel(1)
+        await queue.cancel(2)
+        await queue.cancel(3)
+        await queue.close(timeout=1)
+        return per_chat.value.scope, total.value.scope
+
+    assert asyncio.run(main()) == ("chat 1", "the bot")
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from metrics.server import ROUTES, mount_metrics
+
+
+class FakeApp:
+    def __init__(self) -> None:
+        self.handlers = []
+
+    def add_handlers(self, host_pattern, routes):
+        self.handlers.append((host_pattern, routes))
+
+
+def test_routes_are_added_to_the_webhook_app():
+    app = FakeApp()
+    updater = SimpleNamespace(
+        _httpd=SimpleNamespace(_http_server=SimpleNamespace(request_callback=app))
+    )
+    assert mount_metrics(updater)
+    assert app.handlers == [(r".*", ROUTES)]
+
+
+def test_missing_internals_are_reported_not_raised():
+    assert not mount_metrics(SimpleNamespace())
+    assert not mount_metrics(SimpleNamespace(_httpd=None))
+    assert not mount_metrics(
+        SimpleNamespace(_httpd=SimpleNamespace(_http_server=SimpleNamespace()))
+    )
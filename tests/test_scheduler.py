@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from scheduler import OutboundScheduler, Priority, SchedulerBusyError, TokenBucket
+from scheduler.scheduler import Lane
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_token_bucket_delay_does_not_take_tokens():
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.delay(2) == 0
+    assert bucket.delay(2) == 0
+    assert bucket.try_acquire(2) == 0
+    assert bucket.delay(1) > 0
+
+
+def test_full_lane_rejects_a_burst_over_the_rate_limit():
+    async def main():
+        lane = Lane("chat", 2, 2, rpm=60)
+        results = await asyncio.gather(
+            *(asyncio.wait_for(lane.acquire(), 0.2) for _ in range(50)),
+            return_exceptions=True,
+        )
+        return lane, results
+
+    lane, results = run(main())
+    rejected = [r for r in results if isinstance(r, SchedulerBusyError)]
+    accepted = [r for r in results if r is None]
+    # one call fits the bucket, two wait in the queue, the rest fail fast
+    assert len(accepted) == 1
+    assert len(rejected) == 47
+    assert lane.queued == 0
+
+
+def test_callers_waiting_for_the_rate_count_as_queued():
+    async def main():
+        lane = Lane("chat", 10, 5, rpm=60)
+        await lane.acquire()
+        waiters = [asyncio.create_task(lane.acquire()) for _ in range(3)]
+        await asyncio.sleep(0)
+        queued = lane.queued
+        for task in waiters:
+            task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return queued, lane.queued
+
+    assert run(main()) == (3, 0)
+
+
+def test_queue_is_served_by_priority():
+    async def main():
+        lane = Lane("images", 1, 10)
+        await lane.acquire()
+        order = []
+
+        async def call(name, priority):
+            await lane.acquire(priority)
+            order.append(name)
+            lane.release()
+
+        tasks = [
+            asyncio.create_task(call("low", Priority.LOW)),
+            asyncio.create_task(call("normal", Priority.NORMAL)),
+            asyncio.create_task(call("high", Priority.HIGH)),
+        ]
+        await asyncio.sleep(0)
+        lane.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(main()) == ["high", "normal", "low"]
+
+
+def test_rate_limited_queue_is_served_by_priority():
+    async def main():
+        lane = Lane("chat", 10, 10)
+        # ten calls a second without burst, the next call waits about 0.1s
+        lane._requests = TokenBucket(10, 1)
+        await lane.acquire()
+        order = []
+
+        async def call(name, priority):
+            await lane.acquire(priority)
+            order.append(name)
+
+        low = asyncio.create_task(call("low", Priority.LOW))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(call("high", Priority.HIGH))
+        await asyncio.gather(low, high)
+        return order
+
+    assert run(main()) == ["high", "low"]
+
+
+def test_cancelled_waiter_gives_its_place_back():
+    async def main():
+        lane = Lane("chat", 1, 1)
+        await lane.acquire()
+        waiter = asyncio.create_task(lane.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusyError):
+            await lane.acquire()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        lane.release()
+        await lane.acquire()
+        return lane.active, lane.queued
+
+    assert run(main()) == (1, 0)
+
+
+def test_slot_counts_rejections():
+    async def main():
+        scheduler = OutboundScheduler.__new__(OutboundScheduler)
+        scheduler.__init__({"chat": (1, 0, 0, 0)})
+        async with scheduler.slot("chat"):
+            with pytest.raises(SchedulerBusyError):
+                async with scheduler.slot("chat"):
+                    pass
+        return scheduler.rejected
+
+    assert run(main()) == {"chat": 1}
+
+
+def test_run_retries_and_returns_the_result():
+    async def main():
+        scheduler = OutboundScheduler.__new__(OutboundScheduler)
+        scheduler.__init__({"chat": (1, 1, 0, 0)})
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                from telegram.error import RetryAfter
+
+                raise RetryAfter(0)
+            return "ok"
+
+        result = await scheduler.run("chat", flaky)
+        return result, len(calls), scheduler.retries, scheduler.lanes["chat"].active
+
+    assert run(main()) == ("ok", 2, {"chat": 1}, 0)